@@ -0,0 +1,72 @@
+"""
+Functions to crop the deformation to the region disturbed by the landslide (active region)
+
+The landslide only deforms a small part of the target grid. The active region is the union,
+over all frames, of the cells where |deformation| > crop_threshold (m), as a bounding box
+(rows, cols) of the grid, plus a halo of crop_halo metres on every side. The halo must cover the
+spreading of the deformation by the Kajiura filter (a few times the water depth); engine 'native'
+widens it to the support of the filter (see kajiura_window in py/intmod_native.py).
+ - engine 'native' (see py/intmod_native.py) finds the active region on the BingClaw grid
+   (target_window), interpolates and filters only the target cells inside it (the Kajiura
+   filter zero-pads the window by its support, see py/kajiura.py) and writes the deformation
+   file on the cropped grid
+ - crop_deformation (py/remove_first_timestep.py) crops an existing deformation file (e.g.
+   written by the Interface Module or by stream_interface_module), reading it in slabs of timesteps
+Values outside the active region are below crop_threshold before filtering, so they are taken
+as zero. The deformation file covers the active region only; the bathymetry file is unchanged.
+
+Input needed:
+ - crop_threshold       # Deformation (m) above which a cell belongs to the active region (None: no cropping)
+ - crop_halo            # Distance (m) added around the active region (default 5000)
+"""
+
+import numpy as np
+
+CROP_HALO = 5000.0
+
+
+def footprint(frames, threshold, slab_size=10):
+    """Return the bounding box (rows, cols) of the cells where |frames| > threshold in any frame, or None"""
+    active = np.zeros(frames.shape[1:], dtype=bool)
+    for start in range(0, frames.shape[0], slab_size):
+        slab = np.ma.filled(np.ma.asarray(frames[start:start + slab_size]), 0.0)
+        active |= (np.abs(slab) > threshold).any(axis=0)
+    rows, cols = np.flatnonzero(active.any(axis=1)), np.flatnonzero(active.any(axis=0))
+    if len(rows) == 0:
+        return None
+    return slice(int(rows[0]), int(rows[-1]) + 1), slice(int(cols[0]), int(cols[-1]) + 1)
+
+
+def add_halo(window, shape, halo_rows, halo_cols):
+    """Return window (rows, cols) extended by halo_rows, halo_cols cells on every side, within a grid of shape"""
+    rows, cols = window
+    return (slice(max(rows.start - halo_rows, 0), min(rows.stop + halo_rows, shape[0])),
+            slice(max(cols.start - halo_cols, 0), min(cols.stop + halo_cols, shape[1])))
+
+
+def halo_cells(halo, dx, dy):
+    """Return the halo (m) as a number of rows and columns of a grid with spacing dx, dy (m)"""
+    return int(np.ceil(halo / dy)), int(np.ceil(halo / dx))
+
+
+def target_window(x_source, y_source, window, lon, lat, halo_rows, halo_cols):
+    """Return the window (rows, cols) of the target grid lon, lat covering the window of the source grid
+    x_source, y_source (with the source cells around it, used by the bilinear interpolation) plus the halo"""
+    rows, cols = window
+    x0, x1 = x_source[max(cols.start - 1, 0)], x_source[min(cols.stop, len(x_source) - 1)]
+    y0, y1 = y_source[max(rows.start - 1, 0)], y_source[min(rows.stop, len(y_source) - 1)]
+    target = (slice(int(np.searchsorted(lat, y0, 'left')), int(np.searchsorted(lat, y1, 'right'))),
+              slice(int(np.searchsorted(lon, x0, 'left')), int(np.searchsorted(lon, x1, 'right'))))
+    return add_halo(target, (len(lat), len(lon)), halo_rows, halo_cols)
+
+
+def window_weights(weights, window, shape):
+    """Return the rows of the interpolation operator weights (see py/interp_weights.py) of the target cells in window"""
+    rows, cols = window
+    jj, ii = np.meshgrid(np.arange(rows.start, rows.stop), np.arange(cols.start, cols.stop), indexing='ij')
+    return weights[np.ravel_multi_index((jj.ravel(), ii.ravel()), shape)]
+
+
+def window_size(window):
+    rows, cols = window
+    return (rows.stop - rows.start) * (cols.stop - cols.start)
@@ -0,0 +1,357 @@
+"""
+Script to benchmark the CPU stages of the workflow on synthetic data
+
+For every grid size (number of cells of the BingClaw grid and of the target grid), synthetic
+BingClaw frames and a synthetic bathymetry are created (see py/synthetic.py) and these
+benchmarks are timed, each repeat times:
+ - run_bingclaw:              rendering of setrun.py, staging of the inputs and a fake container
+                              ('docker' script that links the synthetic frames into the run directory)
+ - interface_module_cold:     run_interface_module with engine 'native', target grid and interpolation weights built
+ - interface_module_warm:     same, with target grid and interpolation weights already in memory
+ - remove_first_timestep:     rewrite of the deformation file without its first timestep
+ - interface_module_at_rest:  run_interface_module with engine 'native' on nframes frames followed by nframes frames
+                              at rest (see write_resting_frames)
+ - frame_selection:           same, converting only the frames changed by more than FRAME_TOLERANCE (see py/frame_selection.py)
+ - pack_deformation:          rewrite of the deformation file with PACK_STORAGE (compressed, single precision)
+ - read_deformation:          read of the packed deformation file one time step at a time, as T-HySEA does
+ - kajiura_fft:               run_interface_module with engine 'native' and the Kajiura filter in the frequency
+                              domain (transfer functions cached after the first repeat)
+ - kajiura_direct:            same, with the reference Kajiura filter in space (only up to KAJIURA_DIRECT_CELLS cells)
+                              After the benchmarks of such a case, check_kajiura filters the deformation with both
+                              methods and stops the benchmarks if they differ by more than TOLERANCE (see py/kajiura.py)
+ - kajiura_cropped:           kajiura_fft restricted to the active region (deformation above CROP_THRESHOLD plus
+                              CROP_HALO, see py/active_region.py)
+ - variants:                  run_interface_module with engine 'native' for 4 variants (resolution and 2 x resolution,
+                              filter 'none' and 'kajiura') of the same frames, read once, on VARIANT_WORKERS threads
+                              (see py/variants.py)
+ - run_hysea:                 rendering of the T-HySEA input file and a fake T-HySEA ('mpirun' and
+                              executable scripts that only read the list of simulations)
+ - extract_pois:              extraction of the time series at 98 POIs from a synthetic T-HySEA output grid
+                              with nframes timesteps
+ - aggregate_hazard:          hazard maps of HAZARD_SCENARIOS scenarios (copies of the synthetic T-HySEA output grid)
+ - render_sweep:              rendering of RENDER_INPUTS setrun.py and T-HySEA input files with
+                              numeric parameters changing from one input to the next, as in a sweep table
+Every record has wall time, CPU time, peak RSS, bytes read and written and the time of the
+steps of the benchmark (see py/instrument.py). Results are saved as JSON in
+<bench_dir>/results_<revision>_<date>.json; compare_results lists the benchmarks that got
+slower between two results files.
+
+Input needed:
+ - sizes            # Number of cells of the grids (e.g. [1e4, 1e5, 1e6, 1e7])
+ - nframes          # Number of BingClaw frames
+ - output_format    # Format of the synthetic BingClaw frames: 'ascii' or 'binary'
+ - resolution       # Resolution of the grids (m)
+ - repeat           # Number of times each benchmark is run (the fastest run is reported)
+ - bench_dir        # Directory where synthetic data, fakes and results are written
+"""
+
+import os
+import sys
+import json
+import shutil
+import platform
+import subprocess
+import numpy as np
+from datetime import datetime
+from netCDF4 import Dataset
+
+import py.intmod_native as intmod_native
+import py.interp_weights as interp_weights
+from py.synthetic import write_frames, write_resting_frames, write_bathymetry, write_pois, write_hysea_output
+from py.instrument import measure
+from py.run_bingclaw import run_bingclaw
+from py.run_interface_module import run_interface_module
+from py.remove_first_timestep import remove_first_timestep, pack_deformation
+from py.run_hysea import run_hysea
+from py.poi_series import extract_pois
+from py.hazard import aggregate_hazard
+from py.render import render_file, SETRUN_PLACEHOLDERS, HYSEA_PLACEHOLDERS
+from py.variants import expand_variants, load_frames, run_variants
+from py.kajiura import check_tolerance, TOLERANCE as KAJIURA_TOLERANCE
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREFIX = 'bench'
+RENDER_INPUTS = 10000
+HAZARD_SCENARIOS = 4
+KAJIURA_DIRECT_CELLS = 1e5
+FRAME_TOLERANCE = 0.01
+VARIANT_WORKERS = 4
+CROP_THRESHOLD, CROP_HALO = 0.01, 2000.0
+PACK_STORAGE = {'complevel': 4, 'dtype': 'f4', 'digits': 4}
+
+FAKES = {
+    # Container: link the synthetic frames ($BENCH_FRAMES) into the mounted run directory
+    'docker': '''#!/bin/bash
+while [ $# -gt 0 ]; do
+    case $1 in -v) run_dir=${2%%:/BingClaw/run}; shift ;; esac
+    shift
+done
+cp -l "$BENCH_FRAMES"/fort.* "$run_dir"/ 2>/dev/null || cp "$BENCH_FRAMES"/fort.* "$run_dir"/
+''',
+    # MPI launcher: run the command once
+    'mpirun': '''#!/bin/bash
+[ "$1" = "-np" ] && shift 2
+exec "$@"
+''',
+    # T-HySEA: read the list of simulations and their input files
+    'hysea': '''#!/bin/bash
+while read -r input_file; do cat "$input_file" > /dev/null; done < "$1"
+''',
+}
+
+
+class _Records:
+    """Collects the records of measure, in place of a Manifest"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.records = []
+
+    def add(self, record):
+        self.records.append(record)
+
+
+def write_fakes(bin_dir):
+    """Write the fake docker, mpirun and T-HySEA scripts in bin_dir"""
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, script in FAKES.items():
+        filename = os.path.join(bin_dir, name)
+        with open(filename, 'w') as f:
+            f.write(script)
+        os.chmod(filename, 0o755)
+
+
+def setup_case(case_dir, cells, nframes, output_format, resolution):
+    """Create synthetic inputs of a grid with cells cells in case_dir and return the paths used by the benchmarks"""
+    n = int(round(np.sqrt(cells)))
+    paths = {'bingclaw_input_dir': os.path.join(case_dir, 'bingclaw_inputs'),
+             'hysea_input_dir': os.path.join(case_dir, 'hysea_inputs'),
+             'frames_dir': os.path.join(case_dir, 'frames'),
+             'resting_frames_dir': os.path.join(case_dir, 'resting_frames'),
+             'bingclaw_output_dir': os.path.join(case_dir, 'run', 'bingclaw_out'),
+             'intmod_output_dir': os.path.join(case_dir, 'run', 'intmod_out'),
+             'hysea_output_dir': os.path.join(case_dir, 'run', 'hysea_out'),
+             'post_output_dir': os.path.join(case_dir, 'run', 'post_out'),
+             'render_dir': os.path.join(case_dir, 'run', 'render'),
+             'mx': n, 'my': n}
+    if os.path.exists(case_dir):
+        shutil.rmtree(case_dir)
+    for key in ('bingclaw_input_dir', 'hysea_input_dir', 'hysea_output_dir'):
+        os.makedirs(paths[key])
+    shutil.copy(os.path.join(REPO_DIR, 'inputs', 'bingclaw_inputs', 'setrun_template.py'), paths['bingclaw_input_dir'])
+    for fname in ('scenario.tt3', 'bathymetry.tt3'):
+        with open(os.path.join(paths['bingclaw_input_dir'], fname), 'w') as f:
+            f.write('synthetic\n')
+    for fname in ('hysea_input.template', 'hysea_input_ts.template'):
+        shutil.copy(os.path.join(REPO_DIR, 'inputs', 'hysea_inputs', fname), paths['hysea_input_dir'])
+    write_pois(os.path.join(paths['hysea_input_dir'], 'pois.dat'), n, n, resolution)
+    write_bathymetry(os.path.join(paths['hysea_input_dir'], 'bathymetry.nc'), n, n, resolution)
+    write_frames(paths['frames_dir'], n, n, nframes, resolution, output_format)
+    write_resting_frames(paths['resting_frames_dir'], paths['frames_dir'], nframes, nframes)
+    write_hysea_output(os.path.join(paths['hysea_output_dir'], f"{PREFIX}.nc"), n, n, nframes, resolution)
+    return paths
+
+
+def benchmarks(paths, resolution):
+    """Return the benchmarks of a case as (name, function, preparation) tuples"""
+    casename = os.path.join(paths['intmod_output_dir'], PREFIX)
+
+    def clear_memory():
+        intmod_native._target_grids.clear()
+        interp_weights._weights.clear()
+
+    def bingclaw():
+        return run_bingclaw(paths['bingclaw_input_dir'], paths['bingclaw_output_dir'], 'bathymetry.tt3', 'scenario.tt3',
+                            'docker', 'bingclaw-fake')
+
+    def interface_module(filter_type='none', kajiura_method='fft', frames_dir=paths['frames_dir'], frame_tolerance=None,
+                         crop_threshold=None):
+        return run_interface_module(frames_dir, paths['intmod_output_dir'], paths['hysea_input_dir'], 'bingclaw',
+                                    'bathymetry.nc', resolution, filter_type, casename, skip_frames=1, engine='native',
+                                    kajiura_method=kajiura_method, frame_tolerance=frame_tolerance,
+                                    crop_threshold=crop_threshold, crop_halo=CROP_HALO)
+
+    def at_rest():
+        return interface_module(frames_dir=paths['resting_frames_dir'])
+
+    def frame_selection():
+        return interface_module(frames_dir=paths['resting_frames_dir'], frame_tolerance=FRAME_TOLERANCE)
+
+    def kajiura_fft():
+        return interface_module('kajiura', 'fft')
+
+    def kajiura_direct():
+        return interface_module('kajiura', 'direct')
+
+    def kajiura_cropped():
+        return interface_module('kajiura', 'fft', crop_threshold=CROP_THRESHOLD)
+
+    def convert_variant(variant, frames):
+        return run_interface_module(paths['frames_dir'], paths['intmod_output_dir'], paths['hysea_input_dir'], 'bingclaw',
+                                    'bathymetry.nc', variant['resolution'], variant['filter_type'],
+                                    os.path.join(paths['intmod_output_dir'], variant['filename_prefix']), skip_frames=1,
+                                    engine='native', shared_frames=frames)
+
+    def variants():
+        sweep = expand_variants([(resolution, 'none'), (resolution, 'kajiura'), (2 * resolution, 'none'), (2 * resolution, 'kajiura')])
+        failed = run_variants(sweep, convert_variant, VARIANT_WORKERS, load_frames(paths['frames_dir']))
+        return 0 if all(failure is None for failure in failed.values()) else 1
+
+    def first_timestep():
+        remove_first_timestep(paths['intmod_output_dir'], PREFIX)
+        return 0
+
+    def pack():
+        pack_deformation(paths['intmod_output_dir'], PREFIX, PACK_STORAGE)
+        return 0
+
+    def read_frames():
+        with Dataset(f"{casename}_deformation.nc") as ds:
+            for i in range(ds['z'].shape[0]):
+                ds['z'][i]
+        return 0
+
+    def hysea():
+        return run_hysea(paths['hysea_input_dir'], paths['hysea_output_dir'], paths['intmod_output_dir'], 'hysea',
+                         True, 'pois.dat', 'synthetic', PREFIX)
+
+    def pois():
+        extract_pois(paths['hysea_output_dir'], paths['post_output_dir'], PREFIX, os.path.join(paths['hysea_input_dir'], 'pois.dat'))
+        return 0
+
+    def hazard():
+        grid_file = os.path.join(paths['hysea_output_dir'], f"{PREFIX}.nc")
+        aggregate_hazard([grid_file] * HAZARD_SCENARIOS, os.path.join(paths['post_output_dir'], 'hazard.nc'))
+        return 0
+
+    def clear_render_dir():
+        if os.path.exists(paths['render_dir']):
+            shutil.rmtree(paths['render_dir'])
+        os.makedirs(paths['render_dir'])
+
+    def render_sweep():
+        setrun_template = os.path.join(paths['bingclaw_input_dir'], 'setrun_template.py')
+        hysea_template = os.path.join(paths['hysea_input_dir'], 'hysea_input_ts.template')
+        for i in range(RENDER_INPUTS // 2):
+            name = f"mscen_{i:05d}"
+            render_file(setrun_template, os.path.join(paths['render_dir'], f"setrun_{name}.py"),
+                        {'BATHYMETRY': 'bathymetry.tt3', 'SCENARIO': f"{name}.tt3", 'OUTPUT_FORMAT': 'binary'},
+                        SETRUN_PLACEHOLDERS, {'tfinal': 600 + i % 600, 'cfl_desired': 0.45})
+            render_file(hysea_template, os.path.join(paths['render_dir'], f"{name}.txt"),
+                        {'BATHYMETRY': 'bathymetry.nc', 'SCENARIO_NAME': name, 'HYSEA_OUTNAME': name,
+                         'DEFORMATION_FILE': f"{name}_deformation.nc", 'POIS_FILE': 'pois.dat'},
+                        HYSEA_PLACEHOLDERS, {'simulation_time': 3600 + i % 3600, 'manning': 0.03})
+        return 0
+
+    cases = [('run_bingclaw', bingclaw, None),
+             ('interface_module_cold', interface_module, clear_memory),
+             ('interface_module_warm', interface_module, None),
+             ('remove_first_timestep', first_timestep, interface_module),
+             ('interface_module_at_rest', at_rest, None),
+             ('frame_selection', frame_selection, None),
+             ('pack_deformation', pack, interface_module),
+             ('read_deformation', read_frames, None),
+             ('kajiura_fft', kajiura_fft, None)]
+    if paths['mx'] * paths['my'] <= KAJIURA_DIRECT_CELLS:
+        cases.append(('kajiura_direct', kajiura_direct, None))
+    cases.append(('kajiura_cropped', kajiura_cropped, None))
+    return cases + [('variants', variants, None),
+                    ('run_hysea', hysea, None),
+                    ('extract_pois', pois, None),
+                    ('aggregate_hazard', hazard, None),
+                    ('render_sweep', render_sweep, clear_render_dir)]
+
+
+def check_kajiura(paths, resolution):
+    """Filter the deformation of the case with Kajiura methods 'fft' and 'direct'; exit if they differ by more than the tolerance"""
+    casename = os.path.join(paths['intmod_output_dir'], PREFIX)
+    run_interface_module(paths['frames_dir'], paths['intmod_output_dir'], paths['hysea_input_dir'], 'bingclaw',
+                         'bathymetry.nc', resolution, 'none', casename, skip_frames=1, engine='native')
+    with Dataset(f"{casename}_deformation.nc") as ds:
+        deformation = np.ma.filled(ds['z'][:].astype(np.float64), 0.0)
+    lon, lat, z = intmod_native.target_grid(os.path.join(paths['hysea_input_dir'], 'bathymetry.nc'), resolution)
+    error = check_tolerance(deformation, *intmod_native.grid_spacing(lon, lat), -np.nan_to_num(z, nan=0.0))
+    print(f"  {'kajiura_tolerance':24s} {paths['mx'] * paths['my']:>10d} cells  {error:10.2e} (tolerance {KAJIURA_TOLERANCE})")
+    if error > KAJIURA_TOLERANCE:
+        sys.exit(f"Kajiura methods 'fft' and 'direct' differ by {error:.2e} of the largest deformation "
+                 f"for {paths['mx'] * paths['my']} cells (tolerance {KAJIURA_TOLERANCE})")
+    return error
+
+
+def revision():
+    """Return the git revision of the workflow (with '+' if there are uncommitted changes)"""
+    result = subprocess.run(['git', '-C', REPO_DIR, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+    if result.returncode != 0:
+        return 'unknown'
+    dirty = subprocess.run(['git', '-C', REPO_DIR, 'diff', '--quiet', 'HEAD', '--', 'py'])
+    return result.stdout.strip() + ('+' if dirty.returncode != 0 else '')
+
+
+def run_benchmarks(sizes, nframes=10, output_format='binary', resolution=100, repeat=3, bench_dir='benchmarks'):
+    print(f"* Executing run_benchmarks")
+    bench_dir = os.path.abspath(bench_dir)
+    bin_dir = os.path.join(bench_dir, 'fakes')
+    write_fakes(bin_dir)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+
+    results = []
+    for cells in sizes:
+        case_dir = os.path.join(bench_dir, f"case_{int(cells)}")
+        print(f"Creating synthetic data with {int(cells)} cells and {nframes} frames in {case_dir}")
+        paths = setup_case(case_dir, cells, nframes, output_format, resolution)
+        os.environ['BENCH_FRAMES'] = paths['frames_dir']
+
+        for name, function, prepare in benchmarks(paths, resolution):
+            records = _Records(case_dir)
+            for _ in range(repeat):
+                if prepare is not None:
+                    prepare()
+                with measure(name, records) as record:
+                    record['exit_code'] = function()
+            if any(record['exit_code'] != 0 for record in records.records):
+                sys.exit(f"Benchmark {name} failed for {int(cells)} cells (exit codes {[r['exit_code'] for r in records.records]})")
+            best = min(records.records, key=lambda record: record['wall_s'])
+            results.append({'benchmark': name, 'cells': paths['mx'] * paths['my'], 'nframes': nframes, 'output_format': output_format,
+                            'wall_s': best['wall_s'], 'wall_s_all': [record['wall_s'] for record in records.records],
+                            'cpu_s': best['cpu_s'], 'children_cpu_s': best['children_cpu_s'], 'peak_rss_mb': best['peak_rss_mb'],
+                            'bytes_read': best.get('bytes_read'), 'bytes_written': best.get('bytes_written'),
+                            'steps': {step: record['wall_s'] for step, record in best['steps'].items()}})
+            print(f"  {name:24s} {results[-1]['cells']:>10d} cells  {best['wall_s']:10.4f} s")
+        if paths['mx'] * paths['my'] <= KAJIURA_DIRECT_CELLS:
+            check_kajiura(paths, resolution)
+
+    output = {'revision': revision(), 'date': datetime.now().isoformat(timespec='seconds'),
+              'machine': platform.node(), 'cpus': os.cpu_count(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'repeat': repeat, 'resolution': resolution, 'results': results}
+    results_file = os.path.join(bench_dir, f"results_{output['revision']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(results_file, 'w') as f:
+        json.dump(output, f, indent=1)
+    print(f"* Benchmark results saved in {results_file}")
+    return results_file
+
+
+def compare_results(old_file, new_file, threshold=0.1):
+    """Print the change of wall time of every benchmark between two results files; return the ones slower by more than threshold"""
+    with open(old_file) as f:
+        old = {(r['benchmark'], r['cells'], r['output_format']): r for r in json.load(f)['results']}
+    with open(new_file) as f:
+        new = json.load(f)['results']
+
+    slower = []
+    print(f"{'benchmark':24s} {'cells':>10s} {'old (s)':>10s} {'new (s)':>10s} {'change':>8s}")
+    for result in new:
+        key = (result['benchmark'], result['cells'], result['output_format'])
+        if key not in old:
+            continue
+        change = result['wall_s'] / old[key]['wall_s'] - 1 if old[key]['wall_s'] > 0 else 0.0
+        flag = '  SLOWER' if change > threshold else ''
+        print(f"{key[0]:24s} {key[1]:>10d} {old[key]['wall_s']:10.4f} {result['wall_s']:10.4f} {change:+8.1%}{flag}")
+        if change > threshold:
+            slower.append((key, change))
+    return slower
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python -m py.benchmark <old results.json> <new results.json>")
+    sys.exit(1 if compare_results(sys.argv[1], sys.argv[2]) else 0)
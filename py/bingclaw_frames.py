@@ -0,0 +1,127 @@
+"""
+Functions to handle the output frames of a BingClaw simulation.
+Frame N of a BingClaw (Clawpack) run is made of the files fort.qNNNN (grid data),
+fort.tNNNN (time and sizes), and optionally fort.aNNNN (aux arrays) and fort.bNNNN (binary data).
+
+Frames can be in ASCII format (data in fort.q) or binary format (headers in fort.q, data in fort.b
+as float64 including ghost cells). Binary frames are memory mapped and returned as views of the
+file, without copying or parsing them.
+Only single-grid output (amr_levels_max = 1, as in setrun_template.py) can be read.
+
+Input needed:
+ - bingclaw_output_dir  # Bingclaw scenario output directory
+"""
+
+import os
+import re
+import shutil
+import numpy as np
+
+FRAME_FILE = re.compile(r'^fort\.([a-z])(\d{4})$')
+
+
+def frame_file(bingclaw_output_dir, kind, frame):
+    """Return the name of the file of a given kind ('q', 't', 'a', 'b') of a frame"""
+    return os.path.join(bingclaw_output_dir, f"fort.{kind}{frame:04d}")
+
+
+def list_frames(bingclaw_output_dir):
+    """Return the sorted list of frame numbers that have both a fort.q and a fort.t file"""
+    kinds = {}
+    for fname in os.listdir(bingclaw_output_dir):
+        match = FRAME_FILE.match(fname)
+        if match:
+            kinds.setdefault(int(match.group(2)), set()).add(match.group(1))
+    return sorted(frame for frame, k in kinds.items() if {'q', 't'} <= k)
+
+
+def stage_frames(bingclaw_output_dir, frames_dir, frames, times=None):
+    """
+    Create frames_dir as a view of bingclaw_output_dir that contains only the given frames, renumbered from 0.
+    Frame i of the view has the data files (fort.q, fort.a, fort.b) of frame frames[i] and
+    the time file (fort.t) of frame times[i] (by default, of frames[i] too).
+    All the other files in bingclaw_output_dir (e.g. claw.data) are linked unchanged.
+    Files are symbolic links, so nothing is copied.
+    """
+    if times is None:
+        times = frames
+    if len(times) != len(frames):
+        raise ValueError(f"Got {len(frames)} frames but {len(times)} times")
+
+    if os.path.exists(frames_dir):
+        shutil.rmtree(frames_dir)
+    os.makedirs(frames_dir)
+
+    source_dir = os.path.abspath(bingclaw_output_dir)
+    for fname in os.listdir(source_dir):
+        if not FRAME_FILE.match(fname):
+            os.symlink(os.path.join(source_dir, fname), os.path.join(frames_dir, fname))
+
+    for i, (frame, time) in enumerate(zip(frames, times)):
+        for kind in ('q', 'a', 'b'):
+            source = frame_file(source_dir, kind, frame)
+            if os.path.exists(source):
+                os.symlink(source, frame_file(frames_dir, kind, i))
+        os.symlink(frame_file(source_dir, 't', time), frame_file(frames_dir, 't', i))
+    return frames_dir
+
+
+def _read_header(filename, names):
+    # Header lines are 'value    name'; Fortran may write exponents with D
+    values = {}
+    with open(filename) as f:
+        for name in names:
+            line = f.readline().split()
+            if not line:
+                break
+            values[name] = float(line[0].replace('D', 'E').replace('d', 'e'))
+    return values
+
+
+def read_frame_time(bingclaw_output_dir, frame):
+    """Return the contents of the fort.t file of a frame (time, num_eqn, num_grids, num_aux, num_dim, num_ghost)"""
+    header = _read_header(frame_file(bingclaw_output_dir, 't', frame), ['time', 'num_eqn', 'num_grids', 'num_aux', 'num_dim', 'num_ghost'])
+    return {k: (v if k == 'time' else int(v)) for k, v in header.items()}
+
+
+def read_frame_grid(bingclaw_output_dir, frame):
+    """Return the grid of a frame (mx, my, xlow, ylow, dx, dy) read from the header of its fort.q file"""
+    header = _read_header(frame_file(bingclaw_output_dir, 'q', frame), ['grid_number', 'AMR_level', 'mx', 'my', 'xlow', 'ylow', 'dx', 'dy'])
+    grid = {k: header[k] for k in ('xlow', 'ylow', 'dx', 'dy')}
+    grid['mx'], grid['my'] = int(header['mx']), int(header['my'])
+    return grid
+
+
+def grid_centres(grid):
+    """Return the x and y coordinates of the cell centres of a grid"""
+    x = grid['xlow'] + (np.arange(grid['mx']) + 0.5) * grid['dx']
+    y = grid['ylow'] + (np.arange(grid['my']) + 0.5) * grid['dy']
+    return x, y
+
+
+def frame_format(bingclaw_output_dir, frame):
+    """Return the format of a frame: 'binary' if it has a fort.b file, 'ascii' otherwise"""
+    return 'binary' if os.path.exists(frame_file(bingclaw_output_dir, 'b', frame)) else 'ascii'
+
+
+def read_frame(bingclaw_output_dir, frame):
+    """Return the solution q of a frame as an array (num_eqn, my, mx); for binary frames this is a read-only view of the file"""
+    info = read_frame_time(bingclaw_output_dir, frame)
+    if info['num_grids'] != 1:
+        raise ValueError(f"Frame {frame} in {bingclaw_output_dir} has {info['num_grids']} grids, only single-grid output can be read")
+    grid = read_frame_grid(bingclaw_output_dir, frame)
+    meqn, mx, my = info['num_eqn'], grid['mx'], grid['my']
+
+    if frame_format(bingclaw_output_dir, frame) == 'binary':
+        # Fortran-ordered (num_eqn, mx + 2*num_ghost, my + 2*num_ghost) array of float64
+        ng = info.get('num_ghost', 2)
+        q = np.memmap(frame_file(bingclaw_output_dir, 'b', frame), dtype='<f8', mode='r',
+                      shape=(meqn, mx + 2 * ng, my + 2 * ng), order='F')
+        return q[:, ng:ng + mx, ng:ng + my].transpose(0, 2, 1)
+
+    # After the 8 header lines, one line with num_eqn values per cell, x running fastest
+    with open(frame_file(bingclaw_output_dir, 'q', frame)) as f:
+        for _ in range(8):
+            f.readline()
+        q = np.array(f.read().split(), dtype=np.float64)
+    return q.reshape(my, mx, meqn).transpose(2, 0, 1)
@@ -0,0 +1,107 @@
+"""
+Long-lived BingClaw container, used to run many scenarios without starting a new container for each of them
+
+BingclawInstance starts one docker container (or singularity instance) that mounts the parent
+output directory of all scenarios at /BingClaw/runs and the script run_simulation.sh at
+/BingClaw/run_simulation.sh. The path of the BingClaw executable inside the container is
+searched only once per image, when the first instance starts (or given with bingclaw_exe), and then passed
+to run_simulation.sh, which also gets the run directory of the scenario explicitly, so
+running a scenario does not search the filesystem of the container.
+run_bingclaw uses the instance when it is given as argument 'instance'.
+
+Input needed:
+ - image_type        # Type of image: 'docker' or 'singularity'
+ - image_name        # Name of BingClaw docker image or singularity .sif file
+ - output_dir        # Parent directory where scenario output folders are created
+ - bingclaw_exe      # Path of the BingClaw executable inside the container (default None: searched when the instance starts)
+ - input_dir         # BingClaw input directory, mounted read-only at /BingClaw/inputs (default None: not mounted; needed if staging is 'bind')
+"""
+
+import os
+import sys
+import uuid
+import subprocess
+
+from py.staging import INPUTS_DIR
+
+RUNS_DIR = '/BingClaw/runs'
+SCRIPT = '/BingClaw/run_simulation.sh'
+
+_executables = {}   # Path of the BingClaw executable found in each image
+
+
+class BingclawInstance:
+
+    def __init__(self, image_type, image_name, output_dir, bingclaw_exe=None, input_dir=None):
+        if image_type not in ('docker', 'singularity'):
+            sys.exit(f"{image_type} is not a valid image_type. Options are 'docker' or 'singularity'")
+        self.image_type = image_type
+        self.image_name = image_name
+        self.output_dir = os.path.abspath(output_dir)
+        self.input_dir = os.path.abspath(input_dir) if input_dir is not None else None
+        self.bingclaw_exe = bingclaw_exe or _executables.get((image_type, image_name))
+        self.name = f"bingclaw_{uuid.uuid4().hex[:12]}"
+        self.started = False
+
+    def start(self):
+        """Start the container and find the BingClaw executable inside it (if not given)"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        script = os.path.join(os.getcwd(), 'run_simulation.sh')
+        mounts = [f"{self.output_dir}:{RUNS_DIR}", f"{script}:{SCRIPT}"]
+        if self.input_dir is not None:
+            mounts.append(f"{self.input_dir}:{INPUTS_DIR}:ro")
+        if self.image_type == 'docker':
+            command = ['docker', 'run', '-d', '--rm', '--name', self.name]
+            for mount in mounts:
+                command += ['-v', mount]
+            command += ['--entrypoint', 'sleep', self.image_name, 'infinity']
+        else:
+            command = ['singularity', 'instance', 'start', '--cleanenv']
+            for mount in mounts:
+                command += ['-B', mount]
+            command += [self.image_name, self.name]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        self.started = True
+
+        if self.bingclaw_exe is None:
+            result = subprocess.run(self.exec_command(['find', '/', '-xdev', '-type', 'f', '-name', 'BingClaw5.6.1', '-print', '-quit']),
+                                    capture_output=True, text=True)
+            self.bingclaw_exe = result.stdout.strip()
+            if not self.bingclaw_exe:
+                self.stop()
+                sys.exit(f"BingClaw5.6.1 not found in {self.image_name}")
+            _executables[(self.image_type, self.image_name)] = self.bingclaw_exe
+        print(f"Started BingClaw container {self.name} (executable {self.bingclaw_exe})")
+        return self
+
+    def exec_command(self, args):
+        """Return the command running args inside the container"""
+        if self.image_type == 'docker':
+            return ['docker', 'exec', self.name] + args
+        return ['singularity', 'exec', f"instance://{self.name}"] + args
+
+    def command(self, bingclaw_output_dir):
+        """Return the shell command running the BingClaw simulation set up in bingclaw_output_dir"""
+        relative = os.path.relpath(os.path.abspath(bingclaw_output_dir), self.output_dir)
+        if relative.startswith('..'):
+            sys.exit(f"{bingclaw_output_dir} is not inside {self.output_dir}, which is mounted in the BingClaw container")
+        run_dir = f"{RUNS_DIR}/{relative}"
+        args = ['env', f"BINGCLAW_EXE={self.bingclaw_exe}", 'bash', SCRIPT, run_dir]
+        return ' '.join(self.exec_command(args))
+
+    def stop(self):
+        """Stop the container"""
+        if not self.started:
+            return
+        if self.image_type == 'docker':
+            command = ['docker', 'stop', self.name]
+        else:
+            command = ['singularity', 'instance', 'stop', self.name]
+        subprocess.run(command, stdout=subprocess.DEVNULL)
+        self.started = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
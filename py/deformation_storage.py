@@ -0,0 +1,133 @@
+"""
+Functions to set the storage of the deformation file read by T-HySEA (initialization type 6)
+
+T-HySEA reads the deformation 'z' (time, lat, lon) one time step at a time, so 'z' is
+written with one time step per chunk (chunksizes (1, lat, lon)): every read of T-HySEA
+decompresses exactly one chunk. Options:
+ - complevel:   zlib compression level (0: no compression, 1-9 with the shuffle filter)
+ - dtype:       'f8' (default) or 'f4' (half the size; T-HySEA computes in single precision)
+ - digits:      number of decimal digits (of m) kept, i.e. 'z' is quantized with a scale
+                of 2^n >= 10^digits before compression (netCDF4 least_significant_digit).
+                The values stay floating point, so T-HySEA reads them as any other file
+                (packing to integers with scale_factor/add_offset is not used, because
+                T-HySEA does not unpack it). None (default) keeps all digits
+With the defaults the values written are bit-identical to the deformation computed.
+check_round_trip reads the file back and checks it against its source: layout expected by
+T-HySEA (variables lon, lat, time and z (time, lat, lon)), identical coordinates and 'z'
+equal to the source within the precision of the storage (exactly, when lossless).
+
+Input needed:
+ - complevel        # zlib compression level of the deformation (0-9, default 0)
+ - dtype            # Data type of the deformation: 'f8' (default) or 'f4'
+ - digits           # Decimal digits of the deformation kept (default None: all)
+"""
+
+import sys
+import numpy as np
+from netCDF4 import Dataset, default_fillvals
+
+DTYPES = ('f8', 'f4')
+DIMENSIONS = ('time', 'lat', 'lon')
+
+
+def deformation_storage(complevel=0, dtype='f8', digits=None):
+    """Return the storage of the deformation as a dict, checking the options"""
+    if dtype not in DTYPES:
+        sys.exit(f"{dtype} is not a valid deformation dtype. Options are 'f8' or 'f4'")
+    if not 0 <= int(complevel) <= 9:
+        sys.exit(f"Deformation complevel must be between 0 and 9, not {complevel}")
+    if digits is not None and int(digits) < 0:
+        sys.exit(f"Deformation digits must be positive, not {digits}")
+    return {'complevel': int(complevel), 'dtype': dtype, 'digits': None if digits is None else int(digits)}
+
+
+def is_default(storage):
+    """Return True if storage is uncompressed 'f8' with all digits (the values written are the values computed)"""
+    return storage == deformation_storage()
+
+
+def storage_key(storage):
+    """Return a string identifying the storage (e.g. in cache keys)"""
+    return f"{storage['dtype']}-z{storage['complevel']}-d{storage['digits']}"
+
+
+def z_settings(storage, shape):
+    """Return datatype and createVariable keyword arguments of 'z' with frame shape (lat, lon)"""
+    settings = {'chunksizes': (1,) + tuple(shape), 'zlib': storage['complevel'] > 0, 'shuffle': storage['complevel'] > 0}
+    if storage['complevel'] > 0:
+        settings['complevel'] = storage['complevel']
+    if storage['digits'] is not None:
+        settings['least_significant_digit'] = storage['digits']
+    return storage['dtype'], settings
+
+
+def has_storage(var, storage):
+    """Return True if NetCDF variable var is already stored as storage"""
+    filters = var.filters() or {}
+    complevel = filters.get('complevel', 0) if filters.get('zlib') else 0
+    return (var.chunking() == [1] + list(var.shape[1:]) and var.datatype == np.dtype(storage['dtype'])
+            and complevel == storage['complevel'] and storage['digits'] is None
+            and 'least_significant_digit' not in var.ncattrs())
+
+
+def tolerance(storage, scale):
+    """Return the largest difference allowed between 'z' and its source with largest absolute value scale"""
+    allowed = 0.0
+    if storage['dtype'] == 'f4':
+        allowed += np.finfo(np.float32).eps * scale
+    if storage['digits'] is not None:
+        allowed += 0.5 * 10.0**-storage['digits']
+    return allowed
+
+
+def read_values(var, start, end, window=None):
+    """Return timesteps start to end of 'z' (cells in window (rows, cols) if given) as float64, with NaN where missing
+    (var: NetCDF variable or array)"""
+    rows, cols = window if window is not None else (slice(None), slice(None))
+    if not hasattr(var, 'ncattrs'):
+        return np.ma.filled(np.ma.asarray(var[start:end, rows, cols], dtype=np.float64), np.nan)
+    # Raw values, without the (slow) masking of netCDF4
+    var.set_auto_mask(False)
+    values = np.asarray(var[start:end, rows, cols], dtype=np.float64)
+    fill_value = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else default_fillvals[var.dtype.str[1:]]
+    values[values == np.float64(fill_value)] = np.nan
+    return values
+
+
+def check_round_trip(output_file, source, storage, skip_frames=0, slab_size=10, window=None):
+    """Check the deformation file output_file against source (a deformation file, or an array (time, lat, lon) of 'z')
+    from which its first skip_frames timesteps were removed, and which was cropped to window (rows, cols) if given"""
+    with Dataset(output_file) as ds:
+        missing = [name for name in DIMENSIONS + ('z',) if name not in ds.variables]
+        if missing or ds['z'].dimensions != DIMENSIONS:
+            sys.exit(f"Round-trip check of {output_file} failed: T-HySEA needs variables lon, lat, time and z{DIMENSIONS}")
+        out = ds['z']
+        src_ds = Dataset(source) if isinstance(source, str) else None
+        try:
+            src = src_ds['z'] if src_ds is not None else source
+            rows, cols = window if window is not None else (slice(None), slice(None))
+            if src_ds is not None:
+                for name, cells in (('lon', cols), ('lat', rows)):
+                    if not np.array_equal(ds[name][:], src_ds[name][cells]):
+                        sys.exit(f"Round-trip check of {output_file} failed: {name} differs from {source}")
+                if not np.array_equal(ds['time'][:], src_ds['time'][:len(src_ds['time']) - skip_frames]):
+                    sys.exit(f"Round-trip check of {output_file} failed: time differs from {source}")
+            expected_shape = (src.shape[0] - skip_frames, len(range(src.shape[1])[rows]), len(range(src.shape[2])[cols]))
+            if out.shape != expected_shape:
+                sys.exit(f"Round-trip check of {output_file} failed: z has shape {out.shape}, source {src.shape}")
+            for start in range(0, out.shape[0], slab_size):
+                end = min(start + slab_size, out.shape[0])
+                expected = read_values(src, start + skip_frames, end + skip_frames, window)
+                written = read_values(out, start, end)
+                if np.array_equal(expected, written, equal_nan=True):
+                    continue
+                if not np.array_equal(np.isnan(expected), np.isnan(written)):
+                    sys.exit(f"Round-trip check of {output_file} failed: missing values of z differ from the source")
+                scale = np.nanmax(np.abs(expected))
+                error = np.nanmax(np.abs(written - expected))
+                if error > tolerance(storage, scale):
+                    sys.exit(f"Round-trip check of {output_file} failed: z differs from the source by {error} m "
+                             f"(timesteps {start}-{end - 1}, allowed {tolerance(storage, scale)} m)")
+        finally:
+            if src_ds is not None:
+                src_ds.close()
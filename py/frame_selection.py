@@ -0,0 +1,59 @@
+"""
+Functions to select the BingClaw frames converted by the Interface Module (adaptive temporal decimation)
+
+A frame is kept only if the landslide thickness changed by more than frame_tolerance (m, in
+any cell) since the last frame kept; the frames in between are then within frame_tolerance of
+a kept frame. The changes of a block of frames from the last kept frame are computed at once
+(one vectorized difference per block), and the search restarts after every frame kept. Blocks
+start with one frame after a frame kept (while the landslide moves, every frame is usually
+kept) and double while no frame is kept, up to BLOCK_FRAMES (while it is at rest).
+The first keep_leading frames are always kept (frame 0 is the reference of the deformation,
+the next ones are dropped by skip_frames).
+When the thickness does not change by more than frame_tolerance after the last frame kept,
+the landslide is at rest: with stop_when_stationary the series ends there, otherwise the last
+frame is kept too, so that the series covers the whole BingClaw simulation.
+
+Input needed:
+ - thickness            # Landslide thickness of all frames (nframes, my, mx) (see intmod_native.read_thickness)
+ - frame_tolerance      # Change of thickness (m) above which a frame is kept
+ - stop_when_stationary # End the series at the last frame kept (True) or at the last frame (False)
+ - keep_leading         # Number of leading frames always kept (default 1)
+"""
+
+import numpy as np
+
+BLOCK_FRAMES = 16      # Frames compared with the last frame kept at a time
+
+
+def frame_changes(thickness, reference, start, stop):
+    """Return the largest change of thickness from reference of frames start to stop"""
+    block = np.asarray(thickness[start:stop]) - reference
+    return np.abs(block).reshape(stop - start, -1).max(axis=1)
+
+
+def select_frames(thickness, frame_tolerance, stop_when_stationary=True, keep_leading=1):
+    """Return the indices of the frames of thickness (nframes, my, mx) to keep"""
+    nframes = len(thickness)
+    kept = list(range(min(keep_leading, nframes)))
+    last = kept[-1] if kept else 0
+    start, block = last + 1, 1
+    while start < nframes:
+        stop = min(start + block, nframes)
+        changed = np.flatnonzero(frame_changes(thickness, thickness[last], start, stop) > frame_tolerance)
+        if len(changed) == 0:
+            start, block = stop, min(2 * block, BLOCK_FRAMES)
+            continue
+        last = start + int(changed[0])
+        kept.append(last)
+        start, block = last + 1, 1
+    if not stop_when_stationary and kept[-1] != nframes - 1:
+        kept.append(nframes - 1)
+    return kept
+
+
+def shifted_frames(frames, kept, skip_frames=0):
+    """Return the frames whose data are converted and the frames whose times they take, when the first
+    skip_frames frames are dropped keeping the times of the first frames (see run_interface_module.py)"""
+    data = [frames[k] for k in kept[skip_frames:]]
+    times = [frames[k - skip_frames] for k in kept[skip_frames:]]
+    return data, times
@@ -0,0 +1,231 @@
+"""
+Functions to aggregate the T-HySEA outputs of an ensemble into hazard maps
+
+For every cell of the T-HySEA grid (the same for all scenarios), over all scenarios:
+ - max_eta:                 maximum wave amplitude (m)
+ - arrival_time:            earliest time at which |eta| reaches arrival_threshold (s); NaN if never
+ - mean_arrival_time:       mean of the arrival times of the scenarios that reach arrival_threshold (s)
+ - exceedance_probability:  probability that the maximum wave amplitude of a scenario exceeds each
+                            of the thresholds (scenarios weighted by their weight, default equal)
+
+The output of a scenario is read in slabs of slab_size timesteps, and every slab updates the
+running maximum and arrival time of the scenario in place; at the end of the scenario these
+update the ensemble reductions (HazardAccumulator). Memory is one slab plus the accumulator
+grids, whatever the number of scenarios. Groups of scenarios can be aggregated in parallel
+(workers processes, or separate jobs with 'python -m py.hazard partial') into partial
+accumulators, which are then merged.
+
+Usage:
+    python -m py.hazard partial <partial.npz> <grid.nc> [<grid.nc> ...] [--thresholds 0.1,0.5,1.0,2.0] [--arrival-threshold 0.05]
+                                                                               # aggregate some scenarios
+    python -m py.hazard merge <hazard.nc> <partial.npz> [<partial.npz> ...]    # merge them into the hazard maps
+Pass the thresholds of the ensemble (params['hazard_thresholds'] and params['arrival_threshold']) to every
+partial aggregation; merge refuses partial files with different thresholds.
+
+Input needed:
+ - grid_files           # T-HySEA output grid files of the scenarios (e.g. outputs/<scenario>/hysea_out/<prefix>.nc)
+ - output_file          # NetCDF file where the hazard maps are saved (e.g. outputs/hazard.nc)
+ - thresholds           # Wave amplitudes (m) of the exceedance probabilities (default [0.1, 0.5, 1.0, 2.0])
+ - arrival_threshold    # Amplitude |eta| (m) defining the arrival of the wave (default 0.05)
+ - workers              # Number of processes aggregating scenarios at the same time (default 1)
+ - slab_size            # Number of timesteps read at a time (default 10)
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import numpy as np
+from datetime import datetime
+from netCDF4 import Dataset
+from concurrent.futures import ProcessPoolExecutor
+
+from py.poi_series import grid_coordinates
+
+THRESHOLDS = [0.1, 0.5, 1.0, 2.0]
+ARRIVAL_THRESHOLD = 0.05
+VARIABLE = 'eta'
+
+
+class HazardAccumulator:
+    """Running reductions over the scenarios of an ensemble, on a grid of shape (lat, lon)"""
+
+    def __init__(self, shape, thresholds=THRESHOLDS, arrival_threshold=ARRIVAL_THRESHOLD, lon=None, lat=None):
+        self.shape = tuple(shape)
+        self.lon, self.lat = lon, lat
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.arrival_threshold = float(arrival_threshold)
+        self.nscenarios = 0
+        self.total_weight = 0.0
+        self.max_eta = np.full(self.shape, np.nan, dtype=np.float32)
+        self.arrival_time = np.full(self.shape, np.nan, dtype=np.float32)
+        self.arrival_sum = np.zeros(self.shape, dtype=np.float64)
+        self.arrival_count = np.zeros(self.shape, dtype=np.int32)
+        self.exceedance = np.zeros((len(self.thresholds),) + self.shape, dtype=np.float64)
+
+    def add_scenario(self, grid_file, weight=1.0, slab_size=10, variable=VARIABLE):
+        """Read the output of one scenario slab by slab and add it to the reductions"""
+        with Dataset(grid_file) as ds:
+            var = ds[variable]
+            if var.ndim != 3 or var.shape[1:] != self.shape:
+                sys.exit(f"Variable {variable} of {grid_file} has shape {var.shape}, expected (time,) + {self.shape}")
+            times = ds['time'][:].astype(np.float64)
+            scenario_max = np.full(self.shape, np.nan, dtype=np.float32)
+            arrival = np.full(self.shape, np.nan, dtype=np.float32)
+            for start in range(0, var.shape[0], slab_size):
+                slab = np.ma.filled(var[start:start + slab_size].astype(np.float32), np.nan)
+                np.fmax(scenario_max, np.fmax.reduce(slab, axis=0), out=scenario_max)
+                with np.errstate(invalid='ignore'):
+                    arrived = np.abs(slab) >= self.arrival_threshold
+                new = arrived.any(axis=0) & np.isnan(arrival)
+                if new.any():
+                    arrival[new] = times[start:start + slab_size][arrived.argmax(axis=0)[new]]
+        self._add(scenario_max, arrival, weight)
+
+    def _add(self, scenario_max, arrival, weight):
+        np.fmax(self.max_eta, scenario_max, out=self.max_eta)
+        np.fmin(self.arrival_time, arrival, out=self.arrival_time)
+        reached = ~np.isnan(arrival)
+        self.arrival_sum[reached] += arrival[reached]
+        self.arrival_count += reached
+        with np.errstate(invalid='ignore'):
+            for k, threshold in enumerate(self.thresholds):
+                self.exceedance[k] += weight * (scenario_max > threshold)
+        self.nscenarios += 1
+        self.total_weight += weight
+
+    def merge(self, other):
+        """Add the reductions of other (same grid and thresholds) to these"""
+        if other.shape != self.shape or not np.array_equal(other.thresholds, self.thresholds) \
+                or other.arrival_threshold != self.arrival_threshold:
+            sys.exit("Cannot merge hazard accumulators with different grids or thresholds")
+        np.fmax(self.max_eta, other.max_eta, out=self.max_eta)
+        np.fmin(self.arrival_time, other.arrival_time, out=self.arrival_time)
+        self.arrival_sum += other.arrival_sum
+        self.arrival_count += other.arrival_count
+        self.exceedance += other.exceedance
+        self.nscenarios += other.nscenarios
+        self.total_weight += other.total_weight
+        return self
+
+    def save(self, filename):
+        """Save the accumulator (e.g. a partial aggregation) as .npz"""
+        tmp_fd, tmp_file = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(os.path.abspath(filename)))
+        with os.fdopen(tmp_fd, 'wb') as f:
+            np.savez(f, lon=self.lon, lat=self.lat, thresholds=self.thresholds, arrival_threshold=self.arrival_threshold,
+                     nscenarios=self.nscenarios, total_weight=self.total_weight, max_eta=self.max_eta,
+                     arrival_time=self.arrival_time, arrival_sum=self.arrival_sum,
+                     arrival_count=self.arrival_count, exceedance=self.exceedance)
+        os.replace(tmp_file, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            acc = cls(data['max_eta'].shape, data['thresholds'], float(data['arrival_threshold']), data['lon'], data['lat'])
+            acc.nscenarios = int(data['nscenarios'])
+            acc.total_weight = float(data['total_weight'])
+            for name in ('max_eta', 'arrival_time', 'arrival_sum', 'arrival_count', 'exceedance'):
+                setattr(acc, name, data[name])
+        return acc
+
+    def write(self, filename):
+        """Write the hazard maps to a NetCDF file"""
+        lon, lat = self.lon, self.lat
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_arrival = np.where(self.arrival_count > 0, self.arrival_sum / self.arrival_count, np.nan)
+            probability = self.exceedance / self.total_weight if self.total_weight > 0 else self.exceedance * np.nan
+        tmp_fd, tmp_file = tempfile.mkstemp(suffix='.nc', dir=os.path.dirname(os.path.abspath(filename)))
+        os.close(tmp_fd)
+        with Dataset(tmp_file, mode='w', format='NETCDF4') as ds:
+            ds.title = 'Hazard'
+            ds.history = f"Created {datetime.today().strftime('%d/%m/%y')} by bingclaw-to-hysea"
+            ds.description = f"Hazard maps of an ensemble of {self.nscenarios} scenarios"
+            ds.nscenarios = self.nscenarios
+            ds.arrival_threshold = self.arrival_threshold
+            ds.createDimension('lon', len(lon))
+            ds.createDimension('lat', len(lat))
+            ds.createDimension('threshold', len(self.thresholds))
+            var = ds.createVariable('lon', 'f8', ('lon',))
+            var.units = 'degrees_east'
+            var[:] = lon
+            var = ds.createVariable('lat', 'f8', ('lat',))
+            var.units = 'degrees_north'
+            var[:] = lat
+            var = ds.createVariable('threshold', 'f8', ('threshold',))
+            var.units = 'm'
+            var[:] = self.thresholds
+            for name, values, units in [('max_eta', self.max_eta, 'm'), ('arrival_time', self.arrival_time, 'seconds'),
+                                        ('mean_arrival_time', mean_arrival, 'seconds')]:
+                var = ds.createVariable(name, 'f4', ('lat', 'lon'), zlib=True, fill_value=np.float32(np.nan))
+                var.units = units
+                var[:] = values
+            var = ds.createVariable('exceedance_probability', 'f4', ('threshold', 'lat', 'lon'), zlib=True)
+            var[:] = probability
+        os.replace(tmp_file, filename)
+
+
+def aggregate_scenarios(grid_files, weights=None, thresholds=THRESHOLDS, arrival_threshold=ARRIVAL_THRESHOLD, slab_size=10):
+    """Return the HazardAccumulator of the scenarios in grid_files"""
+    with Dataset(grid_files[0]) as ds:
+        lon, lat = grid_coordinates(ds, grid_files[0])
+        shape = ds[VARIABLE].shape[1:]
+    acc = HazardAccumulator(shape, thresholds, arrival_threshold, lon, lat)
+    for i, grid_file in enumerate(grid_files):
+        acc.add_scenario(grid_file, 1.0 if weights is None else weights[i], slab_size)
+    return acc
+
+
+def aggregate_hazard(grid_files, output_file, thresholds=THRESHOLDS, arrival_threshold=ARRIVAL_THRESHOLD,
+                     workers=1, slab_size=10, weights=None):
+    print("* Executing aggregate_hazard")
+    if len(grid_files) == 0:
+        sys.exit("aggregate_hazard needs the output of at least one scenario")
+    weights = list(weights) if weights is not None else [1.0] * len(grid_files)
+
+    # Every worker aggregates a group of scenarios; the partial accumulators are merged at the end
+    workers = max(1, min(workers, len(grid_files)))
+    groups = [(grid_files[i::workers], weights[i::workers]) for i in range(workers)]
+    if workers == 1:
+        acc = aggregate_scenarios(grid_files, weights, thresholds, arrival_threshold, slab_size)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(aggregate_scenarios, files, group_weights, thresholds, arrival_threshold, slab_size)
+                       for files, group_weights in groups]
+            acc = futures[0].result()
+            for future in futures[1:]:
+                acc.merge(future.result())
+
+    acc.write(output_file)
+    print(f"Hazard maps of {acc.nscenarios} scenarios written to {output_file}")
+    return output_file
+
+
+def merge_partials(partial_files, output_file):
+    """Merge the partial accumulators saved in partial_files (same grid and thresholds) into the hazard maps output_file"""
+    acc = HazardAccumulator.load(partial_files[0])
+    for filename in partial_files[1:]:
+        other = HazardAccumulator.load(filename)
+        if not np.array_equal(other.thresholds, acc.thresholds) or other.arrival_threshold != acc.arrival_threshold:
+            sys.exit(f"Partial hazard {filename} has thresholds {other.thresholds.tolist()} and arrival threshold "
+                     f"{other.arrival_threshold}, {partial_files[0]} has {acc.thresholds.tolist()} and {acc.arrival_threshold}")
+        acc.merge(other)
+    acc.write(output_file)
+    print(f"Hazard maps of {acc.nscenarios} scenarios written to {output_file}")
+    return output_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m py.hazard', description='Aggregate T-HySEA outputs into hazard maps')
+    parser.add_argument('command', choices=['partial', 'merge'])
+    parser.add_argument('output', help='partial.npz (partial) or hazard.nc (merge)')
+    parser.add_argument('files', nargs='+', help='grid.nc files (partial) or partial.npz files (merge)')
+    parser.add_argument('--thresholds', type=lambda value: [float(v) for v in value.split(',')], default=THRESHOLDS,
+                        help=f"Comma-separated wave amplitudes (m) of the exceedance probabilities (partial; default "
+                             f"{','.join(str(t) for t in THRESHOLDS)})")
+    parser.add_argument('--arrival-threshold', type=float, default=ARRIVAL_THRESHOLD,
+                        help=f"Amplitude |eta| (m) defining the arrival of the wave (partial; default {ARRIVAL_THRESHOLD})")
+    args = parser.parse_args()
+    if args.command == 'partial':
+        aggregate_scenarios(args.files, thresholds=args.thresholds, arrival_threshold=args.arrival_threshold).save(args.output)
+    else:
+        merge_partials(args.files, args.output)
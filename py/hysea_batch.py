@@ -0,0 +1,143 @@
+"""
+Functions to run the T-HySEA simulations of many scenarios in batches
+
+T-HySEA reads the list of simulations to run from the file given on its command line,
+so instead of launching mpirun (and paying for MPI and CUDA initialization) once per
+scenario, HyseaBatcher collects the scenarios whose T-HySEA input file is ready and
+launches them together, with one uniquely named list file per batch
+(<list_dir>/simulations_XXXXXXXX.txt, see run_hysea.write_simulations_file).
+
+The number of simulations in a batch is chosen from the free memory of the GPUs
+(queried with nvidia-smi before every batch) and the memory needed by one simulation,
+estimated from the number of cells of its bathymetry grid (BYTES_PER_CELL per cell).
+If nvidia-smi is not available, batches have max_batch_size simulations.
+
+Input needed:
+ - hysea_executable     # Full path of location of T-HySEA executable
+ - list_dir             # Directory where the list files of the batches are written
+ - max_batch_size       # Maximum number of simulations in a batch
+ - concurrent_batches   # Number of batches that can run at the same time on one GPU (memory is shared between them)
+ - memory_fraction      # Fraction of the free GPU memory that a batch can use
+ - ranks                # Number of MPI ranks (= GPUs) of each batch, or 'auto' (see py/hysea_launch.py)
+ - timeout              # Time (s) after which a batch is stopped (default None: no limit)
+The output of a batch is written to <list_dir>/simulations_XXXXXXXX.log (see py/processes.py).
+"""
+
+import os
+import threading
+import subprocess
+from concurrent.futures import Future
+
+from py.run_hysea import write_simulations_file
+from py.hysea_launch import input_bathymetry, grid_cells, resolve_ranks, mpi_command
+from py.instrument import measure
+from py.processes import run_command
+
+BYTES_PER_CELL = 200   # Estimated GPU memory used by T-HySEA for one cell of the grid (state, fluxes, deformation, ...)
+
+
+def gpu_free_memory():
+    """Return the free memory (bytes) of each visible GPU, or None if nvidia-smi is not available"""
+    try:
+        result = subprocess.run(['nvidia-smi', '--query-gpu=memory.free', '--format=csv,noheader,nounits'],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    free = [int(line) * 1024**2 for line in result.stdout.split() if line.strip().isdigit()]
+    visible = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if visible:
+        devices = [int(d) for d in visible.split(',') if d.strip().isdigit()]
+        free = [free[d] for d in devices if d < len(free)]
+    return free or None
+
+
+def simulation_memory(hysea_input_file, bytes_per_cell=BYTES_PER_CELL):
+    """Return the estimated GPU memory (bytes) of the simulation described by a T-HySEA input file"""
+    return grid_cells(input_bathymetry(hysea_input_file)) * bytes_per_cell
+
+
+class HyseaBatcher:
+    """Queue of scenarios ready for T-HySEA, launched in batches sized on the free GPU memory"""
+
+    def __init__(self, hysea_executable, list_dir, max_batch_size=8, concurrent_batches=1, memory_fraction=0.9, ranks=1, timeout=None):
+        self.hysea_executable = hysea_executable
+        self.list_dir = list_dir
+        self.max_batch_size = max_batch_size
+        self.concurrent_batches = concurrent_batches
+        self.memory_fraction = memory_fraction
+        self.ranks = ranks
+        self.timeout = timeout
+        self.pending = []    # (hysea_input_file, memory, future) of scenarios waiting for a batch
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, hysea_input_file):
+        """Add a scenario whose T-HySEA input file is ready; return the Future of its result"""
+        future = Future()
+        memory = simulation_memory(hysea_input_file)
+        with self.lock:
+            self.pending.append((hysea_input_file, memory, future))
+            self.futures[key] = future
+        return future
+
+    def skip(self, key):
+        """Add a scenario that does not need to run (its T-HySEA outputs are up to date)"""
+        future = Future()
+        future.set_result(0)
+        future.skipped = True
+        with self.lock:
+            self.futures[key] = future
+        return future
+
+    def skipped(self, key):
+        """Return True if scenario key was added with skip"""
+        return getattr(self.futures[key], 'skipped', False)
+
+    def batch_size(self, memories, ranks=1):
+        """Return how many of the pending simulations (with memories) fit in the free GPU memory of ranks GPUs"""
+        free = gpu_free_memory()
+        if free is None:
+            return min(len(memories), self.max_batch_size)
+        available = min(free) * ranks * self.memory_fraction / self.concurrent_batches
+        size, used = 0, 0
+        for memory in memories[:self.max_batch_size]:
+            if size > 0 and used + memory > available:
+                break
+            size, used = size + 1, used + memory
+        return size
+
+    def run_ready(self):
+        """Run one batch with the pending scenarios; return False if there was nothing to run"""
+        with self.lock:
+            if not self.pending:
+                return False
+            # Ranks chosen from the largest grid waiting
+            largest = max(self.pending, key=lambda p: p[1])[0]
+            ranks = resolve_ranks(self.ranks, input_bathymetry(largest))
+            size = self.batch_size([memory for _, memory, _ in self.pending], ranks)
+            batch, self.pending = self.pending[:size], self.pending[size:]
+
+        hysea_input_files = [hysea_input_file for hysea_input_file, _, _ in batch]
+        try:
+            simulations_file = write_simulations_file(hysea_input_files, self.list_dir)
+            print(f"* Running T-HySEA batch of {len(batch)} simulations on {ranks} GPUs ({simulations_file})")
+            with measure('run') as record:
+                result = run_command(mpi_command(self.hysea_executable, simulations_file, ranks),
+                                     os.path.splitext(simulations_file)[0] + '.log', self.timeout, 'T-HySEA')
+                record['exit_code'] = result.exit_code
+                record['batch_size'] = len(batch)
+        except BaseException as err:
+            for _, _, future in batch:
+                future.set_exception(err)
+            raise
+        for _, _, future in batch:
+            future.set_result(result)
+        return True
+
+    def result(self, key):
+        """Run batches until the scenario key has been simulated; return the ProcessResult of its batch"""
+        future = self.futures[key]
+        while not future.done():
+            if not self.run_ready():
+                break   # Its batch is running in another thread
+        return future.result()
@@ -0,0 +1,92 @@
+"""
+Functions to launch T-HySEA on several GPUs
+
+T-HySEA splits the domain of a simulation between its MPI ranks, one GPU per rank.
+ - choose_ranks: number of ranks for a grid, from its number of cells and the number
+   of visible GPUs (one more rank for every CELLS_PER_RANK cells, up to the number of GPUs)
+ - write_binding_script: script that sets CUDA_VISIBLE_DEVICES of every rank from its
+   local rank (Open MPI, MVAPICH, SLURM srun), so that each rank uses a different GPU
+ - mpi_command: launch line 'mpirun -np <ranks> [bind_gpus.sh] <T-HySEA> <simulations file>'
+
+Input needed:
+ - ranks        # Number of MPI ranks (= GPUs) used by T-HySEA, or 'auto'
+ - bathymetry   # Bathymetry file created by the Interface Module (grid of the T-HySEA simulation)
+"""
+
+import os
+import math
+import threading
+import subprocess
+from netCDF4 import Dataset
+
+from py.intmod_native import netcdf_lock
+
+CELLS_PER_RANK = 4_000_000   # Grids smaller than this do not run faster on more GPUs (communication dominates)
+BINDING_SCRIPT = 'bind_gpus.sh'
+
+
+def visible_gpus():
+    """Return the indices of the GPUs visible to T-HySEA (CUDA_VISIBLE_DEVICES, or all GPUs listed by nvidia-smi)"""
+    visible = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if visible is not None:
+        return [d.strip() for d in visible.split(',') if d.strip() and d.strip() != '-1']
+    try:
+        result = subprocess.run(['nvidia-smi', '--query-gpu=index', '--format=csv,noheader'],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    return result.stdout.split()
+
+
+def input_bathymetry(hysea_input_file):
+    """Return the bathymetry file of a T-HySEA input file (its second line)"""
+    with open(hysea_input_file) as f:
+        return f.readlines()[1].split()[0]
+
+
+def grid_cells(bathymetry):
+    """Return the number of cells of the grid of a bathymetry NetCDF file"""
+    with netcdf_lock, Dataset(bathymetry) as ds:
+        return math.prod(len(dim) for dim in ds.dimensions.values() if not dim.isunlimited())
+
+
+def choose_ranks(cells, n_gpus, cells_per_rank=CELLS_PER_RANK):
+    """Return the number of MPI ranks for a grid with cells cells on a node with n_gpus GPUs"""
+    return max(1, min(n_gpus, math.ceil(cells / cells_per_rank)))
+
+
+def resolve_ranks(ranks, bathymetry, devices=None):
+    """Return the number of ranks: ranks itself, or chosen from the grid of bathymetry if ranks is 'auto'"""
+    if ranks != 'auto':
+        return int(ranks)
+    devices = visible_gpus() if devices is None else devices
+    return choose_ranks(grid_cells(bathymetry), len(devices))
+
+
+def write_binding_script(script_dir, devices):
+    """Write the script binding each MPI rank to one of devices and return its name"""
+    script = os.path.join(script_dir, BINDING_SCRIPT)
+    tmp = f"{script}.{os.getpid()}.{threading.get_ident()}"   # Batches running at the same time may write it too
+    with open(tmp, 'w') as f:
+        f.write('#!/bin/bash\n')
+        f.write('# Bind each MPI rank to one GPU, then run the command given as arguments\n')
+        f.write('local_rank=${OMPI_COMM_WORLD_LOCAL_RANK:-${MV2_COMM_WORLD_LOCAL_RANK:-${SLURM_LOCALID:-0}}}\n')
+        f.write(f"devices=({' '.join(devices)})\n")
+        f.write('export CUDA_VISIBLE_DEVICES=${devices[$((local_rank % ${#devices[@]}))]}\n')
+        f.write('exec "$@"\n')
+    os.chmod(tmp, 0o755)
+    os.replace(tmp, script)
+    return script
+
+
+def mpi_command(hysea_executable, simulations_file, ranks=1, devices=None, script_dir=None):
+    """Return the command (list) launching T-HySEA with ranks MPI ranks, each bound to one GPU of devices"""
+    command = ['mpirun', '-np', str(ranks)]
+    if ranks > 1:
+        devices = visible_gpus() if devices is None else devices
+        if len(devices) < ranks:
+            print(f"WARNING: running T-HySEA with {ranks} ranks on {len(devices)} visible GPUs")
+        if devices:
+            script_dir = script_dir or os.path.dirname(os.path.abspath(simulations_file))
+            command.append(write_binding_script(script_dir, devices))
+    return command + [hysea_executable, simulations_file]
@@ -0,0 +1,214 @@
+"""
+Functions to measure the performance of the stages of the workflow
+
+ - measure: context manager recording wall time, CPU time (of the calling thread and of
+   its subprocesses), peak RSS, bytes read and written (Linux, including subprocesses
+   that ended) and, set by the caller, the exit code of a stage. A measure inside another
+   one (e.g. 'interpolate' inside 'interface_module') is saved as a step of the outer one;
+   steps with the same name (e.g. one per frame) are added up.
+ - Manifest: JSON file <scenario_dir>/manifest.json with the latest record of each stage of
+   a scenario (outputs/manifest.json for the stages of the whole ensemble, e.g. container start)
+ - write_rollup: CSV file with one row per stage (and step) per scenario of an ensemble
+ - profile: 'cprofile' saves <scenario_dir>/profiles/<stage>.prof (pstats format) for every stage;
+   'py-spy' records <scenario_dir>/profiles/<stage>.json (speedscope format) with py-spy, which
+   has to be installed. Profiles include what other threads (scenarios) do at the same time.
+
+CPU time, bytes read/written and RSS of subprocesses are counted for the whole process, so when
+scenarios run at the same time (run_ensemble with cpu_workers > 1) they include the subprocesses
+of the other scenarios; use cpu_workers = 1 or backend 'local'/'slurm' for exact numbers.
+
+Usage:
+    python -m py.instrument <output_dir>     # write <output_dir>/performance.csv from the scenario manifests
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import signal
+import cProfile
+import resource
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from contextlib import contextmanager
+
+MANIFEST_FILE = 'manifest.json'
+ROLLUP_FILE = 'performance.csv'
+PROFILERS = (None, 'cprofile', 'py-spy')
+SUMMED = ('wall_s', 'cpu_s', 'children_cpu_s', 'bytes_read', 'bytes_written', 'disk_bytes_read', 'disk_bytes_written')
+COLUMNS = ['scenario', 'stage', 'status', 'exit_code', 'count', 'wall_s', 'cpu_s', 'children_cpu_s', 'peak_rss_mb',
+           'children_peak_rss_mb', 'bytes_read', 'bytes_written', 'disk_bytes_read', 'disk_bytes_written', 'started']
+
+_lock = threading.Lock()
+_current = threading.local()   # Record of the stage measured in this thread
+
+
+def _proc_io():
+    """Return the bytes read and written by this process and its finished subprocesses (None if not on Linux)"""
+    try:
+        with open('/proc/self/io') as f:
+            io = dict(line.split(': ') for line in f.read().splitlines())
+    except OSError:
+        return None
+    return {'bytes_read': int(io['rchar']), 'bytes_written': int(io['wchar']),
+            'disk_bytes_read': int(io['read_bytes']), 'disk_bytes_written': int(io['write_bytes'])}
+
+
+def _snapshot():
+    who = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+    own = resource.getrusage(who)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'time': time.perf_counter(), 'cpu': own.ru_utime + own.ru_stime,
+            'children_cpu': children.ru_utime + children.ru_stime, 'io': _proc_io()}
+
+
+def _start_profiler(profile, name, profile_dir):
+    if profile is None:
+        return None
+    if profile not in PROFILERS:
+        sys.exit(f"{profile} is not a valid profiler. Options are None, 'cprofile' or 'py-spy'")
+    os.makedirs(profile_dir, exist_ok=True)
+    if profile == 'cprofile':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            print(f"WARNING: cannot profile {name}: another profiler is active (stages running at the same time)")
+            return None
+        return profiler
+    try:
+        return subprocess.Popen(['py-spy', 'record', '--pid', str(os.getpid()), '--format', 'speedscope',
+                                 '-o', os.path.join(profile_dir, f"{name}.json")],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except FileNotFoundError:
+        print("WARNING: py-spy not found; install it with 'pip install py-spy' to profile the stages")
+        return None
+
+
+def _stop_profiler(profiler, name, profile_dir):
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(os.path.join(profile_dir, f"{name}.prof"))
+    elif profiler is not None:
+        profiler.send_signal(signal.SIGINT)
+        profiler.wait()
+
+
+@contextmanager
+def measure(name, manifest=None, profile=None):
+    """Measure the code in the with block as stage name of manifest (or as a step of the stage measured in this thread)
+
+    Yields the record of the stage, where the caller can set e.g. record['exit_code'].
+    """
+    parent = getattr(_current, 'record', None)
+    record = {'stage': name, 'started': datetime.now().isoformat(timespec='seconds'), 'count': 1, 'steps': {}}
+    if manifest is None and parent is None:
+        yield record   # Not instrumented
+        return
+
+    profile_dir = os.path.join(manifest.directory, 'profiles') if manifest is not None else None
+    profiler = _start_profiler(profile, name, profile_dir) if manifest is not None else None
+    _current.record = record
+    start = _snapshot()
+    try:
+        yield record
+        record.setdefault('status', 'ok')
+    except BaseException:
+        record['status'] = 'failed'
+        raise
+    finally:
+        end = _snapshot()
+        _current.record = parent
+        _stop_profiler(profiler, name, profile_dir)
+        record['wall_s'] = round(end['time'] - start['time'], 6)
+        record['cpu_s'] = round(end['cpu'] - start['cpu'], 6)
+        record['children_cpu_s'] = round(end['children_cpu'] - start['children_cpu'], 6)
+        record['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        record['children_peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+        if start['io'] is not None:
+            for key in start['io']:
+                record[key] = end['io'][key] - start['io'][key]
+        if manifest is not None:
+            manifest.add(record)
+        else:
+            _add_step(parent, record)
+
+
+def current_record():
+    """Return the record of the stage (or step) measured in this thread, e.g. to set its exit code"""
+    record = getattr(_current, 'record', None)
+    return record if record is not None else {}
+
+
+def _add_step(parent, record):
+    steps = parent['steps']
+    if record['stage'] not in steps:
+        steps[record['stage']] = record
+        return
+    step = steps[record['stage']]
+    step['count'] += record['count']
+    for key in SUMMED:
+        if key in record:
+            step[key] = round(step.get(key, 0) + record[key], 6)
+    for key in ('peak_rss_mb', 'children_peak_rss_mb'):
+        step[key] = max(step[key], record[key])
+    if record.get('status') == 'failed':
+        step['status'] = 'failed'
+
+
+class Manifest:
+    """Performance records of the stages of one scenario, saved in <directory>/manifest.json"""
+
+    def __init__(self, directory, scenario=None):
+        self.directory = directory
+        self.filename = os.path.join(directory, MANIFEST_FILE)
+        self.scenario = scenario or os.path.basename(os.path.normpath(directory))
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return {'scenario': self.scenario, 'stages': {}}
+        with open(self.filename) as f:
+            return json.load(f)
+
+    def add(self, record):
+        """Save record, replacing the previous record of the same stage (stages of a scenario may run in different processes)"""
+        with _lock:
+            manifest = self.load()
+            manifest['stages'][record['stage']] = record
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=MANIFEST_FILE)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(manifest, f, indent=1)
+            os.replace(tmp, self.filename)
+
+
+def _rows(manifest):
+    for stage, record in manifest['stages'].items():
+        yield dict(record, scenario=manifest['scenario'], stage=stage)
+        for step, step_record in record.get('steps', {}).items():
+            yield dict(step_record, scenario=manifest['scenario'], stage=f"{stage}/{step}")
+
+
+def write_rollup(output_dir, csv_file=None):
+    """Write the records of all manifests in output_dir (and its scenario directories) to a CSV file; return its name"""
+    csv_file = csv_file or os.path.join(output_dir, ROLLUP_FILE)
+    manifests = [os.path.join(output_dir, MANIFEST_FILE)]
+    manifests += sorted(os.path.join(output_dir, d, MANIFEST_FILE) for d in os.listdir(output_dir))
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for filename in manifests:
+            if os.path.isfile(filename):
+                with open(filename) as fm:
+                    for row in _rows(json.load(fm)):
+                        writer.writerow(row)
+    return csv_file
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python -m py.instrument <output_dir>")
+    print(f"Performance of the stages written to {write_rollup(sys.argv[1])}")
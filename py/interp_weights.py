@@ -0,0 +1,101 @@
+"""
+Interpolation operator from the BingClaw grid to the grid of the Interface Module outputs
+
+The bilinear interpolation from a regular source grid (cell centres of the BingClaw
+grid) to the points of a target grid is stored as a sparse matrix W with 4 weights
+per target point, so that interpolating all frames is one sparse product:
+    z_target[frames, points] = (W @ z_source[frames, cells].T).T
+Target points outside the source grid get no weights (i.e. zero deformation);
+the indices of the target points inside the source grid are stored in 'inside'.
+
+Operators are saved in weights_cache_dir as .npz files, with a name that is a hash of
+the source grid (extent, spacing, size) and of the target grid coordinates, so that
+every scenario sharing the BingClaw domain and the target grid reuses the same file.
+"""
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+import scipy.sparse
+
+_weights = {}
+
+
+def axis_weights(x_source, x_target):
+    """
+    Return, for every target coordinate, the index of the source point on its left,
+    the weight of that point (the one on the right has 1 - weight) and whether the
+    target coordinate is inside the source grid
+    """
+    n = len(x_source)
+    dx = x_source[1] - x_source[0] if n > 1 else 1.0
+    inside = (x_target >= x_source[0] - 0.5 * dx) & (x_target <= x_source[-1] + 0.5 * dx)
+    # Target points between the edge of the grid and the first/last cell centre take the value of that cell
+    position = np.clip((x_target - x_source[0]) / dx, 0, n - 1)
+    left = np.minimum(np.floor(position).astype(np.int64), max(n - 2, 0))
+    weight = 1.0 - (position - left) if n > 1 else np.ones_like(position)
+    return left, weight, inside
+
+
+def build_weights(x_source, y_source, x_target, y_target):
+    """Return the sparse bilinear interpolation operator (rows: target points, columns: source cells) and the inside indices"""
+    nx, ny = len(x_source), len(y_source)
+    ix, wx, inside_x = axis_weights(x_source, x_target)
+    iy, wy, inside_y = axis_weights(y_source, y_target)
+
+    # Target points in row-major order (lat, lon), like the arrays in the NetCDF files
+    jj, ii = np.meshgrid(np.arange(len(y_target)), np.arange(len(x_target)), indexing='ij')
+    jj, ii = jj.ravel(), ii.ravel()
+    inside = np.flatnonzero(inside_y[jj] & inside_x[ii])
+    jj, ii = jj[inside], ii[inside]
+
+    x1 = np.minimum(ix[ii] + 1, nx - 1)
+    y1 = np.minimum(iy[jj] + 1, ny - 1)
+    cols = np.concatenate([iy[jj] * nx + ix[ii], iy[jj] * nx + x1, y1 * nx + ix[ii], y1 * nx + x1])
+    vals = np.concatenate([wy[jj] * wx[ii], wy[jj] * (1 - wx[ii]), (1 - wy[jj]) * wx[ii], (1 - wy[jj]) * (1 - wx[ii])])
+    rows = np.tile(inside, 4)
+    weights = scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(len(y_target) * len(x_target), ny * nx))
+    weights.eliminate_zeros()
+    return weights, inside
+
+
+def weights_key(x_source, y_source, x_target, y_target):
+    """Return the hash identifying the operator from the source grid to the target grid"""
+    sha = hashlib.sha256()
+    sha.update(f"source:{x_source[0]!r},{y_source[0]!r},{x_source[-1]!r},{y_source[-1]!r},{len(x_source)},{len(y_source)}\n".encode())
+    sha.update(np.ascontiguousarray(x_target, dtype=np.float64).tobytes())
+    sha.update(np.ascontiguousarray(y_target, dtype=np.float64).tobytes())
+    return sha.hexdigest()
+
+
+def load_or_build_weights(x_source, y_source, x_target, y_target, weights_cache_dir=None):
+    """Return the interpolation operator and inside indices, from memory, from weights_cache_dir or built from scratch"""
+    key = weights_key(x_source, y_source, x_target, y_target)
+    if key in _weights:
+        return _weights[key]
+
+    cache_file = os.path.join(weights_cache_dir, f"weights_{key}.npz") if weights_cache_dir is not None else None
+    if cache_file is not None and os.path.exists(cache_file):
+        with np.load(cache_file) as data:
+            weights = scipy.sparse.csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape']))
+            inside = data['inside']
+    else:
+        weights, inside = build_weights(x_source, y_source, x_target, y_target)
+        if cache_file is not None:
+            os.makedirs(weights_cache_dir, exist_ok=True)
+            tmp_fd, tmp_file = tempfile.mkstemp(suffix='.npz', dir=weights_cache_dir)
+            with os.fdopen(tmp_fd, 'wb') as f:
+                np.savez(f, data=weights.data, indices=weights.indices, indptr=weights.indptr,
+                         shape=np.array(weights.shape), inside=inside)
+            os.replace(tmp_file, cache_file)
+
+    _weights[key] = (weights, inside)
+    return weights, inside
+
+
+def interpolate(weights, frames, target_shape):
+    """Interpolate frames (nframes, ny_source, nx_source) to the target grid with one sparse product"""
+    nframes = frames.shape[0]
+    values = weights @ frames.reshape(nframes, -1).T
+    return np.asarray(values).T.reshape((nframes,) + tuple(target_shape))
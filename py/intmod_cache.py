@@ -0,0 +1,139 @@
+"""
+Content-addressed cache for the outputs of the Interface Module
+
+The key of a run is a hash of everything the Interface Module output depends on:
+the donor, the BingClaw output frames, the target bathymetry file, resolution, filter_type,
+the number of skipped frames and the git revision of the Interface Module.
+On a hit, the cached deformation and bathymetry NetCDF files are hard linked
+(or copied, if the cache is on another filesystem) into the Interface Module output
+directory instead of being recomputed. Outputs are copied into the cache, so the files of
+the output directory stay writable, and cached files are read-only, so that they cannot be
+modified through the links.
+The outputs of a prefix are the files named <prefix>_*. When the cache is larger than max_size_gb, the least
+recently used entries are removed.
+
+Input needed:
+ - cache_dir        # Directory where cached outputs are stored
+ - max_size_gb      # Maximum size of the cache (GB)
+"""
+
+import os
+import stat
+import errno
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+from py.bingclaw_frames import FRAME_FILE
+from py.intmod_worker import INTERFACE_MODULE
+
+_file_hashes = {}
+
+
+def file_hash(filename, chunk_size=2**20):
+    """Return the sha256 of a file; hashes are remembered until the file size or modification time change"""
+    st = os.stat(filename)
+    memo_key = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+        _file_hashes[memo_key] = sha.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def interface_module_revision(path=INTERFACE_MODULE):
+    """Return the git revision of the Interface Module (or the hash of interface_module.py if it is not a git checkout)"""
+    result = subprocess.run(['git', '-C', os.path.dirname(path), 'rev-parse', 'HEAD'], capture_output=True, text=True)
+    if result.returncode == 0:
+        return result.stdout.strip()
+    return 'file:' + file_hash(path)
+
+
+def link_or_copy(source, destination):
+    """Hard link source to destination, copy it if they are on different filesystems"""
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, destination)
+
+
+class IntmodCache:
+
+    def __init__(self, cache_dir, max_size_gb=50):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_gb * 1e9
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, bingclaw_output_dir, donor, bathymetry, resolution, filter_type, skip_frames=0, revision=None):
+        """Return the cache key of an Interface Module run"""
+        sha = hashlib.sha256()
+        sha.update(f"donor:{donor}\n".encode())
+        for fname in sorted(os.listdir(bingclaw_output_dir)):
+            if FRAME_FILE.match(fname):
+                sha.update(f"{fname}:{file_hash(os.path.join(bingclaw_output_dir, fname))}\n".encode())
+        sha.update(f"bathymetry:{file_hash(bathymetry)}\n".encode())
+        sha.update(f"resolution:{resolution}\nfilter_type:{filter_type}\nskip_frames:{skip_frames}\n".encode())
+        sha.update(f"revision:{revision or interface_module_revision()}\n".encode())
+        return sha.hexdigest()
+
+    def fetch(self, key, intmod_output_dir, prefix):
+        """Link cached outputs of key into intmod_output_dir with the given prefix; return False if key is not cached"""
+        entry = os.path.join(self.cache_dir, key)
+        with self.lock:
+            if not os.path.isdir(entry):
+                self.misses += 1
+                return False
+            self.hits += 1
+            os.utime(entry)   # Used for LRU eviction
+            for suffix in os.listdir(entry):
+                link_or_copy(os.path.join(entry, suffix), os.path.join(intmod_output_dir, prefix + suffix))
+        return True
+
+    def store(self, key, intmod_output_dir, prefix):
+        """Store a copy of the files <prefix>_* of intmod_output_dir as the outputs of key"""
+        entry = os.path.join(self.cache_dir, key)
+        tmp_entry = tempfile.mkdtemp(prefix=f".{key}.", dir=self.cache_dir)
+        for fname in os.listdir(intmod_output_dir):
+            source = os.path.join(intmod_output_dir, fname)
+            if fname.startswith(prefix + '_') and os.path.isfile(source):
+                # Copied, not linked: making the cached file read-only must not change the output file
+                cached = os.path.join(tmp_entry, fname[len(prefix):])
+                shutil.copy2(source, cached)
+                os.chmod(cached, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        with self.lock:
+            if os.path.isdir(entry):
+                shutil.rmtree(tmp_entry)
+            else:
+                os.rename(tmp_entry, entry)
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache is smaller than max_size"""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry)
+            total -= size
+            print(f"Removed {entry} from Interface Module cache")
+
+    def summary(self):
+        return f"Interface Module cache: {self.hits} hits, {self.misses} misses"
@@ -0,0 +1,273 @@
+"""
+Workflow implementation of the BingClaw-to-HySEA conversion done by the Interface Module,
+used by run_interface_module when engine is 'native'.
+EXPERIMENTAL: this re-implements the physics of the Interface Module (deformation as the change of
+landslide thickness since frame 0, grid spacing from a spherical METRES_PER_DEGREE) and has not
+been validated against its output yet: run python -m py.intmod_reference check (see
+py/intmod_reference.py) once the Interface Module reference is stored.
+
+ - reads the BingClaw frames (or takes shared_frames, the frames already read by load_frames of
+   py/variants.py) and computes the ground deformation of every frame as the change in
+   landslide thickness (q component thickness_component) since the first frame
+ - with frame_tolerance, keeps only the frames whose thickness changed by more than frame_tolerance
+   since the last frame kept (see py/frame_selection.py), so that fewer frames are interpolated,
+   filtered and written
+ - reads the HySEA bathymetry (variable elevation, z or depth, in m; depth, or positive = 'down', is
+   turned into elevation, positive up, and a grid without cells below sea level is rejected)
+ - builds the target grid from the HySEA bathymetry at the given resolution and
+   interpolates the bathymetry on it (the parsed target grid is kept in memory, so
+   scenarios run in the same process do not read the bathymetry again)
+ - interpolates all frames on the target grid with the cached sparse operator of
+   py/interp_weights.py, i.e. one sparse product for all frames
+ - with crop_threshold, interpolates, filters and writes only the active region of the target grid,
+   where the deformation is above crop_threshold in some frame, plus crop_halo (see py/active_region.py).
+   With filter_type 'kajiura' the halo also covers the support of the filter, SUPPORT_DEPTHS times the
+   largest depth in the window (see kajiura_window), so no filtered deformation is cut at its edges
+ - with filter_type 'kajiura', filters the deformation with the Kajiura filter at the depth of
+   the target grid (see py/kajiura.py), in the frequency domain (kajiura_method 'fft') or in
+   space (kajiura_method 'direct', the reference implementation)
+ - writes <casename>_bathymetry.nc and <casename>_deformation.nc, with one time step of the
+   deformation per chunk and the compression and precision of storage (see
+   py/deformation_storage.py); unless storage is the default one, the deformation file is read
+   back and checked (check_round_trip)
+NetCDF files are opened while holding netcdf_lock, since the HDF5 library is not thread safe:
+conversions running in threads of the same process (e.g. the variants of py/variants.py) only
+compute in parallel.
+
+Input needed:
+ - bingclaw_output_dir   # Bingclaw scenario output directory
+ - bathymetry            # Bathymetry file (where results of BingClaw are interpolated on)
+ - resolution            # Resolution of the target grid (m)
+ - filter_type           # Filter for deformation data ('none' or 'kajiura')
+ - casename              # String used to name output files (including directory where files are saved)
+ - skip_frames           # Number of leading timesteps to drop from the deformation output (see run_interface_module.py)
+ - weights_cache_dir     # Directory where interpolation operators are saved and reused (None: keep them only in memory)
+ - kajiura_method        # Implementation of the Kajiura filter: 'fft' (default) or 'direct'
+ - storage               # Storage of the deformation (default None: uncompressed 'f8')
+ - frame_tolerance       # Change of landslide thickness (m) above which a frame is kept (default None: all frames)
+ - stop_when_stationary  # End the deformation series at the last frame kept (see py/frame_selection.py)
+ - crop_threshold        # Deformation (m) above which a cell belongs to the active region (default None: no cropping)
+ - crop_halo             # Distance (m) added around the active region (default 5000)
+ - shared_frames         # Frames of bingclaw_output_dir read by load_frames (default None: read them here)
+"""
+
+import os
+import sys
+import threading
+import numpy as np
+from datetime import datetime
+from netCDF4 import Dataset
+
+from py.bingclaw_frames import list_frames, read_frame, read_frame_time, read_frame_grid, grid_centres
+from py.interp_weights import load_or_build_weights, interpolate
+from py.kajiura import kajiura, METHODS as KAJIURA_METHODS, SUPPORT_DEPTHS
+from py.deformation_storage import deformation_storage, is_default, z_settings, check_round_trip
+from py.frame_selection import select_frames
+from py.active_region import CROP_HALO, footprint, halo_cells, target_window, window_weights, window_size
+from py.instrument import measure
+
+METRES_PER_DEGREE = 111195.0   # Length of one degree of latitude (m)
+COORDINATE_NAMES = {'lon': ('lon', 'longitude', 'x'), 'lat': ('lat', 'latitude', 'y')}
+BATHYMETRY_NAMES = ('elevation', 'z', 'depth')
+METRE_UNITS = ('m', 'meter', 'meters', 'metre', 'metres')
+
+_target_grids = {}
+netcdf_lock = threading.RLock()
+
+
+def read_coordinates(ds, filename):
+    """Return lon, lat (1-D) of the open NetCDF file ds"""
+    names = {name.lower(): name for name in ds.variables}
+    coords = {}
+    for coord, candidates in COORDINATE_NAMES.items():
+        found = [names[c] for c in candidates if c in names]
+        if not found:
+            sys.exit(f"Cannot find {coord} coordinate in {filename}")
+        coords[coord] = ds[found[0]][:].astype(np.float64)
+    return coords['lon'], coords['lat']
+
+
+def read_bathymetry(bathymetry):
+    """Return lon, lat (1-D) and z (2-D: lat, lon; elevation (m), positive up) of a bathymetry NetCDF file"""
+    with netcdf_lock, Dataset(bathymetry) as ds:
+        lon, lat = read_coordinates(ds, bathymetry)
+        names = {name.lower(): name for name in ds.variables}
+        found = [names[name] for name in BATHYMETRY_NAMES if name in names]
+        if not found:
+            sys.exit(f"Cannot find the bathymetry in {bathymetry}: no variable {', '.join(BATHYMETRY_NAMES)}")
+        var = ds[found[0]]
+        if var.shape != (len(lat), len(lon)):
+            sys.exit(f"Bathymetry {found[0]} of {bathymetry} has shape {var.shape}, not (lat, lon) {(len(lat), len(lon))}")
+        units = var.getncattr('units') if 'units' in var.ncattrs() else 'm'
+        if units.lower() not in METRE_UNITS:
+            sys.exit(f"Bathymetry {found[0]} of {bathymetry} is in {units}, not m")
+        positive = var.getncattr('positive') if 'positive' in var.ncattrs() else ('down' if found[0].lower() == 'depth' else 'up')
+        z = np.ma.filled(var[:].astype(np.float64), np.nan)
+    if positive.lower() == 'down':
+        z = -z
+    if not np.any(z < 0):
+        sys.exit(f"Bathymetry {found[0]} of {bathymetry} has no cell below sea level: "
+                 f"expected elevation positive up (or depth positive down)")
+    return lon, lat, z
+
+
+def target_grid(bathymetry, resolution, weights_cache_dir=None):
+    """Return lon, lat and bathymetry of the target grid with spacing resolution (m) covering the bathymetry file"""
+    st = os.stat(bathymetry)
+    key = (os.path.abspath(bathymetry), st.st_mtime_ns, float(resolution))
+    if key not in _target_grids:
+        lon, lat, z = read_bathymetry(bathymetry)
+        dlat = resolution / METRES_PER_DEGREE
+        dlon = resolution / (METRES_PER_DEGREE * np.cos(np.radians(lat.mean())))
+        if np.isclose(dlon, lon[1] - lon[0], rtol=0.01) and np.isclose(dlat, lat[1] - lat[0], rtol=0.01):
+            # Bathymetry is already at the required resolution
+            _target_grids[key] = (lon, lat, z)
+        else:
+            lon_target = lon[0] + np.arange(int((lon[-1] - lon[0]) / dlon) + 1) * dlon
+            lat_target = lat[0] + np.arange(int((lat[-1] - lat[0]) / dlat) + 1) * dlat
+            weights, _ = load_or_build_weights(lon, lat, lon_target, lat_target, weights_cache_dir)
+            z_target = interpolate(weights, z[np.newaxis], (len(lat_target), len(lon_target)))[0]
+            _target_grids[key] = (lon_target, lat_target, z_target)
+    return _target_grids[key]
+
+
+def grid_spacing(lon, lat):
+    """Return the spacing dx, dy (m) of a regular lon, lat grid"""
+    dy = (lat[1] - lat[0]) * METRES_PER_DEGREE if len(lat) > 1 else 1.0
+    dx = (lon[1] - lon[0]) * METRES_PER_DEGREE * np.cos(np.radians(lat.mean())) if len(lon) > 1 else 1.0
+    return abs(dx), abs(dy)
+
+
+def _create_grid_file(filename, lon, lat, title, description):
+    ds = Dataset(filename, mode='w', format='NETCDF4')
+    ds.title = title
+    ds.history = f"Created {datetime.today().strftime('%d/%m/%y')} by bingclaw-to-hysea"
+    ds.description = description
+    ds.createDimension('lon', len(lon))
+    ds.createDimension('lat', len(lat))
+    var = ds.createVariable('lon', 'f8', ('lon',))
+    var.units = 'degrees_east'
+    var[:] = lon
+    var = ds.createVariable('lat', 'f8', ('lat',))
+    var.units = 'degrees_north'
+    var[:] = lat
+    return ds
+
+
+def write_bathymetry(filename, lon, lat, z):
+    """Write the bathymetry of the target grid"""
+    with _create_grid_file(filename, lon, lat, 'Bathymetry', 'Bathymetry interpolated on the target grid') as ds:
+        var = ds.createVariable('z', 'f8', ('lat', 'lon'))
+        var.units = 'm'
+        var[:] = z
+
+
+def create_deformation_file(filename, lon, lat, storage=None):
+    """Create the deformation file with an unlimited time dimension; frames are added with append_deformation"""
+    ds = _create_grid_file(filename, lon, lat, 'Deformation', 'Ground deformation from BingClaw interpolated on the target grid')
+    ds.createDimension('time', None)
+    var = ds.createVariable('time', 'f8', ('time',))
+    var.units = 'seconds'
+    datatype, settings = z_settings(storage or deformation_storage(), (len(lat), len(lon)))
+    var = ds.createVariable('z', datatype, ('time', 'lat', 'lon'), **settings)
+    var.units = 'm'
+    return ds
+
+
+def append_deformation(ds, times, z):
+    """Append frames z (nframes, lat, lon) at times to the deformation file"""
+    start = len(ds.dimensions['time'])
+    ds['time'][start:start + len(times)] = times
+    ds['z'][start:start + len(times)] = z
+
+
+def kajiura_window(x_source, y_source, active, lon, lat, z, halo):
+    """Return the window (rows, cols) of the target grid covering the active region of the source grid plus a halo of
+    at least halo (m) and of SUPPORT_DEPTHS times the largest depth in the window, and that halo"""
+    while True:
+        window = target_window(x_source, y_source, active, lon, lat, *halo_cells(halo, *grid_spacing(lon, lat)))
+        support = SUPPORT_DEPTHS * max(np.nanmax(-z[window]), 0.0)
+        if support <= halo:
+            return window, halo
+        halo = support
+
+
+def read_thickness(bingclaw_output_dir, frames, thickness_component=0):
+    """Return landslide thickness (nframes, my, mx) and times of the frames"""
+    thickness = np.stack([read_frame(bingclaw_output_dir, frame)[thickness_component] for frame in frames])
+    times = np.array([read_frame_time(bingclaw_output_dir, frame)['time'] for frame in frames])
+    return thickness, times
+
+
+def run_intmod_native(bingclaw_output_dir, bathymetry, resolution, filter_type, casename,
+                      skip_frames=0, weights_cache_dir=None, thickness_component=0, kajiura_method='fft', storage=None,
+                      frame_tolerance=None, stop_when_stationary=True, crop_threshold=None, crop_halo=CROP_HALO,
+                      shared_frames=None):
+    if filter_type not in ('none', 'kajiura'):
+        sys.exit(f"Filter '{filter_type}' is not available with engine 'native'. Options are 'none' or 'kajiura'")
+    if filter_type == 'kajiura' and kajiura_method not in KAJIURA_METHODS:
+        sys.exit(f"{kajiura_method} is not a valid Kajiura method. Options are 'fft' or 'direct'")
+
+    if shared_frames is not None:
+        if (shared_frames['bingclaw_output_dir'], shared_frames['thickness_component']) != (os.path.abspath(bingclaw_output_dir), thickness_component):
+            sys.exit(f"Shared frames are component {shared_frames['thickness_component']} of {shared_frames['bingclaw_output_dir']}, "
+                     f"not component {thickness_component} of {bingclaw_output_dir}")
+        frames, thickness, times = shared_frames['frames'], shared_frames['thickness'], shared_frames['times']
+    else:
+        frames = list_frames(bingclaw_output_dir)
+    if len(frames) <= skip_frames:
+        sys.exit(f"Cannot skip {skip_frames} frames: {bingclaw_output_dir} has only {len(frames)} frames")
+    if shared_frames is None:
+        with measure('load'):
+            thickness, times = read_thickness(bingclaw_output_dir, frames, thickness_component)
+    kept = np.arange(len(frames))
+    if frame_tolerance is not None:
+        with measure('select_frames'):
+            kept = np.array(select_frames(thickness, frame_tolerance, stop_when_stationary, skip_frames + 1))
+            thickness = thickness[kept]
+        print(f"Kept {len(kept)} of {len(frames)} BingClaw frames (frame_tolerance {frame_tolerance} m)")
+    deformation = thickness - thickness[0]
+
+    # Interpolate all frames on the target grid
+    with measure('target_grid'):
+        lon, lat, z = target_grid(bathymetry, resolution, weights_cache_dir)
+        x_source, y_source = grid_centres(read_frame_grid(bingclaw_output_dir, frames[0]))
+        weights, _ = load_or_build_weights(x_source, y_source, lon, lat, weights_cache_dir)
+
+    # Restrict the target grid to the active region
+    rows, cols = slice(None), slice(None)
+    if crop_threshold is not None:
+        with measure('active_region'):
+            window = footprint(deformation, crop_threshold)
+            if window is None:
+                print(f"WARNING: No deformation above {crop_threshold} m; the deformation is not cropped")
+            else:
+                if filter_type == 'kajiura':
+                    window, halo = kajiura_window(x_source, y_source, window, lon, lat, z, crop_halo)
+                    if halo > crop_halo:
+                        print(f"Halo of the active region widened from {crop_halo} m to {halo:.0f} m, the support of the Kajiura filter")
+                else:
+                    window = target_window(x_source, y_source, window, lon, lat, *halo_cells(crop_halo, *grid_spacing(lon, lat)))
+                weights = window_weights(weights, window, (len(lat), len(lon)))
+                rows, cols = window
+                print(f"Deformation cropped to the active region: {window_size(window)} of {len(lat) * len(lon)} cells")
+    lon_window, lat_window = lon[cols], lat[rows]
+
+    # Drop leading frames, keeping the times of the first frames (as remove_first_timestep does)
+    with measure('interpolate'):
+        deformation = interpolate(weights, deformation[skip_frames:], (len(lat_window), len(lon_window)))
+        times = times[kept[skip_frames:] - skip_frames]
+
+    if filter_type == 'kajiura':
+        with measure('filter'):
+            dx, dy = grid_spacing(lon, lat)
+            deformation = kajiura(deformation, dx, dy, -np.nan_to_num(z[rows, cols], nan=0.0), kajiura_method)
+
+    with measure('write'), netcdf_lock:
+        write_bathymetry(casename + '_bathymetry.nc', lon, lat, z)
+        with create_deformation_file(casename + '_deformation.nc', lon_window, lat_window, storage) as ds:
+            append_deformation(ds, times, deformation)
+    if storage is not None and not is_default(storage):
+        with measure('check'), netcdf_lock:
+            check_round_trip(casename + '_deformation.nc', deformation, storage)
+    return 0
@@ -0,0 +1,125 @@
+"""
+Regression check of engine 'native' (py/intmod_native.py) against the Interface Module
+
+Both convert the same small synthetic case (frames and bathymetry of py/synthetic.py, filter 'none'):
+ - write_reference runs the Interface Module on the case and stores its bathymetry and deformation
+   files in reference_dir. Run it once where the Interface Module is installed and commit the files
+ - check_native runs engine 'native' on the case and compares its output with the reference: same
+   target grid and times, bathymetry and deformation within TOLERANCE of their largest absolute value
+Usage: python -m py.intmod_reference write|check [reference_dir]   (exit code 1 if the check fails)
+
+Input needed:
+ - reference_dir    # Directory of the stored Interface Module output (default benchmarks/intmod_reference)
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from netCDF4 import Dataset
+
+from py.synthetic import write_frames, write_bathymetry
+from py.run_interface_module import run_interface_module
+from py.intmod_native import read_bathymetry, read_coordinates, netcdf_lock
+from py.deformation_storage import read_values
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE_DIR = os.path.join(REPO_DIR, 'benchmarks', 'intmod_reference')
+MX, MY, NFRAMES = 60, 40, 6     # BingClaw grid and number of frames of the case
+RESOLUTION = 200                # Resolution of the target grid (m)
+FILTER_TYPE = 'none'
+PREFIX = 'filter' + FILTER_TYPE + '_res' + str(RESOLUTION)
+TOLERANCE = 0.01                # Largest difference allowed, relative to the largest absolute value of the reference
+GRID_TOLERANCE = 1e-6           # Largest difference allowed between coordinates (degrees) and times (s)
+
+
+def convert(work_dir, engine):
+    """Write the synthetic case in work_dir, convert it with engine and return the output directory"""
+    bingclaw_output_dir = os.path.join(work_dir, 'bingclaw_out')
+    hysea_input_dir = os.path.join(work_dir, 'hysea_inputs')
+    intmod_output_dir = os.path.join(work_dir, 'intmod_out')
+    write_frames(bingclaw_output_dir, MX, MY, NFRAMES, RESOLUTION, 'ascii')
+    os.makedirs(hysea_input_dir, exist_ok=True)
+    write_bathymetry(os.path.join(hysea_input_dir, 'bathymetry.nc'), MX, MY, RESOLUTION)
+    exit_code = run_interface_module(bingclaw_output_dir, intmod_output_dir, hysea_input_dir, 'bingclaw', 'bathymetry.nc',
+                                     RESOLUTION, FILTER_TYPE, os.path.join(intmod_output_dir, PREFIX), engine=engine)
+    if exit_code != 0:
+        sys.exit(f"Engine '{engine}' failed on the reference case with exit code {exit_code}")
+    return intmod_output_dir
+
+
+def write_reference(reference_dir=REFERENCE_DIR):
+    """Run the Interface Module on the synthetic case and store its output in reference_dir"""
+    os.makedirs(reference_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_dir = convert(work_dir, 'intmod')
+        for kind in ('bathymetry', 'deformation'):
+            shutil.copy2(os.path.join(output_dir, f"{PREFIX}_{kind}.nc"), os.path.join(reference_dir, f"{PREFIX}_{kind}.nc"))
+    print(f"Interface Module reference written to {reference_dir}")
+
+
+def read_deformation(filename):
+    """Return lon, lat, time and z (time, lat, lon) of a deformation file"""
+    with netcdf_lock, Dataset(filename) as ds:
+        lon, lat = read_coordinates(ds, filename)
+        return lon, lat, ds['time'][:].astype(np.float64), read_values(ds['z'], 0, len(ds['time']))
+
+
+def relative_error(values, reference):
+    """Return the largest difference between values and reference, relative to the largest absolute value of reference"""
+    scale = np.nanmax(np.abs(reference))
+    return np.nanmax(np.abs(values - reference)) / scale if scale > 0 else np.nanmax(np.abs(values))
+
+
+def compare(filename, reference, kind):
+    """Return the failures (list of messages) of the bathymetry or deformation file filename against reference"""
+    if kind == 'bathymetry':
+        values, expected = read_bathymetry(filename), read_bathymetry(reference)
+        names = ('lon', 'lat', 'z')
+    else:
+        values, expected = read_deformation(filename), read_deformation(reference)
+        names = ('lon', 'lat', 'time', 'z')
+    failures = []
+    for name, value, ref in zip(names, values, expected):
+        if value.shape != ref.shape:
+            failures.append(f"{kind} {name} has shape {value.shape}, reference {ref.shape}")
+        elif name != 'z' and not np.allclose(value, ref, rtol=0, atol=GRID_TOLERANCE):
+            failures.append(f"{kind} {name} differs from the reference by {np.max(np.abs(value - ref))}")
+        elif name == 'z':
+            error = relative_error(value, ref)
+            print(f"{kind}: largest difference {error:.2e} of the largest value (tolerance {TOLERANCE})")
+            if not np.array_equal(np.isnan(value), np.isnan(ref)):
+                failures.append(f"{kind} missing values differ from the reference")
+            elif error > TOLERANCE:
+                failures.append(f"{kind} differs from the reference by {error:.2e} of the largest value")
+    return failures
+
+
+def check_native(reference_dir=REFERENCE_DIR):
+    """Run engine 'native' on the synthetic case and return the failures of its output against the reference"""
+    for kind in ('bathymetry', 'deformation'):
+        if not os.path.exists(os.path.join(reference_dir, f"{PREFIX}_{kind}.nc")):
+            sys.exit(f"No Interface Module reference in {reference_dir}: write it with python -m py.intmod_reference write")
+    failures = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_dir = convert(work_dir, 'native')
+        for kind in ('bathymetry', 'deformation'):
+            failures += compare(os.path.join(output_dir, f"{PREFIX}_{kind}.nc"),
+                                os.path.join(reference_dir, f"{PREFIX}_{kind}.nc"), kind)
+    return failures
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ('write', 'check'):
+        sys.exit("Usage: python -m py.intmod_reference write|check [reference_dir]")
+    reference_dir = sys.argv[2] if len(sys.argv) == 3 else REFERENCE_DIR
+    if sys.argv[1] == 'write':
+        write_reference(reference_dir)
+    else:
+        failures = check_native(reference_dir)
+        for failure in failures:
+            print(f"FAILED: {failure}")
+        if not failures:
+            print("Engine 'native' matches the Interface Module reference")
+        sys.exit(1 if failures else 0)
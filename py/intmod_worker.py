@@ -0,0 +1,82 @@
+"""
+Functions to run the Interface Module inside a Python process instead of
+launching 'python Interface-module/interface_module.py' for every scenario.
+
+ - call_interface_module: runs Interface-module/interface_module.py in the current
+   process with the given command line arguments. The modules it imports (numpy,
+   scipy, netCDF4, vtk, pyvista and the Interface Module's own modules) stay in
+   sys.modules, so only the first call pays for importing them.
+ - IntmodPool: pool of persistent worker processes that import those modules when
+   they start and then run one scenario after the other, so that every scenario
+   only pays for its own interpolation/filtering work.
+
+The Interface Module parses its arguments with argparse, so sys.argv is set to the
+arguments of the run while it executes. Because sys.argv is global, calls in the same
+process are serialized; use IntmodPool to run several scenarios at the same time.
+"""
+
+import os
+import sys
+import runpy
+import threading
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+INTERFACE_MODULE = os.path.join(os.getcwd(), 'Interface-module', 'interface_module.py')
+
+# Modules imported by the Interface Module that are expensive to import
+HEAVY_IMPORTS = ['numpy', 'scipy', 'scipy.interpolate', 'scipy.ndimage', 'netCDF4', 'pyproj', 'vtk', 'pyvista', 'seissolxdmf']
+
+_lock = threading.Lock()
+
+
+def call_interface_module(args, path=INTERFACE_MODULE):
+    """Run the Interface Module with the command line arguments args in this process and return its exit code"""
+    with _lock:
+        argv = sys.argv
+        sys.argv = [path] + [str(a) for a in args]
+        module_dir = os.path.dirname(path)
+        if module_dir not in sys.path:
+            sys.path.insert(0, module_dir)
+        try:
+            runpy.run_path(path, run_name='__main__')
+            return 0
+        except SystemExit as err:
+            if err.code is None or isinstance(err.code, int):
+                return err.code or 0
+            print(err.code)
+            return 1
+        finally:
+            sys.argv = argv
+
+
+def warm_up(modules=HEAVY_IMPORTS):
+    """Import the modules used by the Interface Module, skipping those that are not installed"""
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+class IntmodPool:
+    """Pool of worker processes that keep the Interface Module dependencies imported between scenarios"""
+
+    def __init__(self, workers=1, path=INTERFACE_MODULE):
+        self.path = path
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=warm_up)
+
+    def run(self, args):
+        """Run the Interface Module with the command line arguments args in one of the workers and return its exit code"""
+        return self.executor.submit(call_interface_module, [str(a) for a in args], self.path).result()
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,179 @@
+"""
+Kajiura filter of the ground deformation, used by engine 'native' of run_interface_module
+
+The sea surface displacement produced by a deformation of the sea floor at depth h is
+the deformation smoothed by the Kajiura (1963) Green function G(r/h)/h^2, whose
+transform is the transfer function 1/cosh(k h) (k: wavenumber). Cells on land
+(depth <= 0) are not filtered; water shallower than a tenth of the grid spacing (for which
+the filter does almost nothing) is taken as that deep.
+
+ - method 'fft':    the filter is applied in the frequency domain. The depth of the grid is
+                    covered by a geometric sequence of depth levels (ratio level_ratio); every
+                    batch of frames is transformed once (rfft2, multithreaded), multiplied by the
+                    transfer function of each level and transformed back, and each cell takes
+                    the result of the two levels around its depth, interpolated in log(depth).
+                    The frames are zero-padded by pad_depths times the largest depth, so the
+                    edges behave as in the direct method. Transfer functions are cached per
+                    grid shape, spacing and depth field (see kajiura_filter), so all scenarios on
+                    the same target grid share them.
+ - method 'direct': the reference implementation: convolution in space with the Green function
+                    at the depth of every cell, truncated at radius_depths times the depth and
+                    normalised to 1. Its cost grows with (depth / resolution)^2.
+
+The two methods agree within TOLERANCE times the largest absolute deformation: check_tolerance
+measures it, and the benchmarks stop if it is exceeded (check_kajiura in py/benchmark.py).
+
+Input needed:
+ - deformation      # Deformation frames (nframes, lat, lon) on the target grid (m)
+ - dx, dy           # Spacing of the target grid (m)
+ - depth            # Water depth of the target grid (lat, lon) (m, positive below sea level)
+ - method           # 'fft' (default) or 'direct'
+"""
+
+import os
+import sys
+import hashlib
+import threading
+import numpy as np
+import scipy.fft
+
+METHODS = ('fft', 'direct')
+TOLERANCE = 0.01       # Largest difference between 'fft' and 'direct', relative to the largest absolute deformation
+SHALLOW = 0.1          # Smallest depth used by the filter, relative to the grid spacing
+GREEN_TERMS = 200      # Terms of the series of the Green function
+SUPPORT_DEPTHS = 5.0   # Support of the filter (zero padding of 'fft', radius of 'direct'), in depths
+
+_filters = {}
+_lock = threading.Lock()
+
+
+def green(r):
+    """Kajiura Green function G(r) for r = distance / depth, with integral 1 over the plane"""
+    n = np.arange(GREEN_TERMS)
+    k = 2 * n + 1
+    terms = (-1.0)**n * k / (k**2 + np.asarray(r, dtype=np.float64)[..., np.newaxis]**2)**1.5
+    # Alternating series: mean of the last two partial sums
+    return (2 * terms.sum(axis=-1) - terms[..., -1]) / (2 * np.pi)
+
+
+def filter_depth(depth, dx, dy):
+    """Return the cells in water and the depth used by the filter"""
+    wet = depth > 0
+    return wet, np.maximum(np.where(wet, depth, 0.0), SHALLOW * min(dx, dy))
+
+
+def inverse_cosh(x):
+    """1/cosh(x) without overflow for large x"""
+    e = np.exp(-np.abs(x))
+    return 2 * e / (1 + e * e)
+
+
+class KajiuraFilter:
+    """Kajiura filter of frames on a grid of shape (lat, lon) with spacing dx, dy and water depth depth, in the frequency domain"""
+
+    def __init__(self, shape, dx, dy, depth, level_ratio=1.2, pad_depths=SUPPORT_DEPTHS):
+        self.shape = tuple(shape)
+        self.wet, h = filter_depth(depth, dx, dy)
+        hmin, hmax = (h[self.wet].min(), h[self.wet].max()) if self.wet.any() else (h.min(), h.min())
+
+        # Depth levels and, for every cell, the level below its depth and the weight of the one above
+        nlevels = int(np.ceil(np.log(hmax / hmin) / np.log(level_ratio))) + 1 if hmax > hmin else 1
+        self.levels = hmin * (hmax / hmin)**(np.arange(nlevels) / max(nlevels - 1, 1))
+        position = np.log(h / hmin) / np.log(hmax / hmin) * (nlevels - 1) if nlevels > 1 else np.zeros(self.shape)
+        self.lower = np.clip(np.floor(position).astype(np.int64), 0, max(nlevels - 2, 0))
+        self.upper_weight = np.clip(position - self.lower, 0, 1)
+
+        # Zero-padded grid and transfer function of every level
+        ny, nx = self.shape
+        pad_y, pad_x = int(np.ceil(pad_depths * hmax / dy)), int(np.ceil(pad_depths * hmax / dx))
+        self.padded = (scipy.fft.next_fast_len(ny + 2 * pad_y, real=True), scipy.fft.next_fast_len(nx + 2 * pad_x, real=True))
+        ky = 2 * np.pi * scipy.fft.fftfreq(self.padded[0], dy)
+        kx = 2 * np.pi * scipy.fft.rfftfreq(self.padded[1], dx)
+        k = np.sqrt(ky[:, np.newaxis]**2 + kx[np.newaxis, :]**2)
+        self.transfer = np.stack([inverse_cosh(k * level) for level in self.levels]).astype(np.float32)
+
+    def level_weights(self, level):
+        """Return the weight of the result of level for every cell"""
+        weights = np.where(self.lower == level, 1 - self.upper_weight, 0.0)
+        if level > 0:
+            weights += np.where(self.lower == level - 1, self.upper_weight, 0.0)
+        return np.where(self.wet, weights, 0.0)
+
+    def apply(self, deformation, batch_size=8, workers=None):
+        """Return the filtered deformation (nframes, lat, lon), transforming batch_size frames at a time"""
+        workers = workers or os.cpu_count()
+        ny, nx = self.shape
+        weights = [self.level_weights(level) for level in range(len(self.levels))]
+        filtered = np.array(deformation, dtype=np.float64, copy=True)
+        for start in range(0, len(deformation), batch_size):
+            batch = deformation[start:start + batch_size]
+            spectrum = scipy.fft.rfft2(batch, s=self.padded, workers=workers)
+            result = np.zeros(batch.shape)
+            for level, transfer in enumerate(self.transfer):
+                if not weights[level].any():
+                    continue
+                smoothed = scipy.fft.irfft2(spectrum * transfer, s=self.padded, workers=workers)[:, :ny, :nx]
+                result += weights[level] * smoothed
+            filtered[start:start + batch_size][:, self.wet] = result[:, self.wet]
+        return filtered
+
+
+def depth_key(shape, dx, dy, depth, level_ratio):
+    sha = hashlib.sha256()
+    sha.update(f"{shape}:{dx!r}:{dy!r}:{level_ratio!r}\n".encode())
+    sha.update(np.ascontiguousarray(depth, dtype=np.float64).tobytes())
+    return sha.hexdigest()
+
+
+def kajiura_filter(dx, dy, depth, level_ratio=1.2):
+    """Return the KajiuraFilter of the grid (built once per grid shape, spacing and depth field)"""
+    key = depth_key(depth.shape, dx, dy, depth, level_ratio)
+    if key not in _filters:
+        kfilter = KajiuraFilter(depth.shape, dx, dy, depth, level_ratio)
+        with _lock:
+            _filters[key] = kfilter
+    return _filters[key]
+
+
+def kajiura_direct(deformation, dx, dy, depth, radius_depths=SUPPORT_DEPTHS):
+    """Return the filtered deformation (nframes, lat, lon), by convolution in space with the Green function"""
+    wet, h = filter_depth(depth, dx, dy)
+    radius = radius_depths * h[wet].max() if wet.any() else 0.0
+    ry, rx = int(radius // dy), int(radius // dx)
+    table_r = np.linspace(0, radius_depths, 2001)
+    table_g = green(table_r)
+
+    ny, nx = depth.shape
+    padded = np.zeros((len(deformation), ny + 2 * ry, nx + 2 * rx))
+    padded[:, ry:ry + ny, rx:rx + nx] = deformation
+    total = np.zeros(deformation.shape)
+    norm = np.zeros(depth.shape)
+    for a in range(-ry, ry + 1):
+        for b in range(-rx, rx + 1):
+            r = np.hypot(a * dy, b * dx) / h
+            weight = np.where(r <= radius_depths, np.interp(r, table_r, table_g), 0.0) / h**2
+            if not weight.any():
+                continue
+            norm += weight
+            total += weight * padded[:, ry + a:ry + a + ny, rx + b:rx + b + nx]
+    filtered = np.array(deformation, dtype=np.float64, copy=True)
+    filtered[:, wet] = total[:, wet] / norm[wet]
+    return filtered
+
+
+def kajiura(deformation, dx, dy, depth, method='fft'):
+    """Return the deformation (nframes, lat, lon) filtered with method 'fft' or 'direct'"""
+    if method == 'fft':
+        return kajiura_filter(dx, dy, depth).apply(deformation)
+    elif method == 'direct':
+        return kajiura_direct(deformation, dx, dy, depth)
+    sys.exit(f"{method} is not a valid Kajiura method. Options are 'fft' or 'direct'")
+
+
+def check_tolerance(deformation, dx, dy, depth):
+    """Return the largest difference between methods 'fft' and 'direct', relative to the largest absolute deformation"""
+    scale = np.abs(deformation).max()
+    if scale == 0:
+        return 0.0
+    difference = np.abs(kajiura(deformation, dx, dy, depth, 'fft') - kajiura(deformation, dx, dy, depth, 'direct')).max()
+    return difference / scale
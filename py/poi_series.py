@@ -0,0 +1,194 @@
+"""
+Functions to extract the time series of the POIs (points of interest) from the T-HySEA output grids
+
+ - read_pois: reads the POI file passed to T-HySEA (number of POIs on the first line, then
+   'lon lat' per line); parsed once and kept in memory until the file changes
+ - PoiIndex: grid indices and bilinear weights of all POIs on a T-HySEA grid, and the window
+   of the grid containing them. Indices are computed once per grid and POI file, and reused
+   for all scenarios written on the same grid (see poi_index)
+ - extract_pois: reads each variable of the T-HySEA output file in chunks of timesteps
+   (one read of the POI window per chunk) and interpolates all POIs at once. Dry or masked
+   cells are left out of the interpolation; POIs with no wet cell around them get NaN.
+   Writes <post_output_dir>/<casename>_pois.nc with the series (time, poi) of every variable
+   and their maximum over time (max_<variable>)
+
+Input needed:
+ - hysea_output_dir     # T-HySEA output directory of the scenario
+ - post_output_dir      # Directory where the POI time series are saved
+ - casename             # Casename used in Interface Module and T-HySEA to name output files (e.g. params['filename_prefix'])
+ - pois_file            # File with the list of POIs (e.g. inputs/hysea_inputs/Messina_pois.dat)
+ - variables            # Variables of the T-HySEA output extracted at the POIs (default ['eta'])
+"""
+
+import os
+import sys
+import hashlib
+import threading
+import numpy as np
+from datetime import datetime
+from netCDF4 import Dataset
+
+from py.interp_weights import axis_weights
+from py.intmod_native import COORDINATE_NAMES
+
+CHUNK_BYTES = 256 * 1024**2     # Memory used by one chunk of timesteps of the POI window
+
+_pois = {}
+_indices = {}
+_lock = threading.Lock()
+
+
+def read_pois(pois_file):
+    """Return lon, lat of the POIs in pois_file"""
+    st = os.stat(pois_file)
+    key = (os.path.abspath(pois_file), st.st_mtime_ns, st.st_size)
+    if key not in _pois:
+        with open(pois_file) as f:
+            npois = int(f.readline().split()[0])
+            points = np.loadtxt(f, ndmin=2, max_rows=npois)
+        if len(points) != npois:
+            sys.exit(f"POI file {pois_file} should have {npois} POIs but has {len(points)}")
+        with _lock:
+            _pois[key] = (points[:, 0].copy(), points[:, 1].copy())
+    return _pois[key]
+
+
+def grid_coordinates(ds, filename):
+    """Return the lon, lat coordinates (1-D) of an open NetCDF grid file"""
+    names = {name.lower(): name for name in ds.variables}
+    coords = []
+    for coord, candidates in COORDINATE_NAMES.items():
+        found = [names[c] for c in candidates if c in names]
+        if not found:
+            sys.exit(f"Cannot find {coord} coordinate in {filename}")
+        coords.append(ds[found[0]][:].astype(np.float64))
+    return coords
+
+
+class PoiIndex:
+    """Bilinear interpolation of a regular (lat, lon) grid at the POIs"""
+
+    def __init__(self, lon, lat, poi_lon, poi_lat):
+        ix, wx, inside_x = axis_weights(lon, poi_lon)
+        iy, wy, inside_y = axis_weights(lat, poi_lat)
+        self.inside = inside_x & inside_y
+        self.npois = len(poi_lon)
+
+        # Window of the grid with all POIs inside it
+        ix1 = np.minimum(ix + 1, len(lon) - 1)
+        iy1 = np.minimum(iy + 1, len(lat) - 1)
+        if self.inside.any():
+            self.rows = slice(int(iy[self.inside].min()), int(iy1[self.inside].max()) + 1)
+            self.cols = slice(int(ix[self.inside].min()), int(ix1[self.inside].max()) + 1)
+        else:
+            self.rows, self.cols = slice(0, 1), slice(0, 1)
+        width = self.cols.stop - self.cols.start
+
+        # Corners of every POI as flat indices in the window, with their weights (4, npois)
+        def flat(j, i):
+            return (j - self.rows.start) * width + (i - self.cols.start)
+        self.corners = np.stack([flat(iy, ix), flat(iy, ix1), flat(iy1, ix), flat(iy1, ix1)])
+        self.weights = np.stack([wy * wx, wy * (1 - wx), (1 - wy) * wx, (1 - wy) * (1 - wx)])
+        self.corners[:, ~self.inside] = 0
+        self.weights[:, ~self.inside] = 0.0
+
+    @property
+    def window_size(self):
+        return (self.rows.stop - self.rows.start) * (self.cols.stop - self.cols.start)
+
+    def interpolate(self, window):
+        """Interpolate window (ntimes, rows, cols) at the POIs; return (ntimes, npois)"""
+        values = np.ma.filled(np.ma.masked_invalid(window), np.nan).reshape(len(window), -1)[:, self.corners]
+        wet = np.isfinite(values)
+        weights = np.where(wet, self.weights, 0.0)
+        # Weights of the wet corners add up to 1; no wet corner (or POI outside the grid) gives NaN
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (np.where(wet, values, 0.0) * weights).sum(axis=1) / weights.sum(axis=1)
+
+    def extract(self, var, chunk_bytes=CHUNK_BYTES):
+        """Return the series (ntimes, npois) of NetCDF variable var (time, lat, lon) at the POIs"""
+        ntimes = var.shape[0]
+        chunk = max(1, int(chunk_bytes // (8 * self.window_size)))
+        series = np.empty((ntimes, self.npois))
+        for start in range(0, ntimes, chunk):
+            stop = min(start + chunk, ntimes)
+            series[start:stop] = self.interpolate(var[start:stop, self.rows, self.cols])
+        return series
+
+
+def grid_key(lon, lat, pois_file):
+    """Return the hash identifying the indices of the POIs of pois_file on the grid lon, lat"""
+    sha = hashlib.sha256()
+    sha.update(np.ascontiguousarray(lon).tobytes())
+    sha.update(np.ascontiguousarray(lat).tobytes())
+    st = os.stat(pois_file)
+    sha.update(f"{os.path.abspath(pois_file)}:{st.st_mtime_ns}:{st.st_size}".encode())
+    return sha.hexdigest()
+
+
+def poi_index(lon, lat, pois_file):
+    """Return the PoiIndex of the POIs of pois_file on the grid lon, lat (computed once per grid)"""
+    key = grid_key(lon, lat, pois_file)
+    if key not in _indices:
+        index = PoiIndex(lon, lat, *read_pois(pois_file))
+        if not index.inside.all():
+            print(f"WARNING: {np.count_nonzero(~index.inside)} POIs of {pois_file} are outside the T-HySEA grid; their series are NaN")
+        with _lock:
+            _indices[key] = index
+    return _indices[key]
+
+
+def hysea_grid_file(hysea_output_dir, casename):
+    """Return the T-HySEA output grid file of casename: <casename>.nc if it exists, else the first <casename>_*.nc"""
+    files = sorted(f for f in os.listdir(hysea_output_dir)
+                   if (f == casename + '.nc' or f.startswith(casename + '_')) and f.endswith('.nc') and not f.endswith('_ts.nc'))
+    files.sort(key=lambda f: f != casename + '.nc')
+    if len(files) == 0:
+        sys.exit(f"extract_pois cannot find the T-HySEA output file {casename}*.nc in {hysea_output_dir}")
+    return os.path.join(hysea_output_dir, files[0])
+
+
+def write_series(filename, poi_lon, poi_lat, times, series, source):
+    """Write the POI series {variable: (ntimes, npois)} and their maxima to filename"""
+    tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with Dataset(tmp, mode='w', format='NETCDF4') as ds:
+        ds.title = 'POI time series'
+        ds.history = f"Created {datetime.today().strftime('%d/%m/%y')} by bingclaw-to-hysea"
+        ds.description = f"Time series at the POIs, interpolated from {os.path.basename(source)}"
+        ds.createDimension('poi', len(poi_lon))
+        ds.createDimension('time', len(times))
+        ds.createVariable('lon', 'f8', ('poi',))[:] = poi_lon
+        ds.createVariable('lat', 'f8', ('poi',))[:] = poi_lat
+        var = ds.createVariable('time', 'f8', ('time',))
+        var.units = 'seconds'
+        var[:] = times
+        for name, values in series.items():
+            ds.createVariable(name, 'f4', ('time', 'poi'), zlib=True, fill_value=np.float32(np.nan))[:] = values
+            maxima = np.where(np.isnan(values), -np.inf, values).max(axis=0, initial=-np.inf)
+            maxima[np.isneginf(maxima)] = np.nan
+            ds.createVariable(f"max_{name}", 'f4', ('poi',), fill_value=np.float32(np.nan))[:] = maxima
+    os.replace(tmp, filename)
+
+
+def extract_pois(hysea_output_dir, post_output_dir, casename, pois_file, variables=('eta',)):
+    print("* Executing extract_pois")
+    grid_file = hysea_grid_file(hysea_output_dir, casename)
+    os.makedirs(post_output_dir, exist_ok=True)
+    output_file = os.path.join(post_output_dir, f"{casename}_pois.nc")
+
+    with Dataset(grid_file) as ds:
+        lon, lat = grid_coordinates(ds, grid_file)
+        index = poi_index(lon, lat, pois_file)
+        times = ds['time'][:] if 'time' in ds.variables else np.arange(0)
+        series = {}
+        for name in variables:
+            if name not in ds.variables:
+                sys.exit(f"Variable {name} not found in {grid_file}")
+            var = ds[name]
+            if var.ndim != 3 or var.dimensions[0] != 'time':
+                sys.exit(f"Variable {name} of {grid_file} should have dimensions (time, lat, lon), not {var.dimensions}")
+            series[name] = index.extract(var)
+
+    write_series(output_file, *read_pois(pois_file), np.ma.filled(times, np.nan), series, grid_file)
+    print(f"POI time series of {index.npois} POIs written to {output_file}")
+    return output_file
@@ -0,0 +1,234 @@
+"""
+Functions to run the external programs of the workflow (BingClaw container, Interface Module,
+T-HySEA) as asyncio subprocesses
+
+All processes run on one event loop, in a background thread of the python process running the
+workflow (e.g. run_ensemble.py), so the stages of many scenarios run at the same time from one
+controller: the threads of the workflow only wait for their process (start_command, run_command),
+and coroutines can start many processes at once (run_process, e.g. with asyncio.gather).
+ - the output of a process (stdout and stderr, merged) is copied to its log file (see stage_log)
+   CHUNK_SIZE bytes at a time while it is written, so it is never kept in memory
+ - a process runs in its own session: after timeout seconds, or when it is cancelled (cancel,
+   cancel_all, or an interrupt of the thread waiting for it), the process and its children (e.g.
+   the shell, mpirun and the ranks) get SIGTERM, then SIGKILL after KILL_GRACE seconds
+ - the result of a process is a ProcessResult: exit code (TIMEOUT_EXIT_CODE after a timeout, minus
+   the signal number if it was killed), log file and duration; failure_message describes a failed
+   process with its log, and run_command prints the last lines of the log of a failed process
+Processes still running when python exits are stopped.
+
+Input needed:
+ - command      # Command to run: a string (run by the shell) or a list of arguments
+ - log_file     # File where the output of the process is written (overwritten)
+ - timeout      # Time (s) after which the process is stopped (default None: no limit)
+ - program      # Name of the program in messages (e.g. 'T-HySEA'; default: first word of command)
+"""
+
+import os
+import time
+import shlex
+import atexit
+import signal
+import asyncio
+import threading
+from collections import deque
+
+CHUNK_SIZE = 65536      # Bytes of output copied to the log file at a time
+KILL_GRACE = 10.0       # Time (s) between SIGTERM and SIGKILL when a process is stopped
+TIMEOUT_EXIT_CODE = 124 # Exit code of a process stopped after its timeout (as timeout(1))
+TAIL_LINES = 20         # Lines of the log printed when a process fails
+
+_loop = None
+_running = set()
+_lock = threading.Lock()
+
+
+class ProcessResult:
+    """Exit code, log file and duration (s) of a process; timed_out is True if it was stopped after timeout seconds"""
+
+    def __init__(self, command, exit_code, log_file, duration, timeout=None, timed_out=False):
+        self.command = command
+        self.exit_code = exit_code
+        self.log_file = log_file
+        self.duration = duration
+        self.timeout = timeout
+        self.timed_out = timed_out
+
+    @property
+    def failed(self):
+        return self.exit_code != 0
+
+    def tail(self, lines=TAIL_LINES):
+        """Return the last lines of the log"""
+        if not os.path.exists(self.log_file):
+            return ''
+        with open(self.log_file, errors='replace') as f:
+            return ''.join(deque(f, maxlen=lines))
+
+
+def stage_log(output_dir, stage):
+    """Return the log file of a stage writing output_dir: <parent of output_dir>/logs/<stage>.log"""
+    return os.path.join(os.path.dirname(os.path.abspath(output_dir)), 'logs', f"{stage}.log")
+
+
+def command_text(command):
+    """Return command (a string or a list of arguments) as a shell command line"""
+    return command if isinstance(command, str) else shlex.join(str(c) for c in command)
+
+
+def failure_message(program, exit_code, log_file=None, timeout=None):
+    """Return the description of a failed process of program: exit code (or timeout) and log file (if any)"""
+    log = f" (log: {log_file})" if log_file is not None else ''
+    if exit_code == TIMEOUT_EXIT_CODE and timeout is not None:
+        return f"{program} timed out after {timeout} s{log}"
+    return f"{program} exited with code {exit_code}{log}"
+
+
+def _signal(process, sig):
+    # The process leads its own session (and process group): signal its children too
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def _stop(process):
+    _signal(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), KILL_GRACE)
+    except asyncio.TimeoutError:
+        _signal(process, signal.SIGKILL)
+        await process.wait()
+
+
+async def _copy_output(stream, log):
+    while True:
+        chunk = await stream.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        log.write(chunk)
+        log.flush()
+
+
+async def run_process(command, log_file, timeout=None, cwd=None):
+    """Run command, copying its output to log_file, and return its ProcessResult; stop it after timeout seconds"""
+    os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+    text = command_text(command)
+    start = time.monotonic()
+    with open(log_file, 'wb') as log:
+        log.write(f"$ {text}\n".encode())
+        log.flush()
+        options = {'stdin': asyncio.subprocess.DEVNULL, 'stdout': asyncio.subprocess.PIPE,
+                   'stderr': asyncio.subprocess.STDOUT, 'cwd': cwd, 'start_new_session': True}
+        if isinstance(command, str):
+            process = await asyncio.create_subprocess_shell(command, **options)
+        else:
+            process = await asyncio.create_subprocess_exec(*[str(c) for c in command], **options)
+        copy = asyncio.ensure_future(_copy_output(process.stdout, log))
+        timed_out = False
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            await _stop(process)
+        except asyncio.CancelledError:
+            await _stop(process)
+            raise
+        finally:
+            # Output written by children that outlive the process is not waited for
+            try:
+                await asyncio.wait_for(copy, KILL_GRACE)
+            except asyncio.TimeoutError:
+                pass
+        exit_code = TIMEOUT_EXIT_CODE if timed_out else process.returncode
+        if timed_out:
+            log.write(f"\nStopped after the timeout of {timeout} s\n".encode())
+    return ProcessResult(text, exit_code, log_file, time.monotonic() - start, timeout, timed_out)
+
+
+async def _tracked(coroutine, stopped):
+    task = asyncio.current_task()
+    _running.add(task)
+    try:
+        return await coroutine
+    finally:
+        _running.discard(task)
+        stopped.set()
+
+
+def event_loop():
+    """Return the event loop running the processes (started in a background thread the first time)"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='processes', daemon=True).start()
+            atexit.register(cancel_all)
+    return _loop
+
+
+class RunningProcess:
+    """Process started by start_command, with the poll/wait/returncode interface of subprocess.Popen"""
+
+    def __init__(self, command, log_file, timeout=None, program=None, cwd=None):
+        self.program = program
+        self.log_file = log_file
+        self.timeout = timeout
+        self.stopped = threading.Event()
+        self.future = asyncio.run_coroutine_threadsafe(_tracked(run_process(command, log_file, timeout, cwd), self.stopped),
+                                                       event_loop())
+
+    def poll(self):
+        """Return the exit code, or None while the process is running"""
+        return self.future.result().exit_code if self.future.done() else None
+
+    @property
+    def returncode(self):
+        return self.poll()
+
+    def result(self):
+        """Wait for the process and return its ProcessResult; if the wait is interrupted, stop the process"""
+        try:
+            return self.future.result()
+        except BaseException:
+            self.cancel()
+            raise
+
+    def wait(self):
+        return self.result().exit_code
+
+    def cancel(self):
+        """Stop the process and wait until it is stopped"""
+        self.future.cancel()
+        self.stopped.wait(2 * KILL_GRACE)
+
+
+def start_command(command, log_file, timeout=None, program=None, cwd=None):
+    """Start command on the event loop of the processes and return its RunningProcess"""
+    print(f"Running {command_text(command)} (log: {log_file})")
+    if program is None:
+        program = os.path.basename(command.split()[0] if isinstance(command, str) else str(command[0]))
+    return RunningProcess(command, log_file, timeout, program, cwd)
+
+
+def run_command(command, log_file, timeout=None, program=None, cwd=None):
+    """Run command, wait for it and return its ProcessResult; print the end of its log if it failed"""
+    process = start_command(command, log_file, timeout, program, cwd)
+    result = process.result()
+    if result.failed:
+        print(f"WARNING: {failure_message(process.program, result.exit_code, log_file, timeout)}. "
+              f"Last lines of the log:\n{result.tail()}")
+    return result
+
+
+async def _cancel_all():
+    tasks = list(_running)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def cancel_all():
+    """Stop all the processes running and wait until they are stopped (e.g. when the workflow is interrupted)"""
+    if _loop is None or not _running:
+        return
+    asyncio.run_coroutine_threadsafe(_cancel_all(), _loop).result()
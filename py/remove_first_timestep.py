@@ -1,56 +1,176 @@
 """
 Script to remove the first timestep of the ground deformation output file
-that comes out of the interface module. 
-The ground deformation output file will be overvritten. 
+that comes out of the interface module.
+The ground deformation output file will be overvritten.
+
+The deformation 'z' is copied in slabs of slab_size timesteps, so that the memory
+used does not depend on the number of timesteps in the file. Without storage the new
+file keeps the chunking and compression of the original file; with storage (see
+py/deformation_storage.py) 'z' is written with one time step per chunk and the compression
+and precision of storage, and the new file is checked against the original one
+(check_round_trip). It is written to a temporary file in the same directory, which then
+replaces the original one.
+pack_deformation rewrites the deformation file with storage without removing timesteps
+(e.g. the output of the Interface Module run with skip_frames), unless it is already stored so.
+crop_deformation rewrites it cropped to its active region (see py/active_region.py).
+Files are read and written while holding netcdf_lock (see py/intmod_native.py).
 
 Input needed:
  - intmod_output_dir    # Interface Module output directory
  - casename_from_intmod # Casename used in Interface Module to identify filter and resolution used for a specific scenario
+ - slab_size            # Number of timesteps read/written at a time (default 10)
+ - storage              # Storage of the deformation (default None: as in the original file)
+ - crop_threshold       # Deformation (m) above which a cell belongs to the active region (crop_deformation)
+ - crop_halo            # Distance (m) added around the active region (crop_deformation)
 
 Created by V. Magni (NGI)
 """
 
 import os
+import sys
+import tempfile
+import numpy as np
 from netCDF4 import Dataset
 from datetime import datetime
 
-def remove_first_timestep(intmod_output_dir, casename_from_intmod):
-    print("* Executing remove_first_timestep")    
-    
-    # Get names of files created by the Interface Module
-    dir_list = os.listdir(intmod_output_dir)
-    deform = [x for x in dir_list if ('deformation' in x and casename_from_intmod in x)][0]
-    deformation = os.path.join(intmod_output_dir, deform)
-    print(f"Input filename: {deformation}.")
-    donor = 'bingclaw'
-    
+from py.deformation_storage import z_settings, has_storage, check_round_trip
+from py.active_region import CROP_HALO, footprint, add_halo, halo_cells, window_size
+from py.intmod_native import grid_spacing, netcdf_lock
+
+
+def storage_settings(varin):
+    """Return the createVariable keyword arguments reproducing chunking, compression and fill value of varin"""
+    settings = {}
+    chunking = varin.chunking()
+    if chunking == 'contiguous':
+        settings['contiguous'] = True
+    elif chunking is not None:
+        settings['chunksizes'] = chunking
+    filters = varin.filters() or {}
+    for key in ('zlib', 'complevel', 'shuffle', 'fletcher32'):
+        if key in filters:
+            settings[key] = filters[key]
+    if '_FillValue' in varin.ncattrs():
+        settings['fill_value'] = varin.getncattr('_FillValue')
+    return settings
+
+
+def deformation_file(intmod_output_dir, casename_from_intmod):
+    """Return the deformation file written by the Interface Module: <casename_from_intmod>_deformation.nc if it
+    exists, else the first file <casename_from_intmod>_* naming deformation"""
+    prefix = casename_from_intmod + '_'
+    dir_list = sorted(os.listdir(intmod_output_dir))
+    deform = [x for x in dir_list if x.startswith(prefix) and 'deformation' in x[len(prefix):]]
+    deform.sort(key=lambda x: x != prefix + 'deformation.nc')
+    if len(deform) == 0:
+        sys.exit(f"Cannot find the deformation file of {casename_from_intmod} in {intmod_output_dir} (did the Interface Module fail?)")
+    return os.path.join(intmod_output_dir, deform[0])
+
+
+def rewrite_deformation(deformation, skip_frames=1, storage=None, slab_size=10, window=None):
+    """Rewrite the deformation file without its first skip_frames timesteps (keeping the first times), with storage,
+    and only the cells in window (rows, cols) if given"""
+    # Temporary file with a unique name in the same directory (so that os.replace is atomic)
+    tmp_fd, tmp_file = tempfile.mkstemp(prefix=f".{os.path.basename(deformation)}.", suffix='.tmp', dir=os.path.dirname(deformation))
+    os.close(tmp_fd)
+
     # Open files for reading and writing
-    with Dataset(filename=deformation, mode='r', format='NETCDF4') as dsin:
-        with Dataset(filename='tempfile', mode='w', format='NETCDF4') as dsout:
-            dsout.title =  dsin.title
-            today = datetime.today()
-            dsout.history = f"{dsin.history}. Removed first timestep {today.strftime('%d/%m/%y')}."
-            dsout.description = dsin.description 
-          
-            #Copy dimensions
-            for dname, the_dim in dsin.dimensions.items():
-                dsout.createDimension(dname, len(the_dim) if not the_dim.isunlimited() else None)
-            
-            # Copy variables
-            for v_name, varin in dsin.variables.items():
-                outVar = dsout.createVariable(v_name, varin.datatype, varin.dimensions)
-                outVar.setncatts({k: varin.getncattr(k) for k in varin.ncattrs()})
-                
-                # Remove the first timestep
-                if v_name == 'time': 
-                    dsout['time'][:] = dsin['time'][:-1]
-                elif v_name == 'z':
-                    dsout['z'][:] = dsin['z'][1:]
+    try:
+        with Dataset(filename=deformation, mode='r') as dsin:
+            with Dataset(filename=tmp_file, mode='w', format='NETCDF4') as dsout:
+                # Copy values as they are stored in the file (no masking/unpacking)
+                dsin.set_auto_maskandscale(False)
+                dsout.set_auto_maskandscale(False)
+
+                dsout.title =  dsin.title
+                today = datetime.today()
+                if skip_frames > 0:
+                    dsout.history = f"{dsin.history}. Removed first timestep {today.strftime('%d/%m/%y')}."
                 else:
-                    outVar[:] = varin[:]
-                
-    # Overwrite input file.
-    command = "mv tmpfile " + deformation 
-    os.system(command)
+                    dsout.history = f"{dsin.history}. Repacked {today.strftime('%d/%m/%y')}."
+                dsout.description = dsin.description
+
+                #Copy dimensions
+                crop = {} if window is None else {'lat': window[0], 'lon': window[1]}
+                for dname, the_dim in dsin.dimensions.items():
+                    size = len(range(len(the_dim))[crop[dname]]) if dname in crop else len(the_dim)
+                    dsout.createDimension(dname, size if not the_dim.isunlimited() else None)
+
+                # Copy variables
+                for v_name, varin in dsin.variables.items():
+                    datatype, settings = varin.datatype, storage_settings(varin)
+                    if window is not None and 'chunksizes' in settings:
+                        settings['chunksizes'] = [min(c, len(dsout.dimensions[d]) or c) for c, d in zip(settings['chunksizes'], varin.dimensions)]
+                    if v_name == 'z' and storage is not None:
+                        fill_value = settings.get('fill_value')
+                        datatype, settings = z_settings(storage, [len(dsout.dimensions[d]) for d in varin.dimensions[1:]])
+                        if fill_value is not None:
+                            settings['fill_value'] = np.dtype(datatype).type(fill_value)
+                        # Values are converted and quantized by the library
+                        outVar = dsout.createVariable(v_name, datatype, varin.dimensions, **settings)
+                        outVar.set_auto_maskandscale(True)
+                        varin.set_auto_maskandscale(True)
+                    else:
+                        outVar = dsout.createVariable(v_name, datatype, varin.dimensions, **settings)
+                    outVar.setncatts({k: varin.getncattr(k) for k in varin.ncattrs() if k != '_FillValue'})
+
+                    # Remove the first timesteps
+                    if v_name == 'time':
+                        outVar[:] = varin[:len(varin) - skip_frames]
+                    elif v_name == 'z':
+                        ntimes = varin.shape[0]
+                        rows, cols = window if window is not None else (slice(None), slice(None))
+                        for start in range(skip_frames, ntimes, slab_size):
+                            end = min(start + slab_size, ntimes)
+                            outVar[start-skip_frames:end-skip_frames] = varin[start:end, rows, cols]
+                    elif v_name in crop:
+                        outVar[:] = varin[crop[v_name]]
+                    else:
+                        outVar[:] = varin[:]
+
+        if storage is not None:
+            check_round_trip(tmp_file, deformation, storage, skip_frames, slab_size, window)
+
+        # Overwrite input file.
+        os.replace(tmp_file, deformation)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def remove_first_timestep(intmod_output_dir, casename_from_intmod, slab_size=10, storage=None):
+    print("* Executing remove_first_timestep")
+
+    # Get names of files created by the Interface Module
+    deformation = deformation_file(intmod_output_dir, casename_from_intmod)
+    print(f"Input filename: {deformation}.")
+    with netcdf_lock:
+        rewrite_deformation(deformation, 1, storage, slab_size)
     print(f"* File {deformation} has been overwritten; first timestep output has been removed")
 
+
+def pack_deformation(intmod_output_dir, casename_from_intmod, storage, slab_size=10):
+    print("* Executing pack_deformation")
+    deformation = deformation_file(intmod_output_dir, casename_from_intmod)
+    with netcdf_lock:
+        with Dataset(deformation) as ds:
+            if has_storage(ds['z'], storage):
+                print(f"File {deformation} is already stored as requested")
+                return
+        rewrite_deformation(deformation, 0, storage, slab_size)
+    print(f"* File {deformation} has been rewritten with one time step per chunk")
+
+
+def crop_deformation(intmod_output_dir, casename_from_intmod, crop_threshold, crop_halo=CROP_HALO, storage=None, slab_size=10):
+    print("* Executing crop_deformation")
+    deformation = deformation_file(intmod_output_dir, casename_from_intmod)
+    with netcdf_lock, Dataset(deformation) as ds:
+        lon, lat = ds['lon'][:], ds['lat'][:]
+        window = footprint(ds['z'], crop_threshold, slab_size)
+    if window is None:
+        print(f"WARNING: No deformation above {crop_threshold} m in {deformation}; the file is not cropped")
+        return
+    window = add_halo(window, (len(lat), len(lon)), *halo_cells(crop_halo, *grid_spacing(lon, lat)))
+    with netcdf_lock:
+        rewrite_deformation(deformation, 0, storage, slab_size, window)
+    print(f"* File {deformation} has been cropped to {window_size(window)} of {len(lat) * len(lon)} cells")
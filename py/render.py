@@ -0,0 +1,175 @@
+"""
+Functions to write the input files of BingClaw (setrun.py) and T-HySEA from their templates
+
+A template is parsed once (and kept in memory until the file changes) into literal text and
+fields, then every input file is rendered in one pass and written atomically (to a temporary
+file in the same directory, then renamed), so a crash never leaves a partial input file.
+Fields are:
+ - placeholders: whole words in capitals (e.g. SCENARIO, BATHYMETRY); SCENARIO does not match
+   inside SCENARIO_NAME
+ - numeric parameters of setrun.py, by attribute name: the value of e.g. 'clawdata.tfinal = 900'
+   is the field 'tfinal' (also num_output_times, cfl_desired, manning_coefficient, ...)
+ - numeric parameters of the T-HySEA template, by the names in HYSEA_PARAMETERS: the value at the
+   start of the line whose comment starts with the given label (e.g. 'cfl' is '0.5  # CFL')
+
+Values of numeric parameters of each scenario can be given in a sweep table (read_sweep):
+a CSV file with a column 'scenario' (name of the .tt3 file without extension) and one column per
+parameter, named 'bingclaw.<name>' or 'hysea.<name>' (e.g. bingclaw.tfinal, hysea.manning).
+Empty cells keep the value of the template.
+"""
+
+import os
+import re
+import sys
+import csv
+import threading
+
+SETRUN_PLACEHOLDERS = ('BATHYMETRY', 'SCENARIO', 'OUTPUT_FORMAT')
+HYSEA_PLACEHOLDERS = ('SCENARIO_NAME', 'BATHYMETRY', 'HYSEA_OUTNAME', 'DEFORMATION_FILE', 'POIS_FILE')
+
+# Parameters of the T-HySEA template, identified by the start of the comment of their line
+HYSEA_PARAMETERS = {
+    'kajiura': 'Apply Kajiura filter',
+    'simulation_time': 'Simulation time',
+    'netcdf_saving_time': 'Saving time of NetCDF files',
+    'time_series_saving_time': 'Saving time of time series',
+    'cfl': 'CFL',
+    'epsilon_h': 'Epsilon h',
+    'waf_threshold': 'Threshold for the 2s+WAF scheme',
+    'stability_coefficient': 'Stability coefficient',
+    'friction_type': 'Friction type',
+    'manning': 'Water-bottom friction',
+    'max_velocity': 'Maximum allowed velocity of water',
+    'typical_length': 'L (typical length)',
+    'typical_depth': 'H (typical depth)',
+}
+SWEEP_STAGES = ('bingclaw', 'hysea')
+
+_templates = {}
+_sweeps = {}
+_lock = threading.Lock()
+
+
+def _parameter_span(text, name):
+    """Return start and end of the value of parameter name in text, or None if it is not there"""
+    if name in HYSEA_PARAMETERS:
+        label = re.escape(HYSEA_PARAMETERS[name])
+        match = re.search(rf"^[ \t]*(\S+)[ \t]+#[ \t]*{label}", text, re.MULTILINE)
+    else:
+        match = re.search(rf"^[ \t]*[\w.]*\b{re.escape(name)}[ \t]*=[ \t]*([^#\n]*?)[ \t]*(#.*)?$", text, re.MULTILINE)
+    return match.span(1) if match else None
+
+
+class Template:
+    """Template parsed into literal text and fields (placeholders and numeric parameters)"""
+
+    def __init__(self, filename, placeholders, parameters=()):
+        self.filename = filename
+        with open(filename) as f:
+            text = f.read()
+
+        spans = []
+        if placeholders:
+            names = '|'.join(sorted(placeholders, key=len, reverse=True))
+            spans += [(m.start(), m.end(), m.group(0)) for m in re.finditer(rf"\b(?:{names})\b", text)]
+        for name in parameters:
+            span = _parameter_span(text, name)
+            if span is None:
+                sys.exit(f"Parameter {name} not found in template {filename}")
+            spans.append((span[0], span[1], name))
+        spans.sort()
+
+        self.literals, self.fields = [], []
+        position = 0
+        for start, end, field in spans:
+            if start < position:
+                sys.exit(f"Field {field} overlaps another field in template {filename}")
+            self.literals.append(text[position:start])
+            self.fields.append(field)
+            position = end
+        self.literals.append(text[position:])
+
+    def render(self, values):
+        """Return the text of the template with the fields replaced by values"""
+        parts = [self.literals[0]]
+        try:
+            for field, literal in zip(self.fields, self.literals[1:]):
+                parts.append(str(values[field]))
+                parts.append(literal)
+        except KeyError as err:
+            sys.exit(f"No value given for {err.args[0]} in template {self.filename}")
+        return ''.join(parts)
+
+
+def load_template(filename, placeholders, parameters=()):
+    """Return the parsed template of filename (parsed again only if the file changed)"""
+    st = os.stat(filename)
+    key = (filename, tuple(placeholders), tuple(sorted(parameters)))
+    cached = _templates.get(key)
+    if cached is None or cached[0] != (st.st_mtime_ns, st.st_size):
+        cached = ((st.st_mtime_ns, st.st_size), Template(filename, placeholders, key[2]))
+        with _lock:
+            _templates[key] = cached
+    return cached[1]
+
+
+def write_atomic(filename, text):
+    """Write text to filename through a temporary file in the same directory"""
+    tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, text.encode())
+        finally:
+            os.close(fd)
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def render_file(template_file, output_file, values, placeholders, parameters=None):
+    """Write output_file from template_file, with placeholders and numeric parameters (dict) replaced by their values"""
+    parameters = parameters or {}
+    for name, value in parameters.items():
+        try:
+            float(value)
+        except (TypeError, ValueError):
+            sys.exit(f"Value {value!r} of parameter {name} is not a number")
+    template = load_template(template_file, placeholders, parameters)
+    write_atomic(output_file, template.render({**values, **parameters}))
+    return output_file
+
+
+def read_sweep(sweep_file):
+    """Return the numeric parameters of each scenario of a sweep table: {scenario: {'bingclaw': {...}, 'hysea': {...}}}"""
+    st = os.stat(sweep_file)
+    key = (os.path.abspath(sweep_file), st.st_mtime_ns, st.st_size)
+    if key not in _sweeps:
+        sweep = {}
+        with open(sweep_file, newline='') as f:
+            reader = csv.DictReader(f)
+            if 'scenario' not in reader.fieldnames:
+                sys.exit(f"Sweep table {sweep_file} has no column 'scenario'")
+            for column in reader.fieldnames:
+                if column != 'scenario' and column.split('.')[0] not in SWEEP_STAGES:
+                    sys.exit(f"Column {column} of sweep table {sweep_file} should be named bingclaw.<parameter> or hysea.<parameter>")
+            for row in reader:
+                scenario = os.path.splitext(row.pop('scenario').strip())[0]
+                sweep[scenario] = {stage: {} for stage in SWEEP_STAGES}
+                for column, value in row.items():
+                    if value is not None and value.strip():
+                        stage, name = column.split('.', 1)
+                        sweep[scenario][stage][name] = value.strip()
+        with _lock:
+            _sweeps[key] = sweep
+    return _sweeps[key]
+
+
+def sweep_parameters(sweep_file, scenario, stage):
+    """Return the numeric parameters of stage ('bingclaw' or 'hysea') of scenario in the sweep table (empty if none)"""
+    if sweep_file is None:
+        return {}
+    scenario = os.path.splitext(os.path.basename(scenario))[0]
+    return dict(read_sweep(sweep_file).get(scenario, {}).get(stage, {}))
@@ -5,18 +5,41 @@ Input needed:
  - bingclaw_input_dir       Name of directory with BingClaw input files
  - bingclaw_output_dir      Name of directory where BingClaw outputs will be saved
  - bathymetry               Bathymetry file used in BingClaw simulations
- - scenario                 Simulation name (same name as the .tt3 files describing initial conditions)
+ - scenario                 Simulation name (same name as the .tt3 files describing initial conditions). 
+                            It can also be the full path of the .tt3 file, if this is not in bingclaw_input_dir
  - image_type               Type of image: 'docker' or 'singularity'
  - image_name               Name of BingClaw docker image or singularity .sif file
+ - output_format            Format of BingClaw output frames: 'ascii' (default) or 'binary'. 
+                            Binary frames (fort.bXXXX) are faster to write and read and smaller, 
+                            but can be read only by the 'native' engine of run_interface_module
+ - wait                     If True (default), wait for the end of the simulation and return its exit code.
+                            If False, return the running process (RunningProcess, see py/processes.py), e.g. to
+                            process output frames while they are written (see py/stream_intmod.py)
+ - staging                  How the bathymetry is put in the scenario directory: 'hardlink' (default, copy if
+                            not possible), 'symlink', 'bind' (input directory mounted read-only in the container)
+                            or 'copy'. See py/staging.py
+ - shared_inputs            SharedInputs (see py/staging.py) used to verify the bathymetry once for all scenarios (default None)
+ - parameters               Numeric parameters of setrun.py to set, by attribute name (e.g. {'tfinal': 1200, 'cfl_desired': 0.4}),
+                            e.g. from a sweep table (see py/render.py). Default None: values of the template
+ - instance                 Running BingclawInstance (see py/bingclaw_instance.py) used instead of starting a 
+                            new container (default None). output_dir must be inside the directory it mounts
+ - timeout                  Time (s) after which the simulation is stopped (default None: no limit)
+The simulation runs as an asyncio subprocess (see py/processes.py); its output is written to
+<scenario_dir>/logs/bingclaw.log.
 
 Created by V. Magni (NGI)
 """
 import os 
 import sys
-import shutil
-from pyutil import filereplace
 
-def run_bingclaw(input_dir, output_dir, bathymetry, scenario, image_type, image_name):
+from py.bingclaw_frames import FRAME_FILE
+from py.render import render_file, SETRUN_PLACEHOLDERS
+from py.staging import stage_file, SharedInputs, INPUTS_DIR
+from py.instrument import measure, current_record
+from py.processes import start_command, run_command, stage_log
+
+def run_bingclaw(input_dir, output_dir, bathymetry, scenario, image_type, image_name, output_format='ascii', wait=True, instance=None,
+                 staging='hardlink', shared_inputs=None, parameters=None, timeout=None):
     print(f"* Executing run_bingclaw")
     
     # Create BingClaw output directory inside the scenario output directory
@@ -24,29 +47,57 @@ def run_bingclaw(input_dir, output_dir, bathymetry, scenario, image_type, image_
         os.makedirs(output_dir)
     else:
         print(f"Directory {output_dir} for scenario {scenario} already exists, results will be overwritten")
+        # Remove frames of the previous run, so that they are not mixed with the new ones
+        for fname in os.listdir(output_dir):
+            if FRAME_FILE.match(fname):
+                os.remove(os.path.join(output_dir, fname))
 
-    # Copy template input (setrun.py) in the scenario/bingclaw output directory 
-    # and insert paths/names of files required to run the simualtion
+    # Write setrun.py in the scenario/bingclaw output directory from the template,
+    # with paths/names of files required to run the simualtion and parameters
+    scenario_file = os.path.basename(scenario)
     setrun_template_file = os.path.join(input_dir, 'setrun_template.py')
     setrun_file = os.path.join(output_dir, 'setrun.py')
-    cp = shutil.copy(setrun_template_file, setrun_file)
-    filereplace(setrun_file, 'BATHYMETRY', bathymetry)
-    filereplace(setrun_file, 'SCENARIO', scenario)
-
-    # Copy required files in output scenario folder
-    input_file = os.path.join(input_dir, scenario)
-    cp = shutil.copy(input_file, os.path.join(output_dir, scenario))
-    cp = shutil.copy(os.path.join(input_dir, bathymetry), os.path.join(output_dir, bathymetry))
+    with measure('render'):
+        bathymetry_path = f"{INPUTS_DIR}/{bathymetry}" if staging == 'bind' else bathymetry
+        render_file(setrun_template_file, setrun_file,
+                    {'BATHYMETRY': bathymetry_path, 'SCENARIO': scenario_file, 'OUTPUT_FORMAT': output_format},
+                    SETRUN_PLACEHOLDERS, parameters)
+
+    # Link (or copy) required files in output scenario folder
+    with measure('stage_inputs'):
+        input_file = os.path.join(input_dir, scenario)
+        stage_file(input_file, os.path.join(output_dir, scenario_file), 'copy' if staging == 'copy' else 'hardlink')
+        if shared_inputs is None:
+            shared_inputs = SharedInputs(staging)
+        if staging == 'bind':
+            shared_inputs.verify(os.path.join(input_dir, bathymetry))
+        else:
+            shared_inputs.stage(os.path.join(input_dir, bathymetry), os.path.join(output_dir, bathymetry))
     
-    # Run bingclaw simulation
+    # Run bingclaw simulation (no -it for docker, so that it can also run without a terminal, e.g. in run_ensemble)
+    # Return the exit code of the container, or the running process if wait is False
     tomount = os.path.join(os.getcwd(),output_dir)
-    if image_type == 'docker':
-        command = f"docker run --rm -it -v {tomount}:/BingClaw/run {dockerimage_name}"
-        os.system(command)
+    inputs_mount = ''
+    if staging == 'bind':
+        inputs_mount = f"{os.path.abspath(input_dir)}:{INPUTS_DIR}:ro"
+    if instance is not None:
+        if staging == 'bind' and instance.input_dir != os.path.abspath(input_dir):
+            sys.exit(f"staging is 'bind' but the BingClaw container does not mount {input_dir}")
+        command = instance.command(output_dir)
+    elif image_type == 'docker':
+        inputs_mount = f"-v {inputs_mount} " if inputs_mount else ''
+        command = f"docker run --rm -v {tomount}:/BingClaw/run {inputs_mount}{image_name}"
     elif image_type == 'singularity':
-        command = f"singularity exec -B {tomount}:/BingClaw/run --cleanenv {image_name} ./run_simulation.sh"   
-        os.system(command)
+        inputs_mount = f"-B {inputs_mount} " if inputs_mount else ''
+        command = f"singularity exec -B {tomount}:/BingClaw/run {inputs_mount}--cleanenv {image_name} ./run_simulation.sh"   
     else:
-        print(f"{image_type} is not a valid image_type. Options are 'docker' or 'singularity'")
+        sys.exit(f"{image_type} is not a valid image_type. Options are 'docker' or 'singularity'")
+    log_file = stage_log(output_dir, 'bingclaw')
+    if not wait:
+        return start_command(command, log_file, timeout, 'BingClaw')
+    with measure('solve') as record:
+        record['exit_code'] = run_command(command, log_file, timeout, 'BingClaw').exit_code
+    current_record()['exit_code'] = record['exit_code']
+    return record['exit_code']
 
 
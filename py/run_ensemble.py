@@ -0,0 +1,487 @@
+"""
+Script to run the workflow for an ensemble of BingClaw scenarios
+
+Every scenario goes through the same steps as run_workflow.py (run_bingclaw,
+run_interface_module, remove_first_timestep, run_hysea, extract_pois) and gets its own
+output tree outputs/<scenario>. With params['aggregate_hazard'], the T-HySEA outputs of the
+scenarios that succeeded are aggregated into hazard maps, outputs/hazard.nc (see py/hazard.py). The CPU stages (BingClaw, Interface Module) run
+on a pool of cpu_workers and the GPU stage (T-HySEA) on a separate pool of
+gpu_workers, so that the CPU stages of some scenarios overlap with the
+T-HySEA simulations of others. With params['hysea_batch'], the scenarios that are
+ready for T-HySEA at the same time run in one T-HySEA batch (see py/hysea_batch.py). Scenarios are independent: if one fails, the
+others keep running and the failure is reported in the summary at the end.
+BingClaw, the Interface Module and T-HySEA run as asyncio subprocesses (see py/processes.py),
+with their output in outputs/<scenario>/logs and the timeouts params['bingclaw_timeout'],
+params['intmod_timeout'] and params['hysea_timeout']; a failure names the log of the process.
+If the ensemble is interrupted (e.g. Ctrl-C), the processes of all scenarios are stopped.
+
+Input needed:
+ - scenarios        # Directory with the .tt3 files describing initial conditions, or glob pattern of .tt3 files
+ - params           # Dictionary with the workflow parameters (see run_ensemble.py in the root of the repo)
+ - cpu_workers      # Number of scenarios that can run BingClaw/Interface Module at the same time
+ - gpu_workers      # Number of scenarios (or batches of scenarios) that can run T-HySEA at the same time
+"""
+
+import os
+import sys
+import glob
+import queue
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from py.run_interface_module import run_interface_module, native_revision
+from py.run_bingclaw import run_bingclaw
+from py.run_hysea import run_hysea, prepare_hysea
+from py.hysea_batch import HyseaBatcher
+from py.remove_first_timestep import remove_first_timestep, crop_deformation
+from py.deformation_storage import deformation_storage
+from py.intmod_worker import IntmodPool, INTERFACE_MODULE
+from py.intmod_cache import IntmodCache, interface_module_revision
+from py.bingclaw_frames import FRAME_FILE
+from py.stages import StageTracker
+from py.instrument import measure, Manifest, write_rollup
+from py.stream_intmod import stream_interface_module
+from py.bingclaw_instance import BingclawInstance
+from py.staging import SharedInputs
+from py.render import sweep_parameters
+from py.processes import failure_message, stage_log, cancel_all
+from py.poi_series import extract_pois
+from py.hazard import aggregate_hazard
+
+
+HAZARD_FILE = 'hazard.nc'
+
+
+def find_scenarios(scenarios, pattern='mscen_*.tt3'):
+    """Return the sorted list of scenario .tt3 files in a directory, or matching a glob pattern"""
+    if os.path.isdir(scenarios):
+        scenarios = os.path.join(scenarios, pattern)
+    return sorted(glob.glob(scenarios))
+
+
+def scenario_dirs(output_dir, scenario):
+    """Return the output directories of a scenario (same structure as in run_workflow.py)"""
+    scenario_dir = os.path.join(output_dir, scenario)
+    return {'scenario_dir': scenario_dir,
+            'bingclaw_output_dir': os.path.join(scenario_dir, 'bingclaw_out'),
+            'intmod_output_dir': os.path.join(scenario_dir, 'intmod_out'),
+            'hysea_output_dir': os.path.join(scenario_dir, 'hysea_out'),
+            'post_output_dir': os.path.join(scenario_dir, 'post_out')}
+
+
+def storage_of(params):
+    """Return the storage of the deformation file set by params (see py/deformation_storage.py)"""
+    return deformation_storage(params['deformation_complevel'], params['deformation_dtype'], params['deformation_digits'])
+
+
+def _files(directory, match):
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if match(f)]
+
+
+def stage_files(stage, scenario_file, params):
+    """Return the inputs, upstream outputs and parameters of stage for one scenario (see py/stages.py)"""
+    scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+    if stage == 'bingclaw':
+        inputs = [scenario_file, os.path.join(params['bingclaw_input_dir'], params['bingclaw_bathymetry']),
+                  os.path.join(params['bingclaw_input_dir'], 'setrun_template.py')]
+        keys = ['bingclaw_bathymetry', 'image_type', 'image_name', 'bingclaw_output_format']
+        stage_params = {key: params[key] for key in keys}
+        stage_params['sweep'] = sweep_parameters(params['sweep_file'], scenario, 'bingclaw')
+        return inputs, [], stage_params
+    elif stage == 'interface_module':
+        inputs = [os.path.join(params['hysea_input_dir'], params['bathy_file'])]
+        keys = ['donor', 'bathy_file', 'resolution', 'filter_type', 'filename_prefix', 'skip_first_frame_in_intmod', 'intmod_engine',
+                'deformation_complevel', 'deformation_dtype', 'deformation_digits', 'frame_tolerance', 'stop_when_stationary',
+                'crop_threshold', 'crop_halo']
+        stage_params = {key: params[key] for key in keys}
+        if params['intmod_engine'] == 'native':
+            stage_params['revision'] = native_revision()
+            if params['filter_type'] == 'kajiura':
+                stage_params['kajiura_method'] = params['kajiura_method']
+        elif os.path.exists(INTERFACE_MODULE):
+            stage_params['revision'] = interface_module_revision()
+        return inputs, stage_outputs('bingclaw', scenario_file, params), stage_params
+    elif stage == 'hysea':
+        template = 'hysea_input_ts.template' if params['output_time_series'] else 'hysea_input.template'
+        inputs = [os.path.join(params['hysea_input_dir'], template)]
+        if params['output_time_series']:
+            inputs.append(os.path.join(params['hysea_input_dir'], params['pois_file']))
+        keys = ['hysea_executable', 'output_time_series', 'pois_file', 'filename_prefix']
+        stage_params = {key: params[key] for key in keys}
+        stage_params['sweep'] = sweep_parameters(params['sweep_file'], scenario, 'hysea')
+        return inputs, stage_outputs('interface_module', scenario_file, params), stage_params
+    elif stage == 'pois':
+        inputs = [os.path.join(params['hysea_input_dir'], params['pois_file'])]
+        stage_params = {key: params[key] for key in ['filename_prefix', 'poi_variables']}
+        return inputs, stage_outputs('hysea', scenario_file, params), stage_params
+    sys.exit(f"{stage} is not a valid stage. Options are 'bingclaw', 'interface_module', 'hysea' or 'pois'")
+
+
+def stage_outputs(stage, scenario_file, params):
+    """Return the output files of stage for one scenario"""
+    scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+    dirs = scenario_dirs(params['output_dir'], scenario)
+    if stage == 'bingclaw':
+        return _files(dirs['bingclaw_output_dir'], FRAME_FILE.match)
+    elif stage == 'interface_module':
+        return _files(dirs['intmod_output_dir'], lambda f: f.startswith(params['filename_prefix']) and f.endswith('.nc'))
+    elif stage == 'hysea':
+        return _files(dirs['hysea_output_dir'], lambda f: f.startswith(params['filename_prefix']))
+    return _files(dirs['post_output_dir'], lambda f: f == params['filename_prefix'] + '_pois.nc')
+
+
+def stage_state(stage, scenario_file, params):
+    """Return the StageTracker of a scenario, the digest of stage and whether the stage is up to date"""
+    scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+    tracker = StageTracker(scenario_dirs(params['output_dir'], scenario)['scenario_dir'])
+    digest = tracker.digest(*stage_files(stage, scenario_file, params))
+    return tracker, digest, params['resume'] and tracker.is_up_to_date(stage, digest)
+
+
+def _manifest(scenario_file, params):
+    scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+    return Manifest(scenario_dirs(params['output_dir'], scenario)['scenario_dir'], scenario)
+
+
+def run_tracked(stage, run, scenario_file, params, *args):
+    """Run stage of one scenario with run(scenario_file, params, *args), unless it is up to date"""
+    tracker, digest, up_to_date = stage_state(stage, scenario_file, params)
+    if up_to_date:
+        print(f"Skip {stage} for {os.path.basename(scenario_file)}: outputs are up to date")
+        return None
+    tracker.start(stage)
+    with measure(stage, _manifest(scenario_file, params), params['profile']) as record:
+        failure = run(scenario_file, params, *args)
+        if failure is not None:
+            record['status'] = 'failed'
+            record['error'] = failure[1]
+    if failure is None:
+        tracker.done(stage, digest, stage_outputs(stage, scenario_file, params))
+    return failure
+
+
+def run_cpu_stages(scenario_file, params, intmod_pool=None, intmod_cache=None, instances=None, shared_inputs=None):
+    """Run BingClaw, Interface Module and remove_first_timestep for one scenario"""
+    # Take a BingClaw container that is not used by other scenarios
+    instance = instances.get() if instances is not None else None
+    try:
+        return _run_cpu_stages(scenario_file, params, intmod_pool, intmod_cache, instance, shared_inputs)
+    finally:
+        if instance is not None:
+            instances.put(instance)
+
+
+def _run_cpu_stages(scenario_file, params, intmod_pool, intmod_cache, instance, shared_inputs):
+    scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+    dirs = scenario_dirs(params['output_dir'], scenario)
+    os.makedirs(dirs['scenario_dir'], exist_ok=True)
+
+    # Convert BingClaw frames while BingClaw is running (unless BingClaw is up to date: then only the Interface Module runs, if needed)
+    streamed = params['stream_intmod'] and params['do_run_bingclaw'] and params['do_run_interface_module']
+    if streamed:
+        tracker, digest, up_to_date = stage_state('bingclaw', scenario_file, params)
+    if streamed and not up_to_date:
+        tracker.start('bingclaw')
+        tracker.start('interface_module')
+        with measure('bingclaw_stream', _manifest(scenario_file, params), params['profile']) as record:
+            process = run_bingclaw(params['bingclaw_input_dir'], dirs['bingclaw_output_dir'], params['bingclaw_bathymetry'],
+                                   os.path.abspath(scenario_file), params['image_type'], params['image_name'],
+                                   params['bingclaw_output_format'], wait=False, instance=instance,
+                                   staging=params['staging'], shared_inputs=shared_inputs,
+                                   parameters=sweep_parameters(params['sweep_file'], scenario, 'bingclaw'),
+                                   timeout=params['bingclaw_timeout'])
+            casename = os.path.join(dirs['intmod_output_dir'], params['filename_prefix'])
+            exit_code = stream_interface_module(process, dirs['bingclaw_output_dir'], dirs['intmod_output_dir'],
+                                                os.path.join(params['hysea_input_dir'], params['bathy_file']), params['resolution'],
+                                                params['filter_type'], casename, skip_frames=1 if params['skip_first_frame_in_intmod'] else 0,
+                                                weights_cache_dir=params['weights_cache_dir'], storage=storage_of(params),
+                                                frame_tolerance=params['frame_tolerance'],
+                                                stop_when_stationary=params['stop_when_stationary'])
+            if exit_code == 0 and params['crop_threshold'] is not None:
+                with measure('crop'):
+                    crop_deformation(dirs['intmod_output_dir'], params['filename_prefix'], params['crop_threshold'],
+                                     params['crop_halo'], storage_of(params))
+            if exit_code != 0:
+                record['status'] = 'failed'
+                return 'bingclaw', failure_message('BingClaw', exit_code, stage_log(dirs['bingclaw_output_dir'], 'bingclaw'),
+                                                   params['bingclaw_timeout'])
+            if not params['skip_first_frame_in_intmod']:
+                with measure('remove_first_timestep'):
+                    remove_first_timestep(dirs['intmod_output_dir'], params['filename_prefix'], storage=storage_of(params))
+        tracker.done('bingclaw', digest, stage_outputs('bingclaw', scenario_file, params))
+        _, intmod_digest, _ = stage_state('interface_module', scenario_file, dict(params, resume=False))
+        tracker.done('interface_module', intmod_digest, stage_outputs('interface_module', scenario_file, params))
+        return None
+
+    if params['do_run_bingclaw']:
+        failure = run_bingclaw_stage(scenario_file, params, instance, shared_inputs)
+        if failure is not None:
+            return failure
+    if params['do_run_interface_module']:
+        return run_intmod_stage(scenario_file, params, intmod_pool, intmod_cache)
+    return None
+
+
+def run_bingclaw_stage(scenario_file, params, instance=None, shared_inputs=None):
+    """Run BingClaw for one scenario, unless it is up to date"""
+    return run_tracked('bingclaw', _run_bingclaw, scenario_file, params, instance, shared_inputs)
+
+
+def _run_bingclaw(scenario_file, params, instance, shared_inputs):
+    scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+    dirs = scenario_dirs(params['output_dir'], scenario)
+    os.makedirs(dirs['scenario_dir'], exist_ok=True)
+    exit_code = run_bingclaw(params['bingclaw_input_dir'], dirs['bingclaw_output_dir'], params['bingclaw_bathymetry'],
+                             os.path.abspath(scenario_file), params['image_type'], params['image_name'],
+                             params['bingclaw_output_format'], instance=instance,
+                             staging=params['staging'], shared_inputs=shared_inputs,
+                             parameters=sweep_parameters(params['sweep_file'], scenario, 'bingclaw'),
+                             timeout=params['bingclaw_timeout'])
+    if exit_code != 0:
+        return 'bingclaw', failure_message('BingClaw', exit_code, stage_log(dirs['bingclaw_output_dir'], 'bingclaw'),
+                                           params['bingclaw_timeout'])
+    return None
+
+
+def run_intmod_stage(scenario_file, params, intmod_pool=None, intmod_cache=None):
+    """Run the Interface Module (and remove_first_timestep) for one scenario, unless it is up to date"""
+    return run_tracked('interface_module', _run_intmod, scenario_file, params, intmod_pool, intmod_cache)
+
+
+def _run_intmod(scenario_file, params, intmod_pool, intmod_cache):
+    scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+    dirs = scenario_dirs(params['output_dir'], scenario)
+    casename = os.path.join(dirs['intmod_output_dir'], params['filename_prefix'])
+    skip_frames = 1 if params['skip_first_frame_in_intmod'] else 0
+    exit_code = run_interface_module(dirs['bingclaw_output_dir'], dirs['intmod_output_dir'], params['hysea_input_dir'],
+                                     params['donor'], params['bathy_file'], params['resolution'], params['filter_type'], casename,
+                                     skip_frames=skip_frames, mode=params['intmod_mode'], pool=intmod_pool, 
+                                     cache=intmod_cache, engine=params['intmod_engine'], weights_cache_dir=params['weights_cache_dir'],
+                                     kajiura_method=params['kajiura_method'], storage=storage_of(params),
+                                     frame_tolerance=params['frame_tolerance'], stop_when_stationary=params['stop_when_stationary'],
+                                     crop_threshold=params['crop_threshold'], crop_halo=params['crop_halo'],
+                                     timeout=params['intmod_timeout'])
+    if exit_code != 0:
+        log_file = None
+        if params['intmod_engine'] == 'intmod' and params['intmod_mode'] == 'subprocess':
+            log_file = stage_log(dirs['intmod_output_dir'], f"interface_module_{params['filename_prefix']}")
+        return 'interface_module', failure_message('Interface Module', exit_code, log_file, params['intmod_timeout'])
+    if not params['skip_first_frame_in_intmod']:
+        with measure('remove_first_timestep'):
+            remove_first_timestep(dirs['intmod_output_dir'], params['filename_prefix'], storage=storage_of(params))
+    return None
+
+
+def run_gpu_stages(scenario_file, params):
+    """Run T-HySEA and the extraction of the POI time series for one scenario, unless they are up to date"""
+    if params['do_run_hysea']:
+        failure = run_tracked('hysea', _run_hysea, scenario_file, params)
+        if failure is not None:
+            return failure
+    return run_post_stages(scenario_file, params)
+
+
+def run_post_stages(scenario_file, params):
+    """Extract the time series at the POIs from the T-HySEA output of one scenario, unless they are up to date"""
+    if params['extract_pois']:
+        return run_tracked('pois', _run_pois, scenario_file, params)
+    return None
+
+
+def _run_pois(scenario_file, params):
+    scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+    dirs = scenario_dirs(params['output_dir'], scenario)
+    extract_pois(dirs['hysea_output_dir'], dirs['post_output_dir'], params['filename_prefix'],
+                 os.path.join(params['hysea_input_dir'], params['pois_file']), params['poi_variables'])
+    return None
+
+
+def _run_hysea(scenario_file, params):
+    scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+    dirs = scenario_dirs(params['output_dir'], scenario)
+
+    exit_code = run_hysea(params['hysea_input_dir'], dirs['hysea_output_dir'], dirs['intmod_output_dir'], params['hysea_executable'],
+                          params['output_time_series'], params['pois_file'], scenario, params['filename_prefix'],
+                          ranks=params['hysea_ranks'], parameters=sweep_parameters(params['sweep_file'], scenario, 'hysea'),
+                          timeout=params['hysea_timeout'])
+    if exit_code != 0:
+        return 'hysea', failure_message('T-HySEA', exit_code, stage_log(dirs['hysea_output_dir'], f"hysea_{params['filename_prefix']}"),
+                                        params['hysea_timeout'])
+    return None
+
+
+def queue_hysea(scenario_file, params, batcher):
+    """Write the T-HySEA input file of one scenario and add it to the next T-HySEA batch"""
+    tracker, _, up_to_date = stage_state('hysea', scenario_file, params)
+    if up_to_date:
+        print(f"Skip hysea for {os.path.basename(scenario_file)}: outputs are up to date")
+        batcher.skip(scenario_file)
+        return None
+    tracker.start('hysea')
+    scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+    dirs = scenario_dirs(params['output_dir'], scenario)
+    hysea_input_file = prepare_hysea(params['hysea_input_dir'], dirs['hysea_output_dir'], dirs['intmod_output_dir'],
+                                     params['output_time_series'], params['pois_file'], scenario, params['filename_prefix'],
+                                     sweep_parameters(params['sweep_file'], scenario, 'hysea'))
+    batcher.submit(scenario_file, hysea_input_file)
+    return None
+
+
+def run_gpu_batch(scenario_file, params, batcher):
+    """Run T-HySEA for one scenario, together with the other scenarios ready at the same time"""
+    if batcher.skipped(scenario_file):
+        return run_post_stages(scenario_file, params)
+    with measure('hysea', _manifest(scenario_file, params), params['profile']) as record:
+        result = batcher.result(scenario_file)
+        record['exit_code'] = result.exit_code
+    if result.failed:
+        return 'hysea', failure_message('T-HySEA batch', result.exit_code, result.log_file, params['hysea_timeout'])
+    tracker, digest, _ = stage_state('hysea', scenario_file, dict(params, resume=False))
+    tracker.done('hysea', digest, stage_outputs('hysea', scenario_file, params))
+    return run_post_stages(scenario_file, params)
+
+
+def hysea_succeeded(scenario_files, params):
+    """Return the scenarios whose T-HySEA stage succeeded with the current inputs and parameters (see py/stages.py),
+    e.g. after the jobs of submit_ensemble, so that stale outputs of failed scenarios are not aggregated"""
+    succeeded = []
+    for scenario_file in scenario_files:
+        if stage_state('hysea', scenario_file, dict(params, resume=True))[2]:
+            succeeded.append(scenario_file)
+        else:
+            print(f"WARNING: T-HySEA did not succeed for {os.path.basename(scenario_file)}; it is left out of the hazard maps")
+    return succeeded
+
+
+def hazard_grid_files(scenario_files, params):
+    """Return the T-HySEA output grid files of the scenarios that have one"""
+    grid_files = []
+    for scenario_file in scenario_files:
+        grids = [f for f in stage_outputs('hysea', scenario_file, params) if f.endswith('.nc') and not f.endswith('_ts.nc')]
+        if grids:
+            grid_files.append(grids[0])
+        else:
+            print(f"WARNING: no T-HySEA output grid for {os.path.basename(scenario_file)}; it is left out of the hazard maps")
+    return grid_files
+
+
+def run_hazard(scenario_files, params, workers=1):
+    """Aggregate the T-HySEA outputs of the scenarios into hazard maps (outputs/hazard.nc) with workers processes"""
+    grid_files = hazard_grid_files(scenario_files, params)
+    if len(grid_files) == 0:
+        print("WARNING: no T-HySEA output to aggregate into hazard maps")
+        return None
+    with measure('hazard', Manifest(params['output_dir'], 'ensemble')) as record:
+        record['count'] = len(grid_files)
+        return aggregate_hazard(grid_files, os.path.join(params['output_dir'], HAZARD_FILE), params['hazard_thresholds'],
+                                params['arrival_threshold'], workers)
+
+
+def _run_stages(stages, scenario_file, params, *args):
+    # Run stages of one scenario, turning any error (including sys.exit calls in
+    # the run_* functions) into a (stage, message) failure, so that it does not stop the other scenarios.
+    # KeyboardInterrupt is not caught, so that Ctrl-C stops the ensemble (see run_ensemble)
+    try:
+        return stages(scenario_file, params, *args)
+    except (Exception, SystemExit) as err:
+        traceback.print_exc()
+        return stages.__name__, f"{type(err).__name__}: {err}"
+
+
+def run_ensemble(scenarios, params, cpu_workers=4, gpu_workers=1):
+    print("* Executing run_ensemble")
+
+    scenario_files = find_scenarios(scenarios)
+    if len(scenario_files) == 0:
+        print(f"No scenario found in {scenarios}")
+        return {}
+    print(f"Found {len(scenario_files)} scenarios; running with {cpu_workers} CPU workers and {gpu_workers} GPU workers")
+    if params['stream_intmod'] and params['intmod_engine'] != 'native':
+        print("WARNING: stream_intmod is only available with intmod_engine 'native'; the Interface Module runs after BingClaw")
+        params = dict(params, stream_intmod=False)
+    elif params['stream_intmod'] and params['intmod_cache_dir'] is not None:
+        print('WARNING: the Interface Module cache is not used with stream_intmod')
+    if params['stream_intmod'] and params['do_run_bingclaw'] and params['do_run_interface_module'] and params['filter_type'] != 'none':
+        sys.exit(f"Filter '{params['filter_type']}' is not available with stream_intmod. Use filter_type 'none' or set stream_intmod to False")
+
+    # Workers and containers are always stopped, also when the ensemble fails or is interrupted
+    intmod_pool = None
+    containers = []
+    try:
+        # Persistent Interface Module workers shared by all scenarios (one per CPU worker)
+        intmod_pool = IntmodPool(cpu_workers) if params['intmod_mode'] == 'pool' else None
+        # Long-lived BingClaw containers (one per CPU worker), shared through a queue
+        instances = None
+        if params['persistent_containers'] and params['do_run_bingclaw']:
+            instances = queue.Queue()
+            with measure('container_start', Manifest(params['output_dir'], 'ensemble')) as record:
+                for _ in range(cpu_workers):
+                    input_dir = params['bingclaw_input_dir'] if params['staging'] == 'bind' else None
+                    instance = BingclawInstance(params['image_type'], params['image_name'], params['output_dir'], input_dir=input_dir)
+                    containers.append(instance)
+                    instances.put(instance.start())
+                record['count'] = cpu_workers
+        # Shared BingClaw inputs, verified by checksum once for all scenarios
+        shared_inputs = SharedInputs(params['staging'])
+        # Cache of Interface Module outputs
+        intmod_cache = None
+        if params['intmod_cache_dir'] is not None:
+            intmod_cache = IntmodCache(params['intmod_cache_dir'], params['intmod_cache_size_gb'])
+
+        # T-HySEA batches of the scenarios ready at the same time
+        batcher = None
+        if params['hysea_batch'] and params['do_run_hysea']:
+            batcher = HyseaBatcher(params['hysea_executable'], os.path.join(params['output_dir'], 'hysea_batches'),
+                                   params['hysea_max_batch_size'], concurrent_batches=gpu_workers, ranks=params['hysea_ranks'],
+                                   timeout=params['hysea_timeout'])
+
+        status = {}
+        with ThreadPoolExecutor(max_workers=cpu_workers) as cpu_pool, ThreadPoolExecutor(max_workers=gpu_workers) as gpu_pool:
+            try:
+                # Run CPU stages for all scenarios; as soon as a scenario is done, hand it over to the GPU pool
+                cpu_futures = {cpu_pool.submit(_run_stages, run_cpu_stages, f, params, intmod_pool, intmod_cache, instances, shared_inputs): f for f in scenario_files}
+                gpu_futures = {}
+                for future in as_completed(cpu_futures):
+                    scenario_file = cpu_futures[future]
+                    failure = future.result()
+                    if failure is None and batcher is not None:
+                        failure = _run_stages(queue_hysea, scenario_file, params, batcher)
+                    if failure is not None:
+                        status[scenario_file] = failure
+                    elif batcher is not None:
+                        gpu_futures[gpu_pool.submit(_run_stages, run_gpu_batch, scenario_file, params, batcher)] = scenario_file
+                    else:
+                        gpu_futures[gpu_pool.submit(_run_stages, run_gpu_stages, scenario_file, params)] = scenario_file
+
+                for future in as_completed(gpu_futures):
+                    status[gpu_futures[future]] = future.result()
+            except BaseException:
+                # Do not start the scenarios left and stop the processes running (e.g. on Ctrl-C), so that the pools can shut down
+                cpu_pool.shutdown(wait=False, cancel_futures=True)
+                gpu_pool.shutdown(wait=False, cancel_futures=True)
+                cancel_all()
+                raise
+    finally:
+        if intmod_pool is not None:
+            intmod_pool.shutdown()
+        for instance in containers:
+            instance.stop()
+
+    # Summary
+    n_failed = sum(1 for failure in status.values() if failure is not None)
+    print(f"\n* Done running ensemble: {len(scenario_files) - n_failed} scenarios succeeded, {n_failed} failed")
+    for scenario_file in scenario_files:
+        scenario = os.path.splitext(os.path.basename(scenario_file))[0]
+        failure = status[scenario_file]
+        if failure is None:
+            print(f"  {scenario}: OK")
+        else:
+            print(f"  {scenario}: FAILED in stage '{failure[0]}' ({failure[1]})")
+    if intmod_cache is not None:
+        print(intmod_cache.summary())
+    if params['aggregate_hazard']:
+        run_hazard([f for f in scenario_files if status[f] is None], params, cpu_workers)
+    print(f"Performance of the stages written to {write_rollup(params['output_dir'])}")
+    return status
@@ -8,19 +8,49 @@ Input needed:
  - hysea_executable     # Full path of location of T-HySEA executable
  - scenario             # Simulation name
  - casename_from_intmod # Casename used in Interface Module to identify filter and resolution used for a specific scenario
+ - ranks                # Number of MPI ranks (= GPUs) used by T-HySEA, or 'auto' to choose it from the grid size and the visible GPUs (default 1)
+ - parameters           # Numeric parameters of the input file to set, by the names in py/render.py HYSEA_PARAMETERS
+                          (e.g. {'simulation_time': 3600, 'manning': 0.025}). Default None: values of the template
+ - timeout              # Time (s) after which T-HySEA is stopped (default None: no limit)
+T-HySEA runs as an asyncio subprocess (see py/processes.py); its output is written to
+<scenario_dir>/logs/hysea_<casename_from_intmod>.log.
 
 Created by V. Magni (NGI)
 """
 
 import os 
 import sys
-import shutil
-from pyutil import filereplace
+import tempfile
 
-# TODO: WORK IN PROGRESS
-def run_hysea(hysea_input_dir, hysea_output_dir, intmod_output_dir, hysea_executable, output_time_series, pois_file, scenario, casename_from_intmod):
-    print("* Executing run_hysea")
+from py.render import render_file, HYSEA_PLACEHOLDERS
+from py.hysea_launch import resolve_ranks, input_bathymetry, mpi_command
+from py.instrument import measure, current_record
+from py.processes import run_command, stage_log
+
+def write_simulations_file(hysea_input_files, list_dir):
+    """Write the list of T-HySEA input files in a new, uniquely named file in list_dir and return its name"""
+    os.makedirs(list_dir, exist_ok=True)
+    fd, simulations_file = tempfile.mkstemp(prefix='simulations_', suffix='.txt', dir=list_dir)
+    with os.fdopen(fd, 'w') as f:
+        for hysea_input_file in hysea_input_files:
+            f.write(os.path.abspath(hysea_input_file) + '\n')
+    return simulations_file
+
+
+def intmod_file(intmod_output_dir, casename_from_intmod, kind):
+    """Return the file of kind ('bathymetry' or 'deformation') written by the Interface Module for casename_from_intmod,
+    <casename_from_intmod>_<kind>.nc if it exists, else the first file <casename_from_intmod>_* naming kind"""
+    prefix = casename_from_intmod + '_'
+    found = [x for x in sorted(os.listdir(intmod_output_dir)) if x.startswith(prefix) and kind in x[len(prefix):]]
+    found.sort(key=lambda x: x != f"{prefix}{kind}.nc")
+    if len(found) == 0:
+        sys.exit(f"run_hysea cannot find the {kind} file of {casename_from_intmod} in {intmod_output_dir} (did the Interface Module fail?)")
+    return os.path.join(intmod_output_dir, found[0])
 
+
+def prepare_hysea(hysea_input_dir, hysea_output_dir, intmod_output_dir, output_time_series, pois_file, scenario, casename_from_intmod,
+                  parameters=None):
+    """Write the T-HySEA input file of a scenario and return its name"""
     # Check that Interface Module output directory exists
     if not os.path.exists(intmod_output_dir):
         sys.exit(f"run_hysea cannot read output from Interface Module because {intmod_output_dir} does not exist")
@@ -32,30 +62,39 @@ def run_hysea(hysea_input_dir, hysea_output_dir, intmod_output_dir, hysea_execut
         print(f"Directory {hysea_output_dir} already exists")
     
     # Get names of files created by the Interface Module 
-    dir_list = os.listdir(intmod_output_dir)
-    bathy = [x for x in dir_list if ('bathymetry' in x and casename_from_intmod in x)][0]
-    bathymetry = os.path.join(intmod_output_dir, bathy)
-    deform = [x for x in dir_list if ('deformation' in x and casename_from_intmod in x)][0]
-    deformation = os.path.join(intmod_output_dir, deform)
-
-    # Copy template input file in the scenario/hysea output directory 
-    # and insert paths/names of files required to run the simualtion
+    bathymetry = intmod_file(intmod_output_dir, casename_from_intmod, 'bathymetry')
+    deformation = intmod_file(intmod_output_dir, casename_from_intmod, 'deformation')
+
+    # Write the input file in the scenario/hysea output directory from the template,
+    # with paths/names of files required to run the simualtion and parameters
+    hysea_outname = os.path.join(hysea_output_dir,casename_from_intmod)
+    values = {'BATHYMETRY': bathymetry, 'SCENARIO_NAME': scenario, 'HYSEA_OUTNAME': hysea_outname, 'DEFORMATION_FILE': deformation}
     if output_time_series:
         hysea_template_file = os.path.join(hysea_input_dir, 'hysea_input_ts.template') 
-        pois_file_full = os.path.join(hysea_input_dir, pois_file)
+        values['POIS_FILE'] = os.path.join(hysea_input_dir, pois_file)
     else:
         hysea_template_file = os.path.join(hysea_input_dir, 'hysea_input.template') 
 
-    hysea_outname = os.path.join(hysea_output_dir,casename_from_intmod)
     hysea_input_file = os.path.join(hysea_output_dir, (casename_from_intmod + '.txt'))
-    cp = shutil.copy(hysea_template_file, hysea_input_file)
-    filereplace(hysea_input_file, 'BATHYMETRY', bathymetry)
-    filereplace(hysea_input_file, 'SCENARIO_NAME', scenario)
-    filereplace(hysea_input_file, 'HYSEA_OUTNAME', hysea_outname)
-    filereplace(hysea_input_file, 'DEFORMATION_FILE', deformation)
-    if output_time_series:
-        filereplace(hysea_input_file, 'POIS_FILE', pois_file_full)
-    
-    # Run T-HySEA simulation
-    command = f"echo {hysea_input_file} > 'simulations.txt'; mpirun -np 1 {hysea_executable} 'simulations.txt'"
-    os.system(command)
+    return render_file(hysea_template_file, hysea_input_file, values, HYSEA_PLACEHOLDERS, parameters)
+
+
+def run_hysea(hysea_input_dir, hysea_output_dir, intmod_output_dir, hysea_executable, output_time_series, pois_file, scenario, casename_from_intmod, ranks=1,
+              parameters=None, timeout=None):
+    print("* Executing run_hysea")
+    with measure('render'):
+        hysea_input_file = prepare_hysea(hysea_input_dir, hysea_output_dir, intmod_output_dir, output_time_series,
+                                         pois_file, scenario, casename_from_intmod, parameters)
+
+    # Run T-HySEA simulation and return its exit code
+    # The list of simulations has a unique name, so that runs at the same time 
+    # (e.g. in run_ensemble) do not overwrite each other's list
+    simulations_file = write_simulations_file([hysea_input_file], hysea_output_dir)
+    ranks = resolve_ranks(ranks, input_bathymetry(hysea_input_file))
+    command = mpi_command(hysea_executable, simulations_file, ranks)
+    print(f"Running T-HySEA on {ranks} GPUs")
+    with measure('run') as record:
+        record['exit_code'] = run_command(command, stage_log(hysea_output_dir, f"hysea_{casename_from_intmod}"), timeout,
+                                          'T-HySEA').exit_code
+    current_record()['exit_code'] = record['exit_code']
+    return record['exit_code']
@@ -10,14 +10,84 @@ Input needed:
  - resolution            # Flag for interface module: Resolution (m)
  - filter_type           # Flag for interface module: Filter for deformation data (kajiura / none)
  - casename              # Flag for interface module: String used to name output files from Interface Module (including directory where files are saved)
+ - skip_frames           # Number of leading timesteps to drop from the deformation output (default 0), so that the first
+                           timestep is never written. Engine 'native' drops them when writing, which gives the same output
+                           as running remove_first_timestep afterwards. The Interface Module reads a view of the BingClaw
+                           output (intmod_output_dir/<prefix>_bingclaw_frames) in which frame i has the data of BingClaw frame
+                           i+skip_frames and the time of BingClaw frame i. This gives the output of remove_first_timestep
+                           only if each deformation timestep is computed from the BingClaw frame with the same number alone,
+                           not relative to the first frame read (as engine 'native' does, from frame 0); this has not been
+                           checked against a real Interface Module run, so the workflow uses remove_first_timestep by default.
+ - mode                  # How the Interface Module is run (default 'subprocess'):
+                           'subprocess': a new python process for every call
+                           'inprocess':  inside the current python process, so its imports are done only once (see py/intmod_worker.py)
+                           'pool':       in a persistent worker process of pool (an IntmodPool from py/intmod_worker.py)
+ - pool                  # IntmodPool used when mode is 'pool'
+ - cache                 # IntmodCache (see py/intmod_cache.py) used to reuse the outputs of a previous identical run (default None: no cache)
+ - engine                # Code that converts BingClaw outputs (default 'intmod'):
+                           'intmod': the Interface Module, run as set by mode
+                           'native': the workflow implementation in py/intmod_native.py, which reuses the interpolation
+                                     operator from the BingClaw grid to the target grid (filter_type 'none' or 'kajiura').
+                                     Experimental: not yet validated against the Interface Module (see py/intmod_reference.py)
+ - weights_cache_dir     # Directory where the interpolation operators of engine 'native' are saved and reused (default None)
+ - kajiura_method        # Kajiura filter of engine 'native' (see py/kajiura.py): 'fft' (default; in the frequency domain,
+                           with transfer functions cached per target grid) or 'direct' (convolution in space, reference).
+                           No effect with engine 'intmod': the Interface Module applies its own filter
+ - storage               # Storage of the deformation file (see py/deformation_storage.py; default None: as written by the engine).
+                           Engine 'native' writes it so; the output of the Interface Module is rewritten with pack_deformation
+                           when skip_frames > 0 (otherwise remove_first_timestep(..., storage=storage) does it)
+ - frame_tolerance       # Change of landslide thickness (m) above which a BingClaw frame is converted (default None: all
+                           frames); see py/frame_selection.py. Each frame kept takes the time of the frame skip_frames
+                           before it; use it with skip_frames > 0, as remove_first_timestep shifts times by one frame kept
+ - stop_when_stationary  # With frame_tolerance, end the deformation series at the last frame kept (default True)
+ - crop_threshold        # Crop the deformation to the cells where it is above crop_threshold (m) in some frame, plus
+                           crop_halo (m) (see py/active_region.py; default None: no cropping). Engine 'native' only
+                           interpolates and filters that region; the output of the Interface Module is cropped afterwards
+ - crop_halo             # Distance (m) added around the active region (default 5000)
+ - shared_frames         # BingClaw frames already read by load_frames (see py/variants.py; default None: read them
+                           when needed). Engine 'native' converts them; engine 'intmod' selects frames on them
+ - timeout               # Time (s) after which the Interface Module is stopped, in mode 'subprocess' (default None: no limit).
+                           The Interface Module runs as an asyncio subprocess (see py/processes.py) and its output is written to
+                           <scenario_dir>/logs/interface_module_<prefix>.log
 
 Created by V. Magni (NGI)
 """
 import os 
 import sys
 
+from py.bingclaw_frames import list_frames, stage_frames, frame_format
+from py.intmod_worker import INTERFACE_MODULE, call_interface_module
+from py.intmod_native import run_intmod_native, read_thickness
+from py.frame_selection import select_frames, shifted_frames
+from py.instrument import measure, current_record
+from py.intmod_cache import file_hash, interface_module_revision
+from py.remove_first_timestep import pack_deformation, crop_deformation
+from py.active_region import CROP_HALO
+from py.deformation_storage import storage_key
+from py.processes import run_command, stage_log
 
-def run_interface_module(bingclaw_output_dir, intmod_output_dir, hysea_input_dir, donor, bathy_file, resolution, filter_type, casename):
+
+def native_revision():
+    """Return the revision of engine 'native' used in the cache key (hash of its source files)"""
+    sources = [os.path.join(os.path.dirname(__file__), f) for f in ('intmod_native.py', 'interp_weights.py', 'bingclaw_frames.py', 'kajiura.py', 'deformation_storage.py',
+                                                                    'frame_selection.py', 'active_region.py')]
+    return 'native:' + ','.join(file_hash(f) for f in sources)
+
+
+def finish_intmod(intmod_output_dir, prefix, skip_frames, storage, crop_threshold, crop_halo):
+    """Crop (or only repack) the deformation file written by the Interface Module"""
+    if crop_threshold is not None:
+        with measure('crop'):
+            crop_deformation(intmod_output_dir, prefix, crop_threshold, crop_halo, storage)
+    elif storage is not None and skip_frames > 0:
+        with measure('pack'):
+            pack_deformation(intmod_output_dir, prefix, storage)
+
+
+def run_interface_module(bingclaw_output_dir, intmod_output_dir, hysea_input_dir, donor, bathy_file, resolution, filter_type, casename, skip_frames=0, 
+                         mode='subprocess', pool=None, cache=None, engine='intmod', weights_cache_dir=None, kajiura_method='fft',
+                         storage=None, frame_tolerance=None, stop_when_stationary=True, crop_threshold=None,
+                         crop_halo=CROP_HALO, shared_frames=None, timeout=None):
     print("* Executing run_interface_module")
     
     # Check that BingClaw output directory exists
@@ -31,10 +101,90 @@ def run_interface_module(bingclaw_output_dir, intmod_output_dir, hysea_input_dir
         print(f"Directory {intmod_output_dir} already exists")
 
     bathymetry = os.path.join(hysea_input_dir, bathy_file)
+
+    # Reuse outputs of a previous run with the same BingClaw frames, bathymetry and parameters
+    prefix = os.path.basename(casename)
+    if cache is not None:
+        revision = None if engine == 'intmod' else native_revision()
+        if engine == 'native' and filter_type == 'kajiura':
+            revision += f":kajiura-{kajiura_method}"
+        if engine == 'native' and storage is not None:
+            revision += f":{storage_key(storage)}"
+        if frame_tolerance is not None:
+            revision = f"{revision or interface_module_revision()}:frames-{frame_tolerance}-{stop_when_stationary}"
+        if engine == 'native' and crop_threshold is not None:
+            revision += f":crop-{crop_threshold}-{crop_halo}"
+        with measure('cache_fetch'):
+            cache_key = cache.key(bingclaw_output_dir, donor, bathymetry, resolution, filter_type, skip_frames, revision)
+            hit = cache.fetch(cache_key, intmod_output_dir, prefix)
+        if hit:
+            print(f"Interface Module outputs taken from cache {cache.cache_dir} (key {cache_key})")
+            if engine == 'intmod':
+                finish_intmod(intmod_output_dir, prefix, skip_frames, storage, crop_threshold, crop_halo)
+            current_record()['exit_code'] = 0
+            return 0
+        # Remove outputs of previous runs, which might be read-only links to the cache
+        for fname in os.listdir(intmod_output_dir):
+            if fname.startswith(prefix + '_') and os.path.isfile(os.path.join(intmod_output_dir, fname)):
+                os.remove(os.path.join(intmod_output_dir, fname))
+
+    if engine == 'native':
+        exit_code = run_intmod_native(bingclaw_output_dir, bathymetry, resolution, filter_type, casename,
+                                      skip_frames, weights_cache_dir, kajiura_method=kajiura_method, storage=storage,
+                                      frame_tolerance=frame_tolerance, stop_when_stationary=stop_when_stationary,
+                                      crop_threshold=crop_threshold, crop_halo=crop_halo, shared_frames=shared_frames)
+        if cache is not None:
+            with measure('cache_store'):
+                cache.store(cache_key, intmod_output_dir, prefix)
+        current_record()['exit_code'] = exit_code
+        return exit_code
+    elif engine != 'intmod':
+        sys.exit(f"{engine} is not a valid engine. Options are 'intmod' or 'native'")
+
+    frames = list_frames(bingclaw_output_dir)
+    if frames and frame_format(bingclaw_output_dir, frames[0]) == 'binary':
+        print(f"WARNING: BingClaw frames in {bingclaw_output_dir} are binary, the Interface Module might not be able to read them (use engine 'native')")
+
+    # Let the Interface Module read only the frames after the first skip_frames ones (and only the frames selected)
+    if skip_frames > 0 or frame_tolerance is not None:
+        if len(frames) <= skip_frames:
+            sys.exit(f"Cannot skip {skip_frames} frames: {bingclaw_output_dir} has only {len(frames)} frames")
+        kept = list(range(len(frames)))
+        if frame_tolerance is not None:
+            with measure('select_frames'):
+                if shared_frames is not None:
+                    thickness = shared_frames['thickness']
+                else:
+                    thickness, _ = read_thickness(bingclaw_output_dir, frames)
+                kept = select_frames(thickness, frame_tolerance, stop_when_stationary, skip_frames + 1)
+                del thickness
+            print(f"Kept {len(kept)} of {len(frames)} BingClaw frames (frame_tolerance {frame_tolerance} m)")
+        frames_dir = os.path.join(intmod_output_dir, prefix + '_bingclaw_frames')
+        bingclaw_output_dir = stage_frames(bingclaw_output_dir, frames_dir, *shifted_frames(frames, kept, skip_frames))
+        print(f"Interface Module reads BingClaw frames from {frames_dir} (first {skip_frames} frames skipped)")
     
-    # Run Interface Module
-    tolaunch = os.path.join(os.getcwd(),'Interface-module','interface_module.py')
-    command = f"python {tolaunch} --donor {donor} {bingclaw_output_dir} {bathymetry} \
-                --resolution {resolution} --filter {filter_type} --casename {casename}"
-    os.system(command)
+    # Run Interface Module and return its exit code
+    args = ['--donor', donor, bingclaw_output_dir, bathymetry, 
+            '--resolution', resolution, '--filter', filter_type, '--casename', casename]
+    with measure('run') as record:
+        if mode == 'subprocess':
+            command = ['python', INTERFACE_MODULE] + args
+            exit_code = run_command(command, stage_log(intmod_output_dir, f"interface_module_{prefix}"), timeout,
+                                    'Interface Module').exit_code
+        elif mode == 'inprocess':
+            exit_code = call_interface_module(args)
+        elif mode == 'pool':
+            if pool is None:
+                sys.exit("run_interface_module needs a pool (IntmodPool) when mode is 'pool'")
+            exit_code = pool.run(args)
+        else:
+            sys.exit(f"{mode} is not a valid mode. Options are 'subprocess', 'inprocess' or 'pool'")
+        record['exit_code'] = exit_code
 
+    if cache is not None and exit_code == 0:
+        with measure('cache_store'):
+            cache.store(cache_key, intmod_output_dir, prefix)
+    if exit_code == 0:
+        finish_intmod(intmod_output_dir, prefix, skip_frames, storage, crop_threshold, crop_halo)
+    current_record()['exit_code'] = exit_code
+    return exit_code
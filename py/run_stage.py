@@ -0,0 +1,52 @@
+"""
+Script to run one stage of one scenario of an ensemble, as one task of a job array (see py/scheduler.py)
+
+Usage (from the root of the repo):
+    python -m py.run_stage <stage> <params.json> <scenarios.txt> <task>
+
+Input needed:
+ - stage            # 'bingclaw', 'interface_module' or 'hysea'
+ - params.json      # Workflow parameters (see run_ensemble.py in the root of the repo), written by submit_ensemble
+ - scenarios.txt    # List of scenario .tt3 files, one per line
+ - task             # Index of the scenario in the list (e.g. $SLURM_ARRAY_TASK_ID)
+
+Exit code is 0 if the stage succeeded, 1 otherwise.
+"""
+
+import sys
+import json
+
+from py.run_ensemble import run_bingclaw_stage, run_intmod_stage, run_gpu_stages, _run_stages
+from py.intmod_cache import IntmodCache
+
+
+def run_stage(stage, params, scenario_file):
+    """Run stage for scenario_file and return the failure (stage, message), or None"""
+    print(f"* Executing run_stage {stage} for {scenario_file}")
+    if stage == 'bingclaw':
+        return _run_stages(run_bingclaw_stage, scenario_file, params)
+    elif stage == 'interface_module':
+        # One scenario per task: no persistent pool of Interface Module workers
+        params = dict(params, intmod_mode='subprocess' if params['intmod_mode'] == 'pool' else params['intmod_mode'])
+        intmod_cache = None
+        if params['intmod_cache_dir'] is not None:
+            intmod_cache = IntmodCache(params['intmod_cache_dir'], params['intmod_cache_size_gb'])
+        return _run_stages(run_intmod_stage, scenario_file, params, None, intmod_cache)
+    elif stage == 'hysea':
+        return _run_stages(run_gpu_stages, scenario_file, params)
+    sys.exit(f"{stage} is not a valid stage. Options are 'bingclaw', 'interface_module' or 'hysea'")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 5:
+        sys.exit("Usage: python -m py.run_stage <stage> <params.json> <scenarios.txt> <task>")
+    stage, params_file, scenarios_file, task = sys.argv[1:]
+    with open(params_file) as f:
+        params = json.load(f)
+    with open(scenarios_file) as f:
+        scenario_files = f.read().split()
+
+    failure = run_stage(stage, params, scenario_files[int(task)])
+    if failure is not None:
+        print(f"FAILED in stage '{failure[0]}' ({failure[1]})")
+        sys.exit(1)
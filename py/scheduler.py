@@ -0,0 +1,144 @@
+"""
+Script to submit an ensemble of BingClaw scenarios to a batch scheduler as job arrays
+
+Instead of running the stages in the foreground (run_ensemble), submit_ensemble turns
+the ensemble into one job array per stage, with one array task per scenario:
+ - 'bingclaw':          CPU array running BingClaw in its container
+ - 'interface_module':  CPU array running the Interface Module (and remove_first_timestep)
+ - 'hysea':             GPU array running T-HySEA (and the extraction of the POI time series)
+Task i of a stage depends only on task i of the previous stage (SLURM dependency
+'aftercorr', i.e. afterok per array task), so each scenario moves to its next stage as
+soon as its previous stage is done, independently of the other scenarios. Every task
+runs 'python -m py.run_stage <stage> <params.json> <scenarios.txt> <task>' in the
+directory the ensemble was submitted from (see py/run_stage.py).
+
+Schedulers (same interface: submit(stage, n_tasks, resource, dependency=None) returns a job id):
+ - SlurmScheduler: writes a batch script per stage in job_dir and submits it with sbatch
+ - LocalScheduler: runs the array tasks on this machine with a pool of workers per resource
+                   (CPU/GPU) and the same per-task dependencies; for testing on a workstation
+
+Input needed:
+ - scenarios        # Directory with the .tt3 files describing initial conditions, or glob pattern of .tt3 files
+ - params           # Dictionary with the workflow parameters (see run_ensemble.py in the root of the repo)
+ - scheduler        # SlurmScheduler or LocalScheduler
+ - job_dir          # Directory where parameters, scenario list, batch scripts and logs are written
+ - sbatch_options   # Dictionary with the #SBATCH options of the 'cpu' and 'gpu' arrays (e.g. {'gpu': ['--gres=gpu:1']})
+"""
+
+import os
+import sys
+import json
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from py.run_ensemble import find_scenarios
+
+# Stages in order, with the resource they need
+STAGES = [('bingclaw', 'cpu'), ('interface_module', 'cpu'), ('hysea', 'gpu')]
+RUN_FLAGS = {'bingclaw': 'do_run_bingclaw', 'interface_module': 'do_run_interface_module', 'hysea': 'do_run_hysea'}
+
+
+def task_command(stage, job_dir, task):
+    """Return the command running task task of stage"""
+    return [sys.executable, '-m', 'py.run_stage', stage, os.path.join(job_dir, 'params.json'),
+            os.path.join(job_dir, 'scenarios.txt'), str(task)]
+
+
+class SlurmScheduler:
+    """Submit the stages as SLURM job arrays"""
+
+    def __init__(self, job_dir, sbatch_options=None):
+        self.job_dir = os.path.abspath(job_dir)
+        self.sbatch_options = sbatch_options or {}
+
+    def write_script(self, stage, n_tasks, resource):
+        """Write the batch script of the job array of stage and return its name"""
+        script = os.path.join(self.job_dir, f"{stage}.sbatch")
+        command = ' '.join(task_command(stage, self.job_dir, '$SLURM_ARRAY_TASK_ID'))
+        lines = ['#!/bin/bash',
+                 f"#SBATCH --job-name={stage}",
+                 f"#SBATCH --array=0-{n_tasks - 1}",
+                 f"#SBATCH --output={os.path.join(self.job_dir, 'logs', stage)}_%a.out"]
+        lines += [f"#SBATCH {option}" for option in self.sbatch_options.get(resource, [])]
+        lines += ['', f"cd {os.getcwd()}", command, '']
+        with open(script, 'w') as f:
+            f.write('\n'.join(lines))
+        return script
+
+    def submit(self, stage, n_tasks, resource='cpu', dependency=None):
+        """Submit the job array of stage; task i starts when task i of job dependency succeeded"""
+        script = self.write_script(stage, n_tasks, resource)
+        command = ['sbatch', '--parsable']
+        if dependency is not None:
+            command.append(f"--dependency=aftercorr:{dependency}")
+        try:
+            result = subprocess.run(command + [script], capture_output=True, text=True)
+        except FileNotFoundError:
+            sys.exit("sbatch not found: SLURM is not available on this machine (use backend 'local' to run the job arrays here)")
+        if result.returncode != 0:
+            sys.exit(f"sbatch failed for stage {stage}: {result.stderr.strip()}")
+        job_id = result.stdout.strip().split(';')[0]
+        print(f"Submitted {stage} array of {n_tasks} tasks as job {job_id}")
+        return job_id
+
+    def wait(self):
+        """Jobs run in the background; nothing to wait for"""
+        return None
+
+
+class LocalScheduler:
+    """Run the stages as job arrays on this machine, with the same per-task dependencies as SlurmScheduler"""
+
+    def __init__(self, job_dir, cpu_workers=4, gpu_workers=1):
+        self.job_dir = os.path.abspath(job_dir)
+        self.pools = {'cpu': ThreadPoolExecutor(max_workers=cpu_workers), 'gpu': ThreadPoolExecutor(max_workers=gpu_workers)}
+        self.tasks = {}   # Future of each task of each job
+        self.lock = threading.Lock()
+
+    def run_task(self, stage, task, dependency):
+        # Like SLURM, a task whose dependency failed does not run (and counts as failed)
+        if dependency is not None and self.tasks[dependency][task].result() != 0:
+            return None
+        with open(os.path.join(self.job_dir, 'logs', f"{stage}_{task}.out"), 'w') as log:
+            return subprocess.run(task_command(stage, self.job_dir, task), stdout=log, stderr=subprocess.STDOUT).returncode
+
+    def submit(self, stage, n_tasks, resource='cpu', dependency=None):
+        """Start the tasks of stage; task i starts when task i of job dependency succeeded"""
+        with self.lock:
+            job_id = str(len(self.tasks))
+            self.tasks[job_id] = [self.pools[resource].submit(self.run_task, stage, task, dependency) for task in range(n_tasks)]
+        print(f"Started {stage} array of {n_tasks} tasks as local job {job_id}")
+        return job_id
+
+    def wait(self):
+        """Wait for all tasks; return the exit code of each task of each job (None if not run)"""
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+        return {job_id: [task.result() for task in tasks] for job_id, tasks in self.tasks.items()}
+
+
+def submit_ensemble(scenarios, params, scheduler):
+    print(f"* Executing submit_ensemble")
+
+    scenario_files = find_scenarios(scenarios)
+    if len(scenario_files) == 0:
+        print(f"No scenario found in {scenarios}")
+        return {}
+
+    # Parameters and list of scenarios read by the array tasks
+    os.makedirs(os.path.join(scheduler.job_dir, 'logs'), exist_ok=True)
+    with open(os.path.join(scheduler.job_dir, 'params.json'), 'w') as f:
+        json.dump(params, f, indent=1)
+    with open(os.path.join(scheduler.job_dir, 'scenarios.txt'), 'w') as f:
+        f.write('\n'.join(os.path.abspath(scenario_file) for scenario_file in scenario_files) + '\n')
+
+    jobs = {}
+    dependency = None
+    for stage, resource in STAGES:
+        if not params[RUN_FLAGS[stage]]:
+            continue
+        dependency = scheduler.submit(stage, len(scenario_files), resource, dependency)
+        jobs[stage] = dependency
+    print(f"Submitted {len(scenario_files)} scenarios; logs in {os.path.join(scheduler.job_dir, 'logs')}")
+    return jobs
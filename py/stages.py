@@ -0,0 +1,93 @@
+"""
+Record of the stages done for a scenario, used to skip stages that are up to date and resume after a crash
+
+Every stage of a scenario (BingClaw, Interface Module, T-HySEA) is described by:
+ - inputs:   files read by the stage that are not made by the workflow (e.g. the .tt3 scenario
+             file, bathymetries, templates); identified by their content hash
+ - upstream: stages whose outputs it reads; identified by the size and modification time
+             of those outputs, so large outputs (BingClaw frames) are not hashed
+ - params:   parameters that change its result
+ - outputs:  files it writes
+The digest of these is saved in <scenario_dir>/.stages.json, with the size and
+modification time of the outputs, when the stage succeeds. A stage is up to date if
+its digest is unchanged and its outputs are still there, unchanged. The record of a
+stage is removed when the stage starts, so a stage that crashed or was killed (e.g.
+at the wall time of a job) is run again next time.
+
+Input needed:
+ - scenario_dir     # Output directory of the scenario
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+from py.intmod_cache import file_hash
+
+STATE_FILE = '.stages.json'
+
+_lock = threading.Lock()
+
+
+def stat_signature(files):
+    """Return the (name, size, modification time) of files"""
+    signature = []
+    for filename in sorted(files):
+        st = os.stat(filename)
+        signature.append([os.path.abspath(filename), st.st_size, st.st_mtime_ns])
+    return signature
+
+
+class StageTracker:
+    """Stages done for one scenario, saved in <scenario_dir>/.stages.json"""
+
+    def __init__(self, scenario_dir):
+        self.state_file = os.path.join(scenario_dir, STATE_FILE)
+
+    def load(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def save(self, state):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.state_file), prefix=STATE_FILE)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp, self.state_file)
+
+    def digest(self, inputs, upstream_outputs, params):
+        """Return the digest of the content of inputs, the signature of the upstream outputs and params"""
+        sha = hashlib.sha256()
+        for filename in sorted(inputs):
+            sha.update(f"{os.path.abspath(filename)}:{file_hash(filename)}\n".encode())
+        sha.update(json.dumps(stat_signature(upstream_outputs)).encode())
+        sha.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return sha.hexdigest()
+
+    def is_up_to_date(self, stage, digest):
+        """Return True if stage succeeded with the same digest and its outputs did not change since then"""
+        record = self.load().get(stage)
+        if record is None or record['digest'] != digest or not record['outputs']:
+            return False
+        outputs = [output[0] for output in record['outputs']]
+        if not all(os.path.exists(output) for output in outputs):
+            return False
+        return stat_signature(outputs) == record['outputs']
+
+    def start(self, stage):
+        """Forget stage, so it is run again if it does not complete"""
+        with _lock:
+            state = self.load()
+            if state.pop(stage, None) is not None:
+                self.save(state)
+
+    def done(self, stage, digest, outputs):
+        """Record that stage succeeded with digest and wrote outputs"""
+        with _lock:
+            state = self.load()
+            state[stage] = {'digest': digest, 'outputs': stat_signature(outputs)}
+            self.save(state)
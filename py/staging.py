@@ -0,0 +1,73 @@
+"""
+Functions to put the BingClaw input files in the scenario output directories without copying them
+
+The bathymetry used by BingClaw is the same for all scenarios of an ensemble, so instead of
+copying it in every scenario directory it can be:
+ - 'hardlink': hard linked (default); falls back to a copy if source and destination are on different filesystems
+ - 'symlink':  symbolically linked; only works if the input directory is visible in the container at the same path
+ - 'bind':     not staged at all; the BingClaw input directory is mounted read-only in the container (see run_bingclaw)
+ - 'copy':     copied (as before)
+
+SharedInputs keeps the checksum of every shared input, computed once per ensemble (i.e. per
+SharedInputs object) instead of once per scenario, and warns if a shared input changes while
+the ensemble is running.
+"""
+
+import os
+import errno
+import shutil
+import threading
+
+from py.intmod_cache import file_hash
+
+STAGING_MODES = ('hardlink', 'symlink', 'bind', 'copy')
+INPUTS_DIR = '/BingClaw/inputs'   # Where the BingClaw input directory is mounted when staging is 'bind'
+
+
+def stage_file(source, destination, mode='hardlink'):
+    """Put source at destination with the given staging mode; return the mode actually used"""
+    if mode not in STAGING_MODES:
+        raise ValueError(f"{mode} is not a valid staging mode. Options are {', '.join(STAGING_MODES)}")
+    if os.path.lexists(destination):
+        if os.path.exists(destination) and os.path.samefile(source, destination):
+            return mode
+        os.remove(destination)
+
+    if mode == 'hardlink':
+        try:
+            os.link(source, destination)
+            return mode
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+    elif mode == 'symlink':
+        os.symlink(os.path.abspath(source), destination)
+        return mode
+    shutil.copy(source, destination)
+    return 'copy'
+
+
+class SharedInputs:
+    """Inputs shared by all scenarios of an ensemble, verified by checksum once"""
+
+    def __init__(self, mode='hardlink'):
+        self.mode = mode
+        self.checksums = {}
+        self.lock = threading.Lock()
+
+    def verify(self, source):
+        """Return the checksum of source, computed the first time; warn if the file changed since then"""
+        source = os.path.abspath(source)
+        with self.lock:
+            checksum = file_hash(source)   # Only recomputed if size or modification time changed
+            if source not in self.checksums:
+                self.checksums[source] = checksum
+            elif self.checksums[source] != checksum:
+                print(f"WARNING: shared input {source} changed while the ensemble was running")
+                self.checksums[source] = checksum
+            return checksum
+
+    def stage(self, source, destination):
+        """Verify source and put it at destination"""
+        self.verify(source)
+        return stage_file(source, destination, self.mode)
@@ -0,0 +1,123 @@
+"""
+Script to convert BingClaw frames to HySEA inputs while BingClaw is still running
+
+Instead of waiting for the end of the BingClaw simulation, stream_interface_module watches
+bingclaw_output_dir and, as soon as a frame is complete, interpolates it on the target grid
+(as engine 'native' of run_interface_module does, see py/intmod_native.py) and appends it to
+the deformation file along its unlimited time dimension. Frame N is complete when frame N+1
+has started (its fort.q file exists) or when the simulation has ended.
+When BingClaw ends, only the last frame is left to convert.
+With frame_tolerance, a frame is converted only if the landslide thickness changed by more than
+frame_tolerance since the last frame converted (as in py/frame_selection.py, which only needs
+the frames before it); without stop_when_stationary the last frame is converted in any case.
+
+Input needed:
+ - process               # Running BingClaw simulation (returned by run_bingclaw with wait=False); it is stopped if the conversion fails
+ - bingclaw_output_dir   # Bingclaw scenario output directory
+ - intmod_output_dir     # Output directory
+ - bathymetry            # Bathymetry file (where results of BingClaw are interpolated on)
+ - resolution            # Resolution of the target grid (m)
+ - filter_type           # Filter for deformation data (only 'none')
+ - casename              # String used to name output files (including directory where files are saved)
+ - skip_frames           # Number of leading timesteps to drop from the deformation output (see run_interface_module.py)
+ - weights_cache_dir     # Directory where interpolation operators are saved and reused
+ - storage               # Storage of the deformation (see py/deformation_storage.py; default None: uncompressed 'f8')
+ - poll_interval         # Time between checks for new frames (s)
+ - frame_tolerance       # Change of landslide thickness (m) above which a frame is converted (default None: all frames)
+ - stop_when_stationary  # With frame_tolerance, end the deformation series at the last frame converted (default True)
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+from py.bingclaw_frames import list_frames, frame_file, read_frame, read_frame_time, read_frame_grid, grid_centres
+from py.interp_weights import load_or_build_weights, interpolate
+from py.intmod_native import target_grid, write_bathymetry, create_deformation_file, append_deformation
+from py.instrument import measure, current_record
+
+
+def stream_interface_module(process, bingclaw_output_dir, intmod_output_dir, bathymetry, resolution, filter_type, casename,
+                            skip_frames=0, weights_cache_dir=None, poll_interval=2.0, thickness_component=0, storage=None,
+                            frame_tolerance=None, stop_when_stationary=True):
+    print("* Executing stream_interface_module")
+    try:
+        return _stream_interface_module(process, bingclaw_output_dir, intmod_output_dir, bathymetry, resolution, filter_type, casename,
+                                        skip_frames, weights_cache_dir, poll_interval, thickness_component, storage,
+                                        frame_tolerance, stop_when_stationary)
+    except BaseException:
+        # Do not leave BingClaw running if the conversion fails
+        process.cancel()
+        raise
+
+
+def _stream_interface_module(process, bingclaw_output_dir, intmod_output_dir, bathymetry, resolution, filter_type, casename,
+                             skip_frames, weights_cache_dir, poll_interval, thickness_component, storage,
+                             frame_tolerance, stop_when_stationary):
+    if filter_type != 'none':
+        sys.exit(f"Filter '{filter_type}' is not available when streaming BingClaw frames. Use filter_type 'none'")
+    os.makedirs(intmod_output_dir, exist_ok=True)
+
+    with measure('target_grid'):
+        lon, lat, z = target_grid(bathymetry, resolution, weights_cache_dir)
+        write_bathymetry(casename + '_bathymetry.nc', lon, lat, z)
+
+    times = []          # Times of the frames converted so far
+    reference = None    # Landslide thickness of the first frame
+    weights = None
+    next_frame = 0
+    last_kept = None    # Thickness of the last frame converted (with frame_tolerance)
+    pending = None      # Thickness and time of the last frame not converted
+    written = 0
+    with create_deformation_file(casename + '_deformation.nc', lon, lat, storage) as ds:
+
+        def convert(thickness, frame_time):
+            with measure('interpolate'):
+                deformation = interpolate(weights, (thickness - reference)[None], (len(lat), len(lon)))
+            with measure('write'):
+                append_deformation(ds, [frame_time], deformation)
+                ds.sync()
+
+        while True:
+            finished = process.poll() is not None
+            frames = [f for f in list_frames(bingclaw_output_dir) if f >= next_frame]
+            for frame in frames:
+                if not finished and not os.path.exists(frame_file(bingclaw_output_dir, 'q', frame + 1)):
+                    break
+                with measure('load'):
+                    thickness = read_frame(bingclaw_output_dir, frame)[thickness_component]
+                    times.append(read_frame_time(bingclaw_output_dir, frame)['time'])
+                if reference is None:
+                    reference = thickness.copy()
+                    x_source, y_source = grid_centres(read_frame_grid(bingclaw_output_dir, frame))
+                    weights, _ = load_or_build_weights(x_source, y_source, lon, lat, weights_cache_dir)
+
+                # Drop leading frames, keeping the times of the first frames (as remove_first_timestep does)
+                # (with frame_tolerance, frames close to the last frame converted are only kept as pending)
+                position = len(times) - 1
+                next_frame = frame + 1
+                if position >= skip_frames:
+                    frame_time = times[position - skip_frames]
+                    if frame_tolerance is not None and position > skip_frames \
+                            and np.abs(thickness - last_kept).max() <= frame_tolerance:
+                        pending = (np.array(thickness), frame_time)
+                        print(f"Skipped BingClaw frame {frame}")
+                        continue
+                    convert(thickness, frame_time)
+                    written += 1
+                    pending = None
+                    if frame_tolerance is not None:
+                        last_kept = np.array(thickness)
+                print(f"Converted BingClaw frame {frame}")
+            if finished:
+                break
+            time.sleep(poll_interval)
+        if pending is not None and not stop_when_stationary:
+            convert(*pending)
+            written += 1
+
+    exit_code = process.returncode
+    current_record()['exit_code'] = exit_code
+    print(f"* BingClaw exited with code {exit_code}; {written} frames written to {casename}_deformation.nc")
+    return exit_code
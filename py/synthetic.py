@@ -0,0 +1,135 @@
+"""
+Functions to create synthetic BingClaw outputs and bathymetries, used by the benchmarks (see py/benchmark.py)
+
+ - write_frames: BingClaw frames (fort.q/fort.t, plus fort.b if binary) of a landslide moving
+   across a single grid of mx x my cells, in the same format as BingClaw output
+ - write_resting_frames: frames of a landslide that comes to rest: the frames of write_frames followed
+   by nrest frames (fort.t written, data linked) equal to the last one
+ - write_bathymetry: NetCDF bathymetry (lon, lat, z) of nx x ny cells covering the BingClaw grid,
+   with the spacing of the target grid at resolution, so the Interface Module does not regrid it
+ - write_pois: POI file (as Messina_pois.dat) with npois points spread over the grid
+ - write_hysea_output: T-HySEA output grid (lon, lat, time, eta, max_height) of a wave crossing the grid
+
+Input needed:
+ - directory        # Directory where the frames are written
+ - mx, my           # Number of cells of the BingClaw grid in x and y
+ - nframes          # Number of frames
+ - nrest            # Number of frames at rest added after the last frame
+ - output_format    # 'ascii' or 'binary'
+ - resolution       # Resolution of the target grid (m)
+ - ntimes           # Number of timesteps of the T-HySEA output
+"""
+
+import os
+import numpy as np
+from netCDF4 import Dataset
+
+from py.intmod_native import METRES_PER_DEGREE
+
+XLOW, YLOW = 15.4, 37.8     # Lower left corner of the synthetic grids (degrees)
+DT = 10.0                   # Time between frames (s)
+NUM_GHOST = 2
+
+
+def grid_extent(mx, my, resolution):
+    """Return xlow, ylow, dx, dy of a BingClaw grid of mx x my cells with spacing resolution (m)"""
+    dy = resolution / METRES_PER_DEGREE
+    dx = resolution / (METRES_PER_DEGREE * np.cos(np.radians(YLOW + my * dy / 2)))
+    return XLOW, YLOW, dx, dy
+
+
+def landslide(mx, my, frame, nframes, meqn=6):
+    """Return the solution q (meqn, my, mx) of a synthetic frame: a Gaussian slide moving in x"""
+    x = (np.arange(mx) + 0.5) / mx
+    y = (np.arange(my) + 0.5) / my
+    centre = 0.2 + 0.6 * frame / max(nframes - 1, 1)
+    q = np.zeros((meqn, my, mx))
+    q[0] = 10.0 * np.exp(-((x[np.newaxis, :] - centre)**2 + (y[:, np.newaxis] - 0.5)**2) / 0.01)
+    for m in range(1, meqn):
+        q[m] = q[0] * (0.5 / m)
+    return q
+
+
+def write_frames(directory, mx, my, nframes, resolution, output_format='ascii', meqn=6):
+    """Write nframes synthetic BingClaw frames of mx x my cells in directory"""
+    os.makedirs(directory, exist_ok=True)
+    xlow, ylow, dx, dy = grid_extent(mx, my, resolution)
+    header = (f"{1:18d}    grid_number\n{1:18d}    AMR_level\n{mx:18d}    mx\n{my:18d}    my\n"
+              f"{xlow:18.8e}    xlow\n{ylow:18.8e}    ylow\n{dx:18.8e}    dx\n{dy:18.8e}    dy\n")
+    for frame in range(nframes):
+        q = landslide(mx, my, frame, nframes, meqn)
+        with open(os.path.join(directory, f"fort.t{frame:04d}"), 'w') as f:
+            f.write(f"{frame * DT:18.8e}    time\n{meqn:18d}    num_eqn\n{1:18d}    nstates\n"
+                    f"{0:18d}    num_aux\n{2:18d}    num_dim\n{NUM_GHOST:18d}    num_ghost\n")
+        with open(os.path.join(directory, f"fort.q{frame:04d}"), 'w') as f:
+            f.write(header)
+            if output_format == 'ascii':
+                np.savetxt(f, q.transpose(1, 2, 0).reshape(-1, meqn), fmt='%26.16e')
+        if output_format == 'binary':
+            # Fortran-ordered (meqn, mx + 2*num_ghost, my + 2*num_ghost), ghost cells included
+            full = np.zeros((meqn, mx + 2 * NUM_GHOST, my + 2 * NUM_GHOST))
+            full[:, NUM_GHOST:NUM_GHOST + mx, NUM_GHOST:NUM_GHOST + my] = q.transpose(0, 2, 1)
+            full.ravel(order='F').astype('<f8').tofile(os.path.join(directory, f"fort.b{frame:04d}"))
+
+
+def write_resting_frames(directory, frames_dir, nframes, nrest):
+    """Write in directory the nframes frames of frames_dir followed by nrest copies of the last one (data files are linked)"""
+    os.makedirs(directory, exist_ok=True)
+    source_dir = os.path.abspath(frames_dir)
+    with open(os.path.join(source_dir, f"fort.t{nframes - 1:04d}")) as f:
+        time_file = f.read().split('\n', 1)[1]
+    for frame in range(nframes + nrest):
+        source = min(frame, nframes - 1)
+        for kind in ('q', 'b'):
+            if os.path.exists(os.path.join(source_dir, f"fort.{kind}{source:04d}")):
+                os.symlink(os.path.join(source_dir, f"fort.{kind}{source:04d}"), os.path.join(directory, f"fort.{kind}{frame:04d}"))
+        with open(os.path.join(directory, f"fort.t{frame:04d}"), 'w') as f:
+            f.write(f"{frame * DT:18.8e}    time\n{time_file}")
+
+
+def write_bathymetry(filename, mx, my, resolution):
+    """Write a synthetic bathymetry covering the BingClaw grid of mx x my cells, with spacing resolution (m)"""
+    xlow, ylow, dx, dy = grid_extent(mx, my, resolution)
+    lon = xlow + (np.arange(mx) + 0.5) * dx
+    lat = ylow + (np.arange(my) + 0.5) * dy
+    with Dataset(filename, 'w', format='NETCDF4') as ds:
+        ds.createDimension('lon', mx)
+        ds.createDimension('lat', my)
+        ds.createVariable('lon', 'f8', ('lon',))[:] = lon
+        ds.createVariable('lat', 'f8', ('lat',))[:] = lat
+        z = -1000.0 - 500.0 * (lon[np.newaxis, :] - lon[0]) / (lon[-1] - lon[0] + dx)
+        ds.createVariable('z', 'f4', ('lat', 'lon'))[:] = np.repeat(z, my, axis=0)
+
+
+def write_pois(filename, mx, my, resolution, npois=98, seed=0):
+    """Write a POI file with npois points spread over the grid of mx x my cells"""
+    xlow, ylow, dx, dy = grid_extent(mx, my, resolution)
+    rng = np.random.default_rng(seed)
+    lon = xlow + rng.uniform(0.05, 0.95, npois) * mx * dx
+    lat = ylow + rng.uniform(0.05, 0.95, npois) * my * dy
+    with open(filename, 'w') as f:
+        f.write(f"{npois}\n")
+        for x, y in zip(lon, lat):
+            f.write(f"{x:.6f} {y:.6f}\n")
+
+
+def write_hysea_output(filename, mx, my, ntimes, resolution):
+    """Write a synthetic T-HySEA output grid of mx x my cells with ntimes timesteps; the first column is land"""
+    xlow, ylow, dx, dy = grid_extent(mx, my, resolution)
+    lon = xlow + (np.arange(mx) + 0.5) * dx
+    lat = ylow + (np.arange(my) + 0.5) * dy
+    x = np.arange(mx) / mx
+    with Dataset(filename, 'w', format='NETCDF4') as ds:
+        ds.createDimension('lon', mx)
+        ds.createDimension('lat', my)
+        ds.createDimension('time', None)
+        ds.createVariable('lon', 'f8', ('lon',))[:] = lon
+        ds.createVariable('lat', 'f8', ('lat',))[:] = lat
+        ds.createVariable('time', 'f4', ('time',))[:] = np.arange(ntimes) * DT
+        eta = ds.createVariable('eta', 'f4', ('time', 'lat', 'lon'), fill_value=np.float32(-9999), chunksizes=(1, my, mx))
+        for t in range(ntimes):
+            wave = np.sin(2 * np.pi * (x - t / max(ntimes, 1))) * np.exp(-t / max(ntimes, 1))
+            frame = np.ma.masked_array(np.repeat(wave[np.newaxis, :], my, axis=0), mask=np.zeros((my, mx), bool))
+            frame.mask[:, 0] = True
+            eta[t] = frame
+        ds.createVariable('max_height', 'f4', ('lat', 'lon'))[:] = np.ones((my, mx))
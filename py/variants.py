@@ -0,0 +1,91 @@
+"""
+Functions to convert the output of one BingClaw run with several Interface Module configurations
+(variants) and to run T-HySEA on each of them (sweep mode of run_workflow.py)
+
+A variant is a (resolution, filter_type) pair, or a dict with keys resolution, filter_type and
+optionally filename_prefix (default 'filter<filter_type>_res<resolution>', as filename_prefix in
+run_workflow.py). The outputs of a variant are named by its filename_prefix, in the intmod_out,
+hysea_out and post_out directories shared by all variants. The outputs of a prefix are found by
+name, <filename_prefix>_<kind>.nc (see py/run_hysea.py and py/remove_first_timestep.py), so
+prefixes only need to be different.
+ - load_frames reads the BingClaw frames once: the landslide thickness and times are read-only
+   arrays shared by all variants (engine 'native' converts them, engine 'intmod' selects frames
+   on them; see run_interface_module)
+ - run_variants calls run(variant, frames) for every variant on workers threads. NetCDF files
+   are opened by one thread at a time (netcdf_lock in py/intmod_native.py), the interpolation and
+   the filter of the variants run in parallel
+
+Input needed:
+ - variants             # List of (resolution, filter_type) pairs or dicts (resolution, filter_type, filename_prefix)
+ - bingclaw_output_dir  # Bingclaw scenario output directory
+ - workers              # Number of variants run at the same time
+"""
+
+import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from py.bingclaw_frames import list_frames
+from py.intmod_native import read_thickness
+from py.instrument import measure
+
+
+def variant_prefix(resolution, filter_type):
+    """Return the default filename_prefix of a variant (named as filename_prefix in run_workflow.py)"""
+    return 'filter' + filter_type + '_res' + str(resolution)
+
+
+def expand_variants(variants):
+    """Return variants as dicts with resolution, filter_type and filename_prefix, checking that their outputs do not clash"""
+    expanded = []
+    for variant in variants:
+        if not isinstance(variant, dict):
+            resolution, filter_type = variant
+            variant = {'resolution': resolution, 'filter_type': filter_type}
+        missing = [key for key in ('resolution', 'filter_type') if key not in variant]
+        if missing:
+            sys.exit(f"Variant {variant} has no {' and '.join(missing)}")
+        variant = dict(variant)
+        variant.setdefault('filename_prefix', variant_prefix(variant['resolution'], variant['filter_type']))
+        expanded.append(variant)
+
+    prefixes = [variant['filename_prefix'] for variant in expanded]
+    for prefix in set(prefixes):
+        if prefixes.count(prefix) > 1:
+            sys.exit(f"Variants must have different prefixes: '{prefix}' is used by {prefixes.count(prefix)} variants")
+    return expanded
+
+
+def load_frames(bingclaw_output_dir, thickness_component=0):
+    """Read the BingClaw frames once and return them as a dict (bingclaw_output_dir, thickness_component, frames,
+    thickness, times) of read-only values, shared by the variants"""
+    frames = list_frames(bingclaw_output_dir)
+    if len(frames) == 0:
+        sys.exit(f"No BingClaw frame found in {bingclaw_output_dir}")
+    with measure('load'):
+        thickness, times = read_thickness(bingclaw_output_dir, frames, thickness_component)
+    thickness.flags.writeable = False
+    times.flags.writeable = False
+    return {'bingclaw_output_dir': os.path.abspath(bingclaw_output_dir), 'thickness_component': thickness_component,
+            'frames': tuple(frames), 'thickness': thickness, 'times': times}
+
+
+def _run_variant(run, variant, frames):
+    # Turn a non-zero exit code or any error (including sys.exit calls) into a failure message,
+    # so that it does not stop the other variants
+    try:
+        exit_code = run(variant, frames)
+    except BaseException as err:
+        traceback.print_exc()
+        return f"{type(err).__name__}: {err}"
+    if exit_code != 0:
+        return f"exited with code {exit_code}"
+    return None
+
+
+def run_variants(variants, run, workers=1, frames=None):
+    """Call run(variant, frames) for every variant on workers threads and return {filename_prefix: failure message or None}"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {variant['filename_prefix']: pool.submit(_run_variant, run, variant, frames) for variant in variants}
+    return {prefix: future.result() for prefix, future in futures.items()}
@@ -0,0 +1,25 @@
+"""
+Script to benchmark the CPU stages of the workflow (BingClaw input rendering, Interface Module
+with engine 'native', remove_first_timestep, T-HySEA input rendering, POI time series) on synthetic data.
+BingClaw and T-HySEA are replaced by fakes, so neither the BingClaw image nor a GPU are needed.
+See py/benchmark.py for the list of benchmarks.
+
+Results are saved in bench_dir as results_<revision>_<date>.json. To compare two results files:
+    python -m py.benchmark <old results.json> <new results.json>
+"""
+
+from py.benchmark import run_benchmarks, compare_results
+
+# ============  INPUT PARAMETERS  ============
+sizes = [1e4, 1e5, 1e6]         # ***Number of cells of the grids (up to 1e7; large ASCII frames take long to create)
+nframes = 10                    # Number of BingClaw frames
+output_format = 'binary'        # Format of the synthetic BingClaw frames: 'ascii' or 'binary'
+resolution = 100                # Resolution of the grids (m)
+repeat = 3                      # Number of times each benchmark is run (the fastest run is reported)
+bench_dir = 'benchmarks'        # Directory where synthetic data, fakes and results are written
+compare_with = None             # Results file of a previous revision to compare with (None: no comparison)
+
+# ============  RUN BENCHMARKS  ============
+results_file = run_benchmarks(sizes, nframes, output_format, resolution, repeat, bench_dir)
+if compare_with is not None:
+    compare_results(compare_with, results_file)
@@ -0,0 +1,111 @@
+"""
+Script to launch the workflow for an ensemble of scenarios. For each scenario
+(one .tt3 file with the initial conditions for BingClaw) it follows the same steps as run_workflow.py:
+    - run BingClaw simulation
+    - run interface module (takes output from BingClaw simulation and creates inputs for HySEA)
+    - remove first time step of the interface module (ground deformation) output
+    - run T-HySEA simulation
+Scenarios run concurrently: BingClaw/Interface Module on cpu_workers, T-HySEA on gpu_workers.
+Each scenario has its own output directory outputs/<scenario>.
+
+For the structure of the input/output directories see README file of the this repo.
+"""
+
+import os
+
+from py.run_ensemble import run_ensemble, run_hazard, hysea_succeeded, find_scenarios
+from py.scheduler import submit_ensemble, SlurmScheduler, LocalScheduler
+from py.instrument import write_rollup
+
+# ============  INPUT PARAMETERS  ============
+# Set folder and file names
+# Parameters marked with *** in the comment are the bare minimum for the
+# user to check and change
+input_dir  = 'inputs'        # Parent directory with input files for BingClaw and T-HySEA
+output_dir = 'outputs'       # Parent directory where scenario output folders will be created
+bingclaw_input_dir = os.path.join(input_dir, 'bingclaw_inputs')     # Directory with BingClaw input files
+hysea_input_dir = os.path.join(input_dir, 'hysea_inputs')           # Directory with HySEA useful files
+scenarios = bingclaw_input_dir  # ***Directory with mscen_*.tt3 files, or glob pattern (e.g. 'inputs/bingclaw_inputs/mscen_v0.1*.tt3')
+cpu_workers = 4                 # ***Number of scenarios running BingClaw/Interface Module at the same time
+gpu_workers = 1                 # ***Number of scenarios (or T-HySEA batches) running T-HySEA at the same time
+backend = 'threads'             # ***How scenarios are run: 'threads' (on this machine), 'slurm' (one SLURM job array per stage) or 'local' (job arrays run on this machine)
+job_dir = os.path.join(output_dir, 'jobs')  # Directory with batch scripts and logs of the job arrays (backends 'slurm' and 'local')
+sbatch_options = {                          # #SBATCH options of the CPU and GPU job arrays (backend 'slurm')
+    'cpu': ['--time=04:00:00', '--cpus-per-task=1'],
+    'gpu': ['--time=04:00:00', '--gres=gpu:1'],
+}
+
+filter_type = 'kajiura/none'    # ***Filter for deformation data (kajiura / none)
+resolution = XXX                # ***Resolution (m)
+
+params = {
+    'output_dir': output_dir,
+    'resume': True,                         # Skip the stages of a scenario whose outputs are up to date (same inputs and parameters), e.g. to resume after a crash (True/False)
+    'profile': None,                        # Profile the stages: None, 'cprofile' (outputs/<scenario>/profiles/<stage>.prof) or 'py-spy' (needs py-spy installed)
+    'sweep_file': None,                     # CSV file with numeric parameters of BingClaw and T-HySEA per scenario (e.g. bingclaw.tfinal, hysea.manning; see py/render.py), or None
+    # For BingClaw
+    'do_run_bingclaw': True,                # Run BingClaw simulations (True/False)
+    'bingclaw_input_dir': bingclaw_input_dir,
+    'bingclaw_bathymetry': 'bathymetry.tt3',# ***Bathymetry file used in BingClaw simulations
+    'image_type': 'docker/singularity',     # ***Type of image (docker/singularity)
+    'image_name': 'image_name',             # ***Name of BingClaw docker image
+    'bingclaw_output_format': 'ascii',      # Format of BingClaw output frames: 'ascii' or 'binary' (smaller and faster, only with intmod_engine 'native')
+    'persistent_containers': True,          # Start one BingClaw container per CPU worker and reuse it for all scenarios (True/False)
+    'staging': 'hardlink',                  # How the BingClaw bathymetry is put in scenario directories: 'hardlink', 'symlink', 'bind' (read-only mount) or 'copy'
+    'bingclaw_timeout': None,               # Time (s) after which a BingClaw simulation is stopped and its scenario fails (None: no limit); output in outputs/<scenario>/logs
+    # For Interface Module
+    'do_run_interface_module': True,        # Run Interface Module (True/False)
+    'donor': 'bingclaw',
+    'hysea_input_dir': hysea_input_dir,
+    'bathy_file': 'bathymetry.nc',          # ***Bathymetry file for interface module (where results of BingClaw are interpolated on)
+    'resolution': resolution,
+    'filter_type': filter_type,
+    'filename_prefix': 'filter' + filter_type + '_res' + str(resolution),  # Prefix used by Interface Module to name output files
+    'skip_first_frame_in_intmod': False,    # Drop first timestep of the deformation while running the Interface Module (True; see py/run_interface_module.py) or rewrite the file afterwards with remove_first_timestep (False)
+    'intmod_mode': 'pool',                  # How the Interface Module runs: 'subprocess' (new python for each scenario) or 'pool' (persistent workers with imports done once)
+    'intmod_timeout': None,                 # Time (s) after which the Interface Module is stopped, with intmod_mode 'subprocess' (None: no limit)
+    'intmod_engine': 'intmod',              # Code converting BingClaw outputs: 'intmod' (Interface Module) or 'native' (experimental workflow implementation reusing interpolation weights; filter_type 'none' or 'kajiura')
+    'weights_cache_dir': os.path.join(output_dir, 'weights_cache'),  # Directory where interpolation weights of engine 'native' are saved and reused
+    'kajiura_method': 'fft',                # Kajiura filter of engine 'native': 'fft' (fast, cached per grid) or 'direct' (reference, slow)
+    'deformation_complevel': 0,             # zlib compression level of the deformation file read by T-HySEA (0: none, 1-9)
+    'deformation_dtype': 'f8',              # Data type of the deformation: 'f8' (bit-identical) or 'f4' (half the size)
+    'deformation_digits': None,             # Decimal digits of the deformation kept (e.g. 4: 0.1 mm), to compress better (None: all)
+    'frame_tolerance': None,                # Convert only BingClaw frames whose landslide thickness changed by more than this (m) since the last one converted (None: all frames)
+    'stop_when_stationary': True,           # With frame_tolerance, end the deformation series once the landslide is at rest
+    'crop_threshold': None,                 # Crop the deformation to where it exceeds this (m) in some frame, plus crop_halo (None: whole grid)
+    'crop_halo': 5000.0,                    # Distance (m) kept around the cropped region; a few times the water depth with filter_type 'kajiura'
+    'stream_intmod': False,                 # Convert BingClaw frames while BingClaw is running (only with intmod_engine 'native' and filter_type 'none')
+    'intmod_cache_dir': os.path.join(output_dir, 'intmod_cache'),  # Directory where Interface Module outputs are cached and reused (None: no cache)
+    'intmod_cache_size_gb': 50,             # Maximum size of the Interface Module cache (GB); least recently used outputs are removed
+    # For T-HySEA
+    'do_run_hysea': True,                   # Run T-HySEA (True/False)
+    'hysea_executable': '/FULL_PATH_TO/T-HySEA_executable',  # ***Full path of location of T-HySEA executable
+    'output_time_series': True,             # ***Output time series. If true, template hysea_input_ts.template is used; if False, hysea_input.template
+    'pois_file': 'filename',                # ***Name of file with list of POIs for storing time series (relevant if output_time_series is True)
+    'hysea_batch': True,                    # Run the scenarios ready at the same time in one T-HySEA launch, with batch size chosen from free GPU memory (True/False)
+    'hysea_max_batch_size': 8,              # Maximum number of scenarios in a T-HySEA batch
+    'hysea_ranks': 1,                       # Number of GPUs (MPI ranks) of each T-HySEA run, or 'auto' to choose it from the grid size and the visible GPUs
+    'hysea_timeout': None,                  # Time (s) after which a T-HySEA run (or batch) is stopped (None: no limit)
+    # For post-processing
+    'extract_pois': True,                   # Extract the time series at the POIs of pois_file from the T-HySEA output grid, in outputs/<scenario>/post_out (True/False)
+    'poi_variables': ['eta'],               # Variables of the T-HySEA output extracted at the POIs
+    'aggregate_hazard': True,               # Aggregate the T-HySEA outputs of all scenarios into hazard maps, outputs/hazard.nc (True/False)
+    'hazard_thresholds': [0.1, 0.5, 1.0, 2.0],  # Wave amplitudes (m) of the exceedance probabilities in the hazard maps
+    'arrival_threshold': 0.05,              # Amplitude |eta| (m) defining the arrival time of the wave
+}
+
+# ============  RUN WORKFLOW  ============
+print(f"\n* Running workflow bingclaw-to-hysea for the scenarios in '{scenarios}' with filter '{filter_type}' and resolution {resolution} m")
+if backend == 'threads':
+    run_ensemble(scenarios, params, cpu_workers, gpu_workers)
+elif backend == 'slurm':
+    submit_ensemble(scenarios, params, SlurmScheduler(job_dir, sbatch_options))
+elif backend == 'local':
+    scheduler = LocalScheduler(job_dir, cpu_workers, gpu_workers)
+    submit_ensemble(scenarios, params, scheduler)
+    scheduler.wait()
+    if params['aggregate_hazard']:
+        run_hazard(hysea_succeeded(find_scenarios(scenarios), params), params, cpu_workers)
+    print(f"Performance of the stages written to {write_rollup(output_dir)}")
+else:
+    print(f"{backend} is not a valid backend. Options are 'threads', 'slurm' or 'local'")
@@ -1,27 +1,39 @@
 #!/bin/bash
 
-# Find the directory containing setrun.py
-setrun_dir=$(find / -type f -name "setrun.py" -exec dirname {} \; -quit)
+# Usage: run_simulation.sh [run_dir]
+# run_dir is the directory containing setrun.py (default: $BINGCLAW_RUN_DIR, or /BingClaw/run where
+# run_bingclaw mounts the scenario output directory).
+# The BingClaw executable is $BINGCLAW_EXE; only if this is not set, it is searched in the container.
 
-if [ -z "$setrun_dir" ]; then
-    echo "setrun.py not found"
+setrun_dir=${1:-${BINGCLAW_RUN_DIR:-/BingClaw/run}}
+
+if [ ! -f "$setrun_dir/setrun.py" ]; then
+    echo "setrun.py not found in $setrun_dir"
     exit 1
 fi
 
 echo "Mouted input directory $setrun_dir"
 
 
-# Find relative path between the setrun_dir and the directory with the BingClaw executable
-bingclaw_dir=$(find / -type f -name "BingClaw5.6.1" -exec dirname {} \; -quit)
-common_dir=$(realpath --relative-to="$setrun_dir" "$bingclaw_dir")
+# Find the BingClaw executable, if not given (-xdev: do not search in the mounted directories)
+if [ -z "$BINGCLAW_EXE" ]; then
+    BINGCLAW_EXE=$(find / -xdev -type f -name "BingClaw5.6.1" -print -quit 2>/dev/null)
+fi
+
+if [ -z "$BINGCLAW_EXE" ]; then
+    echo "BingClaw5.6.1 not found"
+    exit 1
+fi
 
-echo "Relative directory between BingClaw and mounted input folder $common_dir"
+echo "BingClaw executable $BINGCLAW_EXE"
 cd $setrun_dir
 
 # Prepare parameters
-python setrun.py 
+python setrun.py
 
-# Run BingClaw in right relative path, save logs
+# Run BingClaw, save logs
 echo "Running simulation"
-./$common_dir/BingClaw5.6.1 >> run_log 2>&1
-echo "Log is saved in the file run_log"
\ No newline at end of file
+$BINGCLAW_EXE >> run_log 2>&1
+exit_code=$?
+echo "Log is saved in the file run_log"
+exit $exit_code
@@ -5,6 +5,10 @@ Script to launch the workflow following the steps:
     - run interface module (takes output from BingClaw simulation and creates inputs for HySEA)
     - remove first time step of the interface module (ground deformation) output
     - run T-HySEA simulation
+The workflow stops at the first stage that fails (non-zero exit code or timeout); the output of
+BingClaw, the Interface Module and T-HySEA is written to <scenario_dir>/logs (see py/processes.py).
+With variants (sweep mode), the BingClaw output is converted by the Interface Module with every
+variant (resolution, filter_type) at the same time, then T-HySEA runs for every variant.
 
 For the structure of the input/output directories see README file of the this repo.
 
@@ -17,7 +21,13 @@ import sys
 from py.run_interface_module import run_interface_module
 from py.run_bingclaw import run_bingclaw
 from py.run_hysea import run_hysea
-from py.remove_first_timestep import remove_first_timestep
+from py.poi_series import extract_pois
+from py.remove_first_timestep import remove_first_timestep, crop_deformation
+from py.intmod_cache import IntmodCache
+from py.stream_intmod import stream_interface_module
+from py.deformation_storage import deformation_storage
+from py.variants import expand_variants, load_frames, run_variants
+from py.processes import failure_message
 
 # ============  INPUT PARAMETERS  ============
 # Set folder and file names
@@ -31,6 +41,7 @@ scenario_dir = os.path.join(output_dir, scenario)                 # Scenario out
 bingclaw_output_dir = os.path.join(scenario_dir, 'bingclaw_out')  # Directory where BingClaw outputs will be saved
 intmod_output_dir = os.path.join(scenario_dir, 'intmod_out')      # Directory where Interface Module outputs will be saved
 hysea_output_dir = os.path.join(scenario_dir, 'hysea_out')        # Directory where T-HySEA outputs will be saved
+post_output_dir = os.path.join(scenario_dir, 'post_out')          # Directory where post-processed outputs (POI time series) will be saved
 
 # For BingClaw 
 # TODO: What else needs to be changed in the setup_run.py that is simulation-dependent? 
@@ -41,6 +52,9 @@ bingclaw_bathymetry = 'localMessinaBathy.tt3'                       # ***Bathyme
 bingclaw_scenario = scenario + '.tt3'                               # ***Name of .tt3 file describing initial conditions for BingClaw simulation
 image_type = 'singularity'              # ***Type of image (docker/singularity)
 image_name = 'bingclaw_latest.sif'      # ***Name of BingClaw docker image     #'ngiacr.azurecr.io/bingclaw:latest'  
+bingclaw_output_format = 'ascii'        # Format of BingClaw output frames: 'ascii' or 'binary' (smaller and faster, only with intmod_engine = 'native')
+staging = 'hardlink'                    # How the BingClaw bathymetry is put in the scenario directory: 'hardlink', 'symlink', 'bind' (read-only mount) or 'copy'
+bingclaw_timeout = None                 # Time (s) after which the BingClaw simulation is stopped (None: no limit); output in <scenario_dir>/logs/bingclaw.log
 
 # For Interface Module 
 do_run_interface_module = True                  # Run Interface Module (True/False)
@@ -50,6 +64,21 @@ resolution = 100                                # ***Resolution (m)
 filter_type = 'kajiura'                            # ***Filter for deformation data (kajiura / none)
 filename_prefix = 'filter' + filter_type + '_res' + str(resolution) # Prefix used by Interface Module to name output files
 casename = os.path.join(intmod_output_dir, filename_prefix)         # Add path of directory where output is saved to prefix string
+skip_first_frame_in_intmod = False     # Drop first timestep of the deformation while running the Interface Module (True; see py/run_interface_module.py) or rewrite the file afterwards with remove_first_timestep (False)
+intmod_mode = 'subprocess'              # How the Interface Module runs: 'subprocess' (new python process) or 'inprocess' (inside this python process)
+intmod_timeout = None                   # Time (s) after which the Interface Module is stopped, with intmod_mode = 'subprocess' (None: no limit)
+intmod_engine = 'intmod'                # Code converting BingClaw outputs: 'intmod' (Interface Module) or 'native' (experimental workflow implementation reusing interpolation weights; filter_type 'none' or 'kajiura')
+weights_cache_dir = os.path.join(output_dir, 'weights_cache')  # Directory where interpolation weights of engine 'native' are saved and reused
+kajiura_method = 'fft'                  # Kajiura filter of engine 'native': 'fft' (fast, cached per grid) or 'direct' (reference, slow)
+deformation_complevel = 0               # zlib compression level of the deformation file read by T-HySEA (0: none, 1-9)
+deformation_dtype = 'f8'                # Data type of the deformation: 'f8' (bit-identical) or 'f4' (half the size)
+deformation_digits = None               # Decimal digits of the deformation kept (e.g. 4: 0.1 mm), to compress better (None: all)
+frame_tolerance = None                  # Convert only BingClaw frames whose landslide thickness changed by more than this (m) since the last one converted (None: all frames)
+stop_when_stationary = True             # With frame_tolerance, end the deformation series once the landslide is at rest
+crop_threshold = None                   # Crop the deformation to where it exceeds this (m) in some frame, plus crop_halo (None: whole grid)
+crop_halo = 5000.0                      # Distance (m) kept around the cropped region; a few times the water depth with filter_type 'kajiura'
+stream_intmod = False                   # Convert BingClaw frames while BingClaw is running (only with intmod_engine = 'native', filter_type = 'none', do_run_bingclaw and do_run_interface_module)
+intmod_cache_dir = None                 # Directory where Interface Module outputs are cached and reused when nothing they depend on has changed (None: no cache)
 
 # For T-HySEA 
 do_run_hysea = True                 # Run T-HySEA (True/False)
@@ -58,6 +87,17 @@ hysea_executable = '/home/vmg/T-HySEA_4.0.0_MC/build/TsunamiHySEA'  # ***Full pa
 casename_from_intmod = filename_prefix
 output_time_series = True           # ***Output time series. If true, template hysea_input.template is used; if False, hysea_input_ts.template
 pois_file = 'Messina_pois.dat'      # ***Name of file with list of POIs for storing time series (relevant if output_time_series is True)
+hysea_ranks = 1                     # Number of GPUs (MPI ranks) used by T-HySEA, or 'auto' to choose it from the grid size and the visible GPUs
+hysea_timeout = None                # Time (s) after which T-HySEA is stopped (None: no limit); output in <scenario_dir>/logs/hysea_<prefix>.log
+
+# For post-processing
+do_extract_pois = True              # Extract the time series at the POIs of pois_file from the T-HySEA output grid (True/False)
+poi_variables = ['eta']             # Variables of the T-HySEA output extracted at the POIs
+
+# For sweep mode
+variants = None                     # Convert the BingClaw output with several resolutions/filters and run T-HySEA on each: list of (resolution, filter_type) pairs or dicts also with filename_prefix, e.g. [(100, 'kajiura'), (200, 'none')] (None: only resolution and filter_type above)
+cpu_workers = 4                     # Number of variants converted by the Interface Module at the same time
+gpu_workers = 1                     # Number of variants run by T-HySEA at the same time
 
 # ============  RUN WORKFLOW  ============ 
 print(f"\n* Running workflow bingclaw-to-hysea for scenario '{scenario}' with filter '{filter_type}' and resolution {resolution} m")
@@ -68,28 +108,129 @@ if not os.path.exists(scenario_dir):
 else:
     print(f"WARNING: The output folder {scenario_dir} already exists")
 
+# Storage of the deformation file read by T-HySEA (one time step per chunk)
+storage = deformation_storage(deformation_complevel, deformation_dtype, deformation_digits)
+
+# Sweep mode: outputs of every variant are named by its filename_prefix (see py/variants.py)
+sweep = variants is not None
+if (sweep):
+    variants = expand_variants(variants)
+    failed = {}
+    if stream_intmod:
+        print('WARNING: stream_intmod is not used with variants; the Interface Module runs after BingClaw')
+    if intmod_engine == 'intmod' and intmod_mode == 'inprocess':
+        print("WARNING: variants run at the same time, so the Interface Module runs with intmod_mode 'subprocess'")
+        intmod_mode = 'subprocess'
+
+
+def convert_variant(variant, frames):
+    exit_code = run_interface_module(bingclaw_output_dir, intmod_output_dir, hysea_input_dir, donor, bathy_file, variant['resolution'], variant['filter_type'],
+                                     os.path.join(intmod_output_dir, variant['filename_prefix']), skip_frames=1 if skip_first_frame_in_intmod else 0,
+                                     mode=intmod_mode, cache=intmod_cache, engine=intmod_engine, weights_cache_dir=weights_cache_dir,
+                                     kajiura_method=kajiura_method, storage=storage,
+                                     frame_tolerance=frame_tolerance, stop_when_stationary=stop_when_stationary,
+                                     crop_threshold=crop_threshold, crop_halo=crop_halo, shared_frames=frames,
+                                     timeout=intmod_timeout)
+    if exit_code == 0 and not skip_first_frame_in_intmod:
+        remove_first_timestep(intmod_output_dir, variant['filename_prefix'], storage=storage)
+    return exit_code
+
+
+def simulate_variant(variant, frames):
+    return run_hysea(hysea_input_dir, hysea_output_dir, intmod_output_dir, hysea_executable, output_time_series, pois_file, scenario, variant['filename_prefix'], ranks=hysea_ranks,
+                     timeout=hysea_timeout)
+
+
+# Run BingClaw and Interface Module at the same time, converting BingClaw frames as soon as they are written
+if stream_intmod and intmod_engine != 'native':
+    print("WARNING: stream_intmod is only available with intmod_engine = 'native'; the Interface Module runs after BingClaw")
+streamed = stream_intmod and intmod_engine == 'native' and do_run_bingclaw and do_run_interface_module and not sweep
+if streamed and filter_type != 'none':
+    sys.exit(f"Filter '{filter_type}' is not available with stream_intmod. Use filter_type 'none' or set stream_intmod to False")
+if streamed and intmod_cache_dir is not None:
+    print('WARNING: the Interface Module cache is not used with stream_intmod')
+if (streamed):
+    process = run_bingclaw(bingclaw_input_dir, bingclaw_output_dir, bingclaw_bathymetry, bingclaw_scenario, image_type, image_name, bingclaw_output_format, wait=False, staging=staging,
+                           timeout=bingclaw_timeout)
+    exit_code = stream_interface_module(process, bingclaw_output_dir, intmod_output_dir, os.path.join(hysea_input_dir, bathy_file), resolution, filter_type, casename,
+                                        skip_frames=1 if skip_first_frame_in_intmod else 0, weights_cache_dir=weights_cache_dir, storage=storage,
+                                        frame_tolerance=frame_tolerance, stop_when_stationary=stop_when_stationary)
+    if exit_code != 0:
+        sys.exit(failure_message('BingClaw', exit_code, timeout=bingclaw_timeout))
+    if crop_threshold is not None:
+        crop_deformation(intmod_output_dir, casename_from_intmod, crop_threshold, crop_halo, storage)
+    if not skip_first_frame_in_intmod:
+        remove_first_timestep(intmod_output_dir, casename_from_intmod, storage=storage)
+
 # Run BingClaw
-if (do_run_bingclaw):
-    run_bingclaw(bingclaw_input_dir, bingclaw_output_dir, bingclaw_bathymetry, bingclaw_scenario, image_type, image_name)
+elif (do_run_bingclaw):
+    exit_code = run_bingclaw(bingclaw_input_dir, bingclaw_output_dir, bingclaw_bathymetry, bingclaw_scenario, image_type, image_name, bingclaw_output_format, staging=staging,
+                             timeout=bingclaw_timeout)
+    if exit_code != 0:
+        sys.exit(failure_message('BingClaw', exit_code, timeout=bingclaw_timeout))
 else:
     print('Skip running BingClaw simulation because do_run_bingclaw is set to False')
 
 # Run interface module
-if (do_run_interface_module):
-    run_interface_module(bingclaw_output_dir, intmod_output_dir, hysea_input_dir, donor, bathy_file, resolution, filter_type, casename)
-    remove_first_timestep(intmod_output_dir, casename_from_intmod)
+if (streamed):
+    print('Interface Module already run while BingClaw was running because stream_intmod is set to True')
+elif (do_run_interface_module and sweep):
+    intmod_cache = IntmodCache(intmod_cache_dir) if intmod_cache_dir is not None else None
+    # BingClaw frames are read once and shared by all variants, when a variant uses their thickness
+    # (engine 'native' or frame_tolerance)
+    shared_frames = load_frames(bingclaw_output_dir) if intmod_engine == 'native' or frame_tolerance is not None else None
+    failed.update(run_variants(variants, convert_variant, cpu_workers, shared_frames))
+    if intmod_cache is not None:
+        print(intmod_cache.summary())
+elif (do_run_interface_module):
+    intmod_cache = IntmodCache(intmod_cache_dir) if intmod_cache_dir is not None else None
+    exit_code = run_interface_module(bingclaw_output_dir, intmod_output_dir, hysea_input_dir, donor, bathy_file, resolution, filter_type, casename,
+                                     skip_frames=1 if skip_first_frame_in_intmod else 0, mode=intmod_mode, cache=intmod_cache,
+                                     engine=intmod_engine, weights_cache_dir=weights_cache_dir,
+                                     kajiura_method=kajiura_method, storage=storage,
+                                     frame_tolerance=frame_tolerance, stop_when_stationary=stop_when_stationary,
+                                     crop_threshold=crop_threshold, crop_halo=crop_halo, timeout=intmod_timeout)
+    if exit_code != 0:
+        sys.exit(failure_message('Interface Module', exit_code, timeout=intmod_timeout))
+    if not skip_first_frame_in_intmod:
+        remove_first_timestep(intmod_output_dir, casename_from_intmod, storage=storage)
+    if intmod_cache is not None:
+        print(intmod_cache.summary())
 else:
     print('Skip running Interface Module because do_run_interface_module is set to False')
 
 # Run T-HySEA
-if (do_run_hysea):
-    run_hysea(hysea_input_dir, hysea_output_dir, intmod_output_dir, hysea_executable, output_time_series, pois_file, scenario, casename_from_intmod)
+if (do_run_hysea and sweep):
+    failed.update(run_variants([v for v in variants if failed.get(v['filename_prefix']) is None], simulate_variant, gpu_workers))
+elif (do_run_hysea):
+    exit_code = run_hysea(hysea_input_dir, hysea_output_dir, intmod_output_dir, hysea_executable, output_time_series, pois_file, scenario, casename_from_intmod, ranks=hysea_ranks,
+                          timeout=hysea_timeout)
+    if exit_code != 0:
+        sys.exit(failure_message('T-HySEA', exit_code, timeout=hysea_timeout))
 else:
     print('Skip running T-HySEA simulation because do_run_hysea is set to False')
 
-
-print(f"\n* Done running workflow bingclaw-to-hysea for scenario '{scenario}' with filter '{filter_type}' and resolution {resolution} m")
+# Extract time series at the POIs
+if (do_extract_pois and sweep):
+    for variant in variants:
+        if failed.get(variant['filename_prefix']) is None:
+            extract_pois(hysea_output_dir, post_output_dir, variant['filename_prefix'], os.path.join(hysea_input_dir, pois_file), poi_variables)
+elif (do_extract_pois):
+    extract_pois(hysea_output_dir, post_output_dir, casename_from_intmod, os.path.join(hysea_input_dir, pois_file), poi_variables)
+else:
+    print('Skip extracting POI time series because do_extract_pois is set to False')
+
+if (sweep):
+    print(f"\n* Done running workflow bingclaw-to-hysea for scenario '{scenario}' with {len(variants)} variants")
+    for variant in variants:
+        failure = failed.get(variant['filename_prefix'])
+        print(f"  {variant['filename_prefix']} (filter '{variant['filter_type']}', resolution {variant['resolution']} m): {'OK' if failure is None else 'FAILED (' + failure + ')'}")
+    filename_prefix = "', '".join(variant['filename_prefix'] for variant in variants)
+else:
+    print(f"\n* Done running workflow bingclaw-to-hysea for scenario '{scenario}' with filter '{filter_type}' and resolution {resolution} m")
 print(f"* BingClaw outputs are stored in {bingclaw_output_dir}")
 print(f"* Interface Module outputs are stored in {intmod_output_dir} and have prefix '{filename_prefix}'")
 print(f"* T-HySEA outputs are stored in {hysea_output_dir} and have prefix '{filename_prefix}'")
+if (do_extract_pois):
+    print(f"* POI time series are stored in {post_output_dir}")
 